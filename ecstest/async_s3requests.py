@@ -0,0 +1,666 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+
+asyncio version of s3requests, for python 3.7 and later only.
+Thousands of requests are in flight from a single thread:
+
+async def put_keys(names):
+    engine = AsyncS3Engine()
+    try:
+        await asyncio.gather(*[engine.put(url + name, data=b'x')
+                               for name in names])
+    finally:
+        await engine.close()
+
+Run a throughput check against the in-memory StandInServer with:
+# python -m ecstest.async_s3requests
+'''
+
+import asyncio
+import collections
+import os
+import ssl
+import time
+from urllib.parse import urlencode, urlsplit
+
+from requests.structures import CaseInsensitiveDict
+
+from ecstest.logger import logger
+from ecstest import config
+from ecstest import constants
+from ecstest.signer import sign
+
+cfg = config.get_config()
+
+STREAM_BLOCK_SIZE = 64 * 1024
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+# Requests whose response never has a body.
+NO_BODY_STATUS = (204, 304)
+
+
+async def _wait(aw, timeout):
+    # Like requests, timeout bounds each socket operation,
+    # not the whole request, so a long streamed body is fine.
+    if not timeout:
+        return await aw
+    return await asyncio.wait_for(aw, timeout)
+
+
+class _Connection(object):
+    '''A keep-alive connection to one scheme/host/port.'''
+    def __init__(self, key, reader, writer, timeout=None):
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.reused = False
+
+    async def wait(self, aw):
+        '''Await a read or drain of the connection, up to timeout.'''
+        return await _wait(aw, self.timeout)
+
+    def is_reusable(self):
+        return not self.reader.at_eof() and not self.writer.is_closing()
+
+    def close(self):
+        self.writer.close()
+
+
+class ConnectionPool(object):
+    '''
+    Keep-alive connections keyed by (scheme, host, port),
+    at most limit_per_host of them open to the same key.
+    Connecting, and every read or drain of a connection,
+    fails after timeout seconds.
+    '''
+    def __init__(self, limit_per_host=cfg['ASYNC_LIMIT_PER_HOST'],
+                 verify_ssl=False, timeout=None):
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.opened = 0
+        self.reused = 0
+        self._idle = collections.defaultdict(list)
+        self._slots = {}
+        self._ssl = ssl.create_default_context()
+        if not verify_ssl:
+            self._ssl.check_hostname = False
+            self._ssl.verify_mode = ssl.CERT_NONE
+
+    async def acquire(self, key):
+        '''Return an idle connection of key, or open a new one.'''
+        slots = self._slots.get(key)
+        if slots is None:
+            slots = self._slots[key] = asyncio.Semaphore(
+                self.limit_per_host)
+        await slots.acquire()
+        try:
+            idle = self._idle[key]
+            while idle:
+                conn = idle.pop()
+                if conn.is_reusable():
+                    self.reused += 1
+                    conn.reused = True
+                    return conn
+                conn.close()
+            scheme, host, port = key
+            reader, writer = await _wait(asyncio.open_connection(
+                host, port, ssl=self._ssl if scheme == 'https' else None),
+                self.timeout)
+            self.opened += 1
+            return _Connection(key, reader, writer, self.timeout)
+        except BaseException:
+            slots.release()
+            raise
+
+    def release(self, conn, reusable):
+        '''Give a connection back, it is closed unless reusable.'''
+        if reusable and conn.is_reusable():
+            self._idle[conn.key].append(conn)
+        else:
+            conn.close()
+        self._slots[conn.key].release()
+
+    def close(self):
+        for idle in self._idle.values():
+            for conn in idle:
+                conn.close()
+        self._idle.clear()
+
+
+class Response(object):
+    '''
+    The status and headers of a response. The body is in content,
+    unless the request was sent with stream=True, then it is read
+    by read() or iter_content() and the connection is given back
+    once the body is consumed or close() is called.
+    '''
+    def __init__(self, method, status_code, reason, headers, conn,
+                 on_close):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self._conn = conn
+        self._on_close = on_close
+        self._content = None
+        self._chunked = False
+        self._chunk_left = 0
+        self._remaining = None
+        self._keep_alive = \
+            headers.get('Connection', '').lower() != 'close'
+        if method == 'HEAD' or status_code in NO_BODY_STATUS:
+            self._remaining = 0
+        elif 'chunked' in headers.get(constants.TRANSFER_ENCODING,
+                                      '').lower():
+            self._chunked = True
+        elif constants.CONTENT_LENGTH in headers:
+            self._remaining = int(headers[constants.CONTENT_LENGTH])
+        else:
+            # The body ends when the server closes the connection.
+            self._keep_alive = False
+        if self._remaining == 0:
+            self._finish(True)
+
+    @property
+    def content(self):
+        if self._content is None:
+            raise Exception('the body of a streamed response is not read')
+        return self._content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception('%s %s' % (self.status_code, self.reason))
+
+    async def read(self, size=-1):
+        '''
+        Return up to size bytes of the body, or all the rest of it,
+        b'' at the end of the body.
+        '''
+        if size < 0:
+            parts = []
+            while True:
+                part = await self.read(STREAM_BLOCK_SIZE)
+                if not part:
+                    return b''.join(parts)
+                parts.append(part)
+        if self._conn is None:
+            return b''
+        try:
+            data = await self._read_some(size)
+        except BaseException:
+            self._finish(False)
+            raise
+        if not data:
+            self._finish(self._keep_alive)
+        return data
+
+    async def _read_some(self, size):
+        conn = self._conn
+        reader = conn.reader
+        if self._chunked:
+            if self._chunk_left == 0:
+                line = await conn.wait(reader.readline())
+                self._chunk_left = int(line.split(b';')[0].strip(), 16)
+                if self._chunk_left == 0:
+                    # Skip the trailers up to the empty line.
+                    while True:
+                        line = await conn.wait(reader.readline())
+                        if line in (b'\r\n', b''):
+                            break
+                    return b''
+            data = await conn.wait(reader.read(min(size, self._chunk_left)))
+            if not data:
+                raise Exception('connection closed in a chunk')
+            self._chunk_left -= len(data)
+            if self._chunk_left == 0:
+                await conn.wait(reader.readexactly(2))
+            return data
+        if self._remaining is None:
+            return await conn.wait(reader.read(size))
+        if self._remaining == 0:
+            return b''
+        data = await conn.wait(reader.read(min(size, self._remaining)))
+        if not data:
+            raise Exception('connection closed with %d bytes left'
+                            % self._remaining)
+        self._remaining -= len(data)
+        return data
+
+    async def iter_content(self, chunk_size=STREAM_BLOCK_SIZE):
+        '''Yield the body by blocks of at most chunk_size bytes.'''
+        while True:
+            data = await self.read(chunk_size)
+            if not data:
+                return
+            yield data
+
+    def _finish(self, reusable):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._on_close(conn, reusable)
+
+    def close(self):
+        '''Give the connection up without reading the rest of the body.'''
+        self._finish(False)
+
+
+def _parse_url(url, params):
+    parts = urlsplit(url)
+    scheme = (parts.scheme or 'http').lower()
+    host = parts.hostname
+    port = parts.port or DEFAULT_PORTS[scheme]
+    target = parts.path or '/'
+    # Subresources without value are already appended to url.
+    query = [parts.query] if parts.query else []
+    extra = urlencode([(k, v) for k, v in params or [] if v is not None])
+    if extra:
+        query.append(extra)
+    if query:
+        target += '?' + '&'.join(query)
+    host_header = host if port == DEFAULT_PORTS[scheme] \
+        else '%s:%d' % (host, port)
+    return (scheme, host, port), target, host_header
+
+
+def _prepare_body(method, data, headers):
+    '''
+    Return (body, blocks): body is bytes to send at once, or blocks
+    an iterable or async iterable of bytes to stream,
+    chunked when headers has no Content-Length.
+    '''
+    if data is None:
+        if method not in ('GET', 'HEAD') and \
+                constants.CONTENT_LENGTH not in headers:
+            headers[constants.CONTENT_LENGTH] = '0'
+        return b'', None
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        headers[constants.CONTENT_LENGTH] = str(len(data))
+        return data, None
+    if hasattr(data, 'read'):
+        if constants.CONTENT_LENGTH not in headers:
+            try:
+                size = os.fstat(data.fileno()).st_size - data.tell()
+                headers[constants.CONTENT_LENGTH] = str(size)
+            except (AttributeError, OSError, ValueError):
+                pass
+        blocks = iter(lambda: data.read(STREAM_BLOCK_SIZE), b'')
+    else:
+        blocks = data
+    if constants.CONTENT_LENGTH not in headers:
+        headers[constants.TRANSFER_ENCODING] = 'chunked'
+    return None, blocks
+
+
+async def _iter_blocks(blocks):
+    if hasattr(blocks, '__aiter__'):
+        async for block in blocks:
+            yield block
+    else:
+        for block in blocks:
+            yield block
+
+
+class AsyncS3Engine(object):
+    '''
+    Send requests signed as s3requests.request() does,
+    over pooled keep-alive connections.
+
+    At most max_concurrency requests are in flight, the others
+    wait for their turn, and at most limit_per_host connections
+    are open to the same host. Raise the open files limit
+    (ulimit -n) above limit_per_host times the number of hosts.
+    As with requests, timeout applies to connecting and to each read
+    or write of a connection, a request may take longer as a whole.
+    '''
+    def __init__(self, max_concurrency=cfg['ASYNC_MAX_CONCURRENCY'],
+                 limit_per_host=cfg['ASYNC_LIMIT_PER_HOST'],
+                 timeout=cfg['REQUEST_TIMEOUT'], verify_ssl=False,
+                 signature_version=None):
+        self.max_concurrency = max_concurrency
+        self.signature_version = signature_version
+        self.timeout = timeout
+        self.pool = ConnectionPool(limit_per_host, verify_ssl, timeout)
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._semaphore = None
+
+    async def request(self, method, url, access_key=None, secret_key=None,
+                      headers=None, params=None, data=None, stream=False,
+                      signature_version=None, payload_hash=None):
+        '''
+        Sign and send a request, return its Response.
+        data is bytes, a file-like object, or an iterable or async
+        iterable of bytes streamed to the server. With stream=True
+        the body of the response is left to be read by the caller.
+        signature_version, the one of the engine by default,
+        and payload_hash are the ones of s3requests.request().
+        '''
+        if signature_version is None:
+            signature_version = self.signature_version
+        url, headers, params = sign(method, url, access_key, secret_key,
+                                    headers, params,
+                                    signature_version=signature_version,
+                                    payload_hash=payload_hash, body=data)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        await self._semaphore.acquire()
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        released = []
+
+        def on_close(conn, reusable):
+            self.pool.release(conn, reusable)
+            if not released:
+                released.append(True)
+                self.in_flight -= 1
+                self._semaphore.release()
+
+        try:
+            return await self._send(method, url, headers, params, data,
+                                    stream, on_close)
+        except BaseException:
+            if not released:
+                released.append(True)
+                self.in_flight -= 1
+                self._semaphore.release()
+            raise
+
+    async def _send(self, method, url, headers, params, data, stream,
+                    on_close):
+        key, target, host_header = _parse_url(url, params)
+        headers = CaseInsensitiveDict(headers)
+        headers.setdefault('Host', host_header)
+        body, blocks = _prepare_body(method, data, headers)
+        chunked = constants.TRANSFER_ENCODING in headers
+        head = '%s %s HTTP/1.1\r\n' % (method, target)
+        head += ''.join('%s: %s\r\n' % item for item in headers.items())
+        head = (head + '\r\n').encode('latin-1')
+
+        while True:
+            conn = await self.pool.acquire(key)
+            try:
+                status_line = await self._exchange(conn, head, body,
+                                                   blocks, chunked)
+            except BaseException:
+                self.pool.release(conn, False)
+                raise
+            if status_line or not conn.reused or blocks is not None:
+                break
+            # The server closed the idle connection, resend on a new one.
+            logger.debug('retry %s %s on a new connection', method, url)
+            self.pool.release(conn, False)
+
+        try:
+            if not status_line:
+                raise Exception('connection closed before the response')
+            response = await self._read_head(conn, method, status_line,
+                                             on_close)
+        except BaseException:
+            self.pool.release(conn, False)
+            raise
+        # From now on the response gives the connection back.
+        if not stream:
+            response._content = await response.read()
+        return response
+
+    async def _exchange(self, conn, head, body, blocks, chunked):
+        # Send the request and return the status line of the response.
+        conn.writer.write(head + body if body else head)
+        if blocks is not None:
+            async for block in _iter_blocks(blocks):
+                if not block:
+                    continue
+                if chunked:
+                    conn.writer.write(b'%x\r\n' % len(block))
+                    conn.writer.write(block)
+                    conn.writer.write(b'\r\n')
+                else:
+                    conn.writer.write(block)
+                await conn.wait(conn.writer.drain())
+            if chunked:
+                conn.writer.write(b'0\r\n\r\n')
+        await conn.wait(conn.writer.drain())
+        while True:
+            status_line = await conn.wait(conn.reader.readline())
+            if not status_line.startswith(b'HTTP/1.1 1'):
+                return status_line
+            # Skip the headers of an interim response, e.g. 100-continue.
+            while True:
+                line = await conn.wait(conn.reader.readline())
+                if line in (b'\r\n', b''):
+                    break
+
+    async def _read_head(self, conn, method, status_line, on_close):
+        parts = status_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        status = int(parts[1])
+        reason = parts[2] if len(parts) > 2 else ''
+        headers = CaseInsensitiveDict()
+        while True:
+            line = await conn.wait(conn.reader.readline())
+            if line in (b'\r\n', b''):
+                break
+            name, value = line.decode('latin-1').split(':', 1)
+            headers[name.strip()] = value.strip()
+        return Response(method, status, reason, headers, conn,
+                        on_close)
+
+    async def get(self, url, access_key=None, secret_key=None, **kwargs):
+        return await self.request('GET', url, access_key, secret_key,
+                                  **kwargs)
+
+    async def put(self, url, access_key=None, secret_key=None, **kwargs):
+        return await self.request('PUT', url, access_key, secret_key,
+                                  **kwargs)
+
+    async def head(self, url, access_key=None, secret_key=None, **kwargs):
+        return await self.request('HEAD', url, access_key, secret_key,
+                                  **kwargs)
+
+    async def delete(self, url, access_key=None, secret_key=None,
+                     **kwargs):
+        return await self.request('DELETE', url, access_key, secret_key,
+                                  **kwargs)
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+            'connections_opened': self.pool.opened,
+            'reuse_count': self.pool.reused,
+        }
+
+    async def close(self):
+        self.pool.close()
+        # get_engine() creates a new engine for the loop, if any.
+        for loop, engine in list(_engines.items()):
+            if engine is self:
+                del _engines[loop]
+
+
+class StandInServer(object):
+    '''
+    A minimal in-memory S3 server storing the bodies of PUT requests,
+    to exercise the engine without ECS. Signatures are not checked.
+    '''
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.objects = {}
+        self.requests = 0
+        self._server = None
+        self._handlers = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host,
+                                                  self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return 'http://%s:%d' % (self.host, self.port)
+
+    async def stop(self):
+        self._server.close()
+        # Handlers of keep-alive connections wait for the next request.
+        for task in list(self._handlers):
+            task.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                method, target, _ = request_line.decode().split(' ', 2)
+                headers = CaseInsensitiveDict()
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b''):
+                        break
+                    name, value = line.decode().split(':', 1)
+                    headers[name.strip()] = value.strip()
+                body = await self._read_body(reader, headers)
+                self.requests += 1
+                status, out = self._handle(method, target.split('?')[0],
+                                           body)
+                if method == 'HEAD':
+                    length, out = len(out), b''
+                else:
+                    length = len(out)
+                writer.write(b'HTTP/1.1 %d OK\r\nContent-Length: %d\r\n\r\n'
+                             % (status, length) + out)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError,
+                asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+            self._handlers.discard(task)
+
+    async def _read_body(self, reader, headers):
+        if 'chunked' in headers.get(constants.TRANSFER_ENCODING, ''):
+            parts = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    return b''.join(parts)
+                parts.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+        length = int(headers.get(constants.CONTENT_LENGTH, 0))
+        return await reader.readexactly(length) if length else b''
+
+    def _handle(self, method, path, body):
+        if method == 'PUT':
+            self.objects[path] = body
+            return 200, b''
+        if method == 'DELETE':
+            self.objects.pop(path, None)
+            return 204, b''
+        if path not in self.objects:
+            return 404, b''
+        return 200, self.objects[path]
+
+
+async def put_throughput(count=10000, size=1024):
+    '''
+    Return how many PUT requests per second of size bytes
+    the engine sends to a StandInServer, count at a time.
+    '''
+    server = StandInServer()
+    url = await server.start()
+    engine = AsyncS3Engine(max_concurrency=count)
+    body = b'x' * size
+    start = time.time()
+    try:
+        responses = await asyncio.gather(
+            *[engine.put('%s/bucket/key%d' % (url, i), 'key', 'secret',
+                         data=body)
+              for i in range(count)])
+    finally:
+        await engine.close()
+        await server.stop()
+    elapsed = time.time() - start
+    if any(response.status_code != 200 for response in responses):
+        raise Exception('a PUT to the stand-in server failed')
+    logger.debug('engine stats: %s', engine.stats())
+    return count / elapsed
+
+
+# The engine of each event loop. An engine refers to its loop through
+# its semaphore and connections, so the entry is dropped when the engine
+# is closed, or when get_engine() finds its loop closed.
+_engines = {}
+
+
+def get_engine():
+    '''Return the engine shared by the coroutines of the running loop.'''
+    loop = asyncio.get_event_loop()
+    for closed in [key for key in _engines if key.is_closed()]:
+        # Its connections cannot be closed without the loop.
+        del _engines[closed]
+    engine = _engines.get(loop)
+    if engine is None:
+        engine = _engines[loop] = AsyncS3Engine()
+    return engine
+
+
+async def get(url, access_key=None, secret_key=None, **kwargs):
+    return await get_engine().get(url, access_key, secret_key, **kwargs)
+
+
+async def put(url, access_key=None, secret_key=None, **kwargs):
+    return await get_engine().put(url, access_key, secret_key, **kwargs)
+
+
+async def head(url, access_key=None, secret_key=None, **kwargs):
+    return await get_engine().head(url, access_key, secret_key, **kwargs)
+
+
+async def delete(url, access_key=None, secret_key=None, **kwargs):
+    return await get_engine().delete(url, access_key, secret_key, **kwargs)
+
+
+async def request(method, url, access_key=None, secret_key=None, **kwargs):
+    return await get_engine().request(method, url, access_key, secret_key,
+                                      **kwargs)
+
+
+async def close():
+    '''Close the engine of the running loop, before closing the loop.'''
+    engine = _engines.get(asyncio.get_event_loop())
+    if engine is not None:
+        await engine.close()
+
+
+def main():
+    loop = asyncio.new_event_loop()
+    try:
+        rate = loop.run_until_complete(put_throughput())
+    finally:
+        loop.close()
+    print('%-45s %10.2f' % ('async PUT of 1KB requests/s', rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+
+Micro-benchmarks of client side helpers, run them with:
+# python -m ecstest.benchmark
+'''
+
+import contextlib
+import time
+from email.utils import formatdate
+
+import requests
+from boto.s3.bucket import Bucket
+from boto.s3.connection import S3Connection
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util import parse_url
+
+from ecstest.logger import logger
+from ecstest import config
+from ecstest import constants
+from ecstest import filehelper
+from ecstest import post
+from ecstest import s3requests
+from ecstest import sessionpool
+from ecstest import signer
+
+cfg = config.get_config()
+
+GB = float(constants.ECS_1GB_OBJ_SIZE)
+# Requests to this endpoint are answered by _NullAdapter.
+NULL_ENDPOINT = 'http://ecstest.invalid:9020/'
+
+
+def pseudofile_throughput(size=constants.ECS_1GB_OBJ_SIZE,
+                          read_size=constants.ECS_1MB_OBJ_SIZE,
+                          compute_md5=False):
+    '''
+    Return how many GB/s of PseudoFile data are generated
+    by readinto() calls of read_size bytes.
+    '''
+    pseudofile = filehelper.PseudoFile(size, compute_md5=compute_md5)
+    buff = bytearray(read_size)
+    start = time.time()
+    while pseudofile.readinto(buff):
+        pass
+    return size / GB / (time.time() - start)
+
+
+def pseudofile_read_throughput(size=constants.ECS_1GB_OBJ_SIZE,
+                               read_size=constants.ECS_1MB_OBJ_SIZE,
+                               compute_md5=False):
+    '''
+    Return how many GB/s of PseudoFile data are returned
+    by read() calls of read_size bytes.
+    '''
+    pseudofile = filehelper.PseudoFile(size, compute_md5=compute_md5)
+    start = time.time()
+    while pseudofile.read(read_size):
+        pass
+    return size / GB / (time.time() - start)
+
+
+def _sign_rate(sign, count):
+    url = 'http://127.0.0.1:9020/bucket/key'
+    headers = {'Content-Type': 'application/octet-stream',
+               'x-amz-meta-name': 'value'}
+    params = {'acl': None}
+    start = time.time()
+    for _ in range(count):
+        sign('PUT', url, 'access_key', 'secret_key', headers, params)
+    return count / (time.time() - start)
+
+
+def _legacy_sign_request(method, url, access_key=None, secret_key=None,
+                         headers=None, params=None):
+    # signer.sign_request() as it was before SigV2Signer,
+    # to measure the signer against it.
+    if access_key is None:
+        access_key = cfg['ACCESS_KEY']
+    if secret_key is None:
+        secret_key = cfg['ACCESS_SECRET']
+    logger.debug('access_key: %s, secret_key: %s', access_key, secret_key)
+
+    if headers is not None:
+        headers = headers.copy()
+    else:
+        headers = {}
+
+    if not signer.find_matching_headers(constants.DATE, headers):
+        headers[constants.DATE] = formatdate(usegmt=True)
+
+    string_to_sign, url, params = _legacy_get_string_to_sign(
+        method, url, headers, headers[constants.DATE], params)
+
+    headers[constants.AUTHORIZATION] = 'AWS %s:%s' % (
+        access_key, signer.get_signature(secret_key, string_to_sign))
+    logger.debug('headers is ' + repr(headers))
+
+    return url, headers, params
+
+
+def _legacy_get_string_to_sign(method, url, headers, date_or_expires,
+                               params):
+    # Return the SigV2 string to sign, url with the subresources
+    # without value appended, and the sorted list of params.
+    string_to_sign = '%s\n' % method
+    if signer.find_matching_headers(constants.CONTENT_MD5, headers):
+        string_to_sign += '%s\n' % headers[constants.CONTENT_MD5]
+    else:
+        string_to_sign += '\n'
+
+    if signer.find_matching_headers(constants.CONTENT_TYPE, headers):
+        string_to_sign += '%s\n' % headers[constants.CONTENT_TYPE]
+    else:
+        string_to_sign += '\n'
+
+    string_to_sign += date_or_expires + '\n'
+
+    # Sort canonicalizedAmzHeaders by name
+    amz_keys = [h for h in headers if h.lower().startswith('x-amz-')]
+    amz_keys.sort()
+    for key in amz_keys:
+        string_to_sign += '%s:%s\n' % (key, headers[key].strip())
+
+    canonicalized_resource = ''
+
+    # The subresources that must be included
+    # when constructing the CanonicalizedResource
+    # for calculating signature.
+    subresources = ['acl', 'lifecycle', 'location', 'logging',
+                    'notification', 'partNumber', 'policy',
+                    'requestPayment', 'torrent', 'uploadId',
+                    'uploads', 'versionId', 'versioning',
+                    'versions', 'website']
+
+    _, _, _, _, path, _, _ = parse_url(url)
+
+    if not path:
+        path = '/'
+
+    canonicalized_resource += path
+
+    if params is not None:
+        params = params.copy()
+    else:
+        params = {}
+
+    subresource_without_value = []
+    subresource_to_sign = []
+
+    # Sort subresource by name, otherwise signature will not match.
+    # If the value of key in dict params is none, e.g. ?acl,
+    # it will not be appended to query string by requests parsing.
+    # So need to pick it up from params to query string by manual.
+    params = sorted(params.items(), key=lambda d: d[0])
+    for key, value in params:
+        if key in subresources:
+            # subresource has value
+            if value is not None:
+                subresource_to_sign.append('%s=%s' % (key, value))
+            else:
+                subresource_to_sign.append('%s' % key)
+                subresource_without_value.append('%s' % key)
+        else:
+            if value is None:
+                subresource_without_value.append('%s' % key)
+
+    if subresource_to_sign:
+        canonicalized_resource += '?'
+        canonicalized_resource += '&'.join(subresource_to_sign)
+
+    if subresource_without_value:
+        url += '?'
+        url += '&'.join(subresource_without_value)
+
+    string_to_sign += canonicalized_resource
+    logger.debug('string to sign:\n%s', string_to_sign)
+    logger.debug('request url:\n%s', url)
+    return string_to_sign, url, params
+
+
+def sigv2_sign_rate(count=20000, legacy=False):
+    '''
+    Return how many requests per second are signed with SigV2,
+    by SigV2Signer or by the string to sign code it replaced.
+    '''
+    if legacy:
+        return _sign_rate(_legacy_sign_request, count)
+    return _sign_rate(signer.sign_request, count)
+
+
+def sigv4_sign_rate(count=20000, cache_keys=True):
+    '''
+    Return how many requests per second are signed with SigV4
+    (UNSIGNED-PAYLOAD), with or without the signing key cache.
+    '''
+    sigv4 = signer.SigV4Signer(max_cached_keys=64 if cache_keys else 0)
+
+    def sign(method, url, access_key, secret_key, headers, params):
+        return sigv4.sign_request(method, url, access_key, secret_key,
+                                  headers, params,
+                                  payload_hash=signer.UNSIGNED_PAYLOAD)
+    return _sign_rate(sign, count)
+
+
+def presign_rate(count=20000, signature_version=4, processes=0):
+    '''Return how many urls per second presign_batch() presigns.'''
+    key_names = ['key%d' % i for i in range(count)]
+    start = time.time()
+    s3requests.presign_batch('GET', 'http://127.0.0.1:9020/bucket',
+                             key_names, 'access_key', 'secret_key',
+                             signature_version=signature_version,
+                             processes=processes)
+    return count / (time.time() - start)
+
+
+class _NullAdapter(HTTPAdapter):
+    '''Answer every request with an empty 200, without any I/O.'''
+    def send(self, request, **kwargs):
+        response = requests.models.Response()
+        response.status_code = 200
+        response.request = request
+        response.url = request.url
+        response._content = b''
+        return response
+
+
+@contextlib.contextmanager
+def _null_transport():
+    # Mount _NullAdapter on the pooled session of NULL_ENDPOINT
+    # for the block only, later requests are left alone.
+    session = sessionpool.get_session(NULL_ENDPOINT)
+    previous = session.adapters.get(NULL_ENDPOINT)
+    session.mount(NULL_ENDPOINT, _NullAdapter())
+    try:
+        yield
+    finally:
+        if previous is None:
+            del session.adapters[NULL_ENDPOINT]
+        else:
+            session.mount(NULL_ENDPOINT, previous)
+
+
+def request_overhead_rate(count=20000, signature_version=2,
+                          legacy_signer=False):
+    '''
+    Return how many requests per second s3requests.request() sends
+    to a server answering at once, i.e. its client side CPU cost.
+    legacy_signer signs SigV2 requests with the string to sign code
+    SigV2Signer replaced, to compare the two.
+    '''
+    url = NULL_ENDPOINT + 'bucket/key'
+    headers = {'Content-Type': 'application/octet-stream',
+               'x-amz-meta-name': 'value'}
+    sign_request = signer.sign_request
+    if legacy_signer:
+        signer.sign_request = _legacy_sign_request
+    try:
+        with _null_transport():
+            start = time.time()
+            for _ in range(count):
+                s3requests.put(url, 'access_key', 'secret_key',
+                               headers=headers, params={'acl': None},
+                               signature_version=signature_version)
+            return count / (time.time() - start)
+    finally:
+        signer.sign_request = sign_request
+
+
+def post_overhead_rate(count=5000, reuse_policy=True, signature_version=4):
+    '''
+    Return how many POST uploads per second are sent to a server
+    answering at once, with a PostPolicy signed once, or with
+    a policy built and signed for every POST as post_from_string() does.
+    '''
+    connection = S3Connection('access_key', 'secret_key', is_secure=False,
+                              host='ecstest.invalid', port=9020)
+    bucket = Bucket(connection, 'bucket')
+    policy = post.PostPolicy(bucket, key_prefix='key',
+                             signature_version=signature_version)
+    with _null_transport():
+        start = time.time()
+        for i in range(count):
+            if reuse_policy:
+                policy.post('key%d' % i, content='data')
+            else:
+                post.post_from_string(bucket, 'key%d' % i, 'data',
+                                      signature_version=signature_version)
+        return count / (time.time() - start)
+
+
+def main():
+    results = [
+        ('PseudoFile readinto() GB/s', pseudofile_throughput()),
+        ('PseudoFile read() GB/s', pseudofile_read_throughput()),
+        ('PseudoFile readinto() with MD5 GB/s',
+         pseudofile_throughput(compute_md5=True)),
+        ('SigV2 signatures/s before SigV2Signer',
+         sigv2_sign_rate(legacy=True)),
+        ('SigV2 signatures/s', sigv2_sign_rate()),
+        ('SigV4 signatures/s', sigv4_sign_rate()),
+        ('SigV2 s3requests.request() requests/s before SigV2Signer',
+         request_overhead_rate(legacy_signer=True)),
+        ('SigV2 s3requests.request() requests/s',
+         request_overhead_rate()),
+        ('SigV4 s3requests.request() requests/s',
+         request_overhead_rate(signature_version=4)),
+        ('SigV4 signatures/s without key cache',
+         sigv4_sign_rate(cache_keys=False)),
+        ('SigV2 presigned urls/s', presign_rate(signature_version=2)),
+        ('SigV4 presigned urls/s', presign_rate()),
+        ('SigV4 presigned urls/s with 4 processes',
+         presign_rate(processes=4)),
+        ('POST uploads/s with a policy per POST',
+         post_overhead_rate(reuse_policy=False)),
+        ('POST uploads/s with a reused PostPolicy', post_overhead_rate()),
+    ]
+    for name, value in results:
+        print('%-45s %10.2f' % (name, value))
+
+
+if __name__ == '__main__':
+    main()
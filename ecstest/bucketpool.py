@@ -0,0 +1,213 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import atexit
+import threading
+
+from boto.s3.connection import S3Connection
+from boto.s3.connection import OrdinaryCallingFormat
+
+from ecstest.logger import logger
+from ecstest import bucketname
+from ecstest import config
+from ecstest import constants
+from ecstest import utils
+from ecstest import workerpool
+
+cfg = config.get_config()
+
+
+class BucketPool(object):
+    '''
+    A pool of empty buckets leased to tests instead of creating
+    and deleting a bucket in every test.
+
+    Buckets are created concurrently by start(). A bucket given back
+    by release() is emptied by a background worker and then returned
+    to the pool, so the next test doesn't wait for it. A bucket which
+    had versioning enabled, or which fails to be emptied, is deleted
+    and replaced by a new one.
+
+    Only keys, versions and the ACL are reset, a test changing
+    other bucket settings (lifecycle, policy, CORS, ...) must ask
+    EcsDataPlaneTestBase.setUp() for a fresh bucket.
+    '''
+    def __init__(self, size=cfg['BUCKET_POOL_SIZE'],
+                 target=cfg['TEST_TARGET'],
+                 num_workers=constants.DEFAULT_THREAD_NUMBER,
+                 lease_timeout=cfg['REQUEST_TIMEOUT']):
+        self.size = size
+        self.target = target
+        self.lease_timeout = lease_timeout
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._buckets = set()
+        self._recycling = 0
+        self._local = threading.local()
+        self._workers = workerpool.WorkerPool(num_workers,
+                                              name='ecstest-bucket-pool')
+        self._started = False
+        self._destroyed = False
+
+    def _get_conn(self):
+        # boto connections are not shared between threads.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = S3Connection(aws_access_key_id=cfg['ACCESS_KEY'],
+                                aws_secret_access_key=cfg['ACCESS_SECRET'],
+                                is_secure=cfg['ACCESS_SSL'],
+                                port=cfg['ACCESS_PORT'],
+                                host=cfg['ACCESS_SERVER'],
+                                calling_format=OrdinaryCallingFormat())
+            self._local.conn = conn
+        return conn
+
+    def _create_bucket(self):
+        name = bucketname.get_unique_bucket_name('pool')
+        self._get_conn().create_bucket(name)
+        with self._lock:
+            self._buckets.add(name)
+        logger.debug('bucket pool created bucket %s', name)
+        return name
+
+    def _delete_bucket(self, name):
+        with self._lock:
+            self._buckets.discard(name)
+        try:
+            bucket = self._get_conn().get_bucket(name, validate=False)
+            utils.delete_keys(bucket, self.target)
+            self._get_conn().delete_bucket(name)
+        except Exception as err:
+            logger.warn('bucket pool failed to delete bucket %s: %s',
+                        name, err)
+
+    def start(self):
+        '''Create the buckets of the pool concurrently.'''
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        tasks = [self._workers.submit(self._create_bucket)
+                 for _ in range(self.size)]
+        for task in tasks:
+            self._idle.put(task.result())
+
+    def lease(self):
+        '''
+        Return the name of an empty bucket for the exclusive use
+        of the caller until it is released.
+        '''
+        self.start()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            recycling = self._recycling
+        if recycling:
+            # A bucket will be back soon, cheaper than creating one.
+            try:
+                return self._idle.get(timeout=self.lease_timeout)
+            except queue.Empty:
+                pass
+        logger.debug('bucket pool is exhausted, create a new bucket')
+        return self._create_bucket()
+
+    def release(self, name):
+        '''
+        Give a leased bucket back, it is emptied in the background.
+        '''
+        with self._lock:
+            self._recycling += 1
+        self._workers.submit(self._recycle, name)
+
+    def _recycle(self, name):
+        try:
+            name = self._empty(name)
+            # Back in the queue before it stops being counted as
+            # recycling, so lease() waits for it instead of creating one.
+            if name is not None:
+                self._idle.put(name)
+        finally:
+            with self._lock:
+                self._recycling -= 1
+
+    def _empty(self, name):
+        # Return the name of an empty bucket replacing name, or None.
+        try:
+            conn = self._get_conn()
+            bucket = conn.get_bucket(name, validate=False)
+            versioned = self.target != constants.TARGET_FAKES3 and \
+                bool(bucket.get_versioning_status())
+            if versioned:
+                # Versioning can only be suspended, not disabled.
+                self._delete_bucket(name)
+                return self._create_bucket()
+            utils.delete_keys(bucket, self.target, versions=False)
+            if self.target != constants.TARGET_FAKES3:
+                bucket.set_canned_acl('private')
+            return name
+        except Exception as err:
+            logger.warn('bucket pool failed to recycle bucket %s: %s',
+                        name, err)
+            self._delete_bucket(name)
+            try:
+                return self._create_bucket()
+            except Exception as err:
+                logger.warn('bucket pool failed to create a bucket: %s', err)
+                return None
+
+    def destroy(self):
+        '''
+        Wait for the buckets being recycled,
+        then delete every bucket of the pool, leased or not.
+        '''
+        with self._lock:
+            if self._destroyed:
+                return
+            self._destroyed = True
+        self._workers.shutdown()
+        with self._lock:
+            names = list(self._buckets)
+        with workerpool.WorkerPool(name='ecstest-bucket-pool') as workers:
+            for name in names:
+                workers.submit(self._delete_bucket, name)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def is_enabled():
+    '''The pool is used when ECSTEST_BUCKET_POOL_SIZE is positive.'''
+    return cfg['BUCKET_POOL_SIZE'] > 0
+
+
+def get_pool():
+    '''
+    Return the process-wide bucket pool, created on first use
+    and destroyed when the test run exits.
+    '''
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BucketPool()
+            atexit.register(_pool.destroy)
+    return _pool
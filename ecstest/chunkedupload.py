@@ -18,18 +18,35 @@ try:
 except ImportError:
     import http.client as hlib
 
+import hashlib
+import os
 import time
 import urllib
 
+import requests
+import six
 from boto.utils import find_matching_headers
 from boto import UserAgent
+from requests.packages.urllib3.util import parse_url
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
 
 from ecstest.logger import logger
+from ecstest import config
 from ecstest import constants
 from ecstest import filehelper
-from ecstest import s3requests
+from ecstest import signer
 from ecstest.utils import get_signature
 
+cfg = config.get_config()
+
+# Most bytes read from a file at once when streaming chunks.
+STREAM_BLOCK_SIZE = constants.ECS_1MB_OBJ_SIZE
+# Size of the chunks of aws-chunked uploads,
+# S3 requires at least 8KB but for the last chunk.
+AWS_CHUNK_SIZE = 64 * constants.ECS_1KB_OBJ_SIZE
+AWS_CHUNK_SIGNATURE = ';chunk-signature='
+
 
 def upload_file(bucket, key_name, filename, chunk_size_list=None):
     '''
@@ -40,8 +57,9 @@ def upload_file(bucket, key_name, filename, chunk_size_list=None):
 
 def upload_strings(bucket, key_name, strings):
     '''
-    :param strings: a list of string
+    :param strings: a list of string, or any iterable yielding strings
     Upload key contents of chunked transfer encoding from strings.
+    Each string is sent as one chunk.
     '''
     return _upload_chunk(bucket, key_name, content=strings)
 
@@ -51,6 +69,8 @@ def _upload_chunk(bucket, key_name,
     '''
     Upload key contents of chunked transfer encoding
     from file or string content.
+    The chunks are encoded on the fly and written to the socket
+    as they are produced, so memory usage doesn't grow with the object.
     '''
     headers = {}
     headers[constants.TRANSFER_ENCODING] = 'chunked'
@@ -65,47 +85,197 @@ def _upload_chunk(bucket, key_name,
         # that may affect top level.
         chunk_size_list = chunk_size_list[:]
 
-    data = ''
+    # The body is streamed, so it is never hashed for SigV4.
+    url, headers, _ = signer.sign('PUT', url, headers=headers,
+                                  payload_hash=signer.UNSIGNED_PAYLOAD)
 
     # Upload chunk from file.
-    # TODO: need to enhance when upload so large file, should use virtual file
     if filepath is not None:
         with open(filepath, 'rb') as fp:
-            while True:
-                chunk_size = _pick_chunk_size(chunk_size_list)
-                if chunk_size > 0:
-                    chunk = fp.read(chunk_size)
-                    if not chunk:
-                        break
-                    data = _add_chunk_block(data, chunk)
-                # It has no chance to send invalid chunk_size(such as 0 or -1)
-                # to ECS, because file read will eat it.
-                # So send the invalid size with test data directly to ECS,
-                # to test the negative scenario.
-                else:
-                    data += '%x\r\n' % chunk_size
-                    data += '1234567890\r\n'
+            return _stream_request(bucket, 'PUT', url, headers,
+                                   iter_file_chunks(fp, chunk_size_list))
+
     # Upload chunk from string.
-    elif content is not None:
-        for chunk in content:
-            data = _add_chunk_block(data, chunk)
+    if content is None:
+        content = []
+    return _stream_request(bucket, 'PUT', url, headers,
+                           iter_content_chunks(content))
 
-    data += '0\r\n'
-    data += '\r\n'
 
-    response = s3requests.put(url, data=data, headers=headers)
+def upload_aws_chunked(bucket, key_name, filepath=None, length=None,
+                       seed=0, chunk_size=AWS_CHUNK_SIZE, headers=None):
+    '''
+    Upload key contents with the aws-chunked encoding of SigV4
+    (STREAMING-AWS4-HMAC-SHA256-PAYLOAD) from filepath, or from a
+    PseudoFile of length bytes generated from seed if filepath is None.
+    Each chunk is signed as it is read and sent, so memory usage is
+    bounded by chunk_size and the payload is never hashed up front.
+    Return the pseudofile, or None, together with the response.
+    '''
+    if headers is not None:
+        headers = headers.copy()
+    else:
+        headers = {}
+    url = "http://%s:%s/%s/%s" % (bucket.connection.host,
+                                  bucket.connection.port,
+                                  bucket.name,
+                                  key_name)
 
-    return response
+    pseudofile = None
+    if filepath is not None:
+        fp = open(filepath, 'rb')
+        length = _remaining_size(fp)
+    else:
+        fp = pseudofile = filehelper.PseudoFile(length, seed=seed)
+
+    try:
+        headers['Content-Encoding'] = 'aws-chunked'
+        headers['x-amz-decoded-content-length'] = str(length)
+        headers[constants.CONTENT_LENGTH] = \
+            str(aws_chunked_length(length, chunk_size))
+
+        access_key = bucket.connection.provider.access_key
+        secret_key = bucket.connection.provider.secret_key
+        url, headers, _ = signer.sign_request_v4(
+            'PUT', url, access_key, secret_key, headers,
+            payload_hash=signer.STREAMING_PAYLOAD)
+        seed_signature = headers['Authorization'].rsplit('Signature=', 1)[1]
+
+        chunks = iter_aws_chunks(fp, length, secret_key,
+                                 headers['x-amz-date'], seed_signature,
+                                 chunk_size)
+        return pseudofile, _stream_request(bucket, 'PUT', url, headers,
+                                           chunks)
+    finally:
+        fp.close()
 
 
-def _add_chunk_block(data, chunk):
+def aws_chunked_length(length, chunk_size=AWS_CHUNK_SIZE):
+    '''
+    Return the Content-Length of the aws-chunked encoding
+    of length bytes in chunks of chunk_size bytes.
+    '''
+    def encoded_size(size):
+        # hex size;chunk-signature=64 hex digits\r\ndata\r\n
+        return len('%x' % size) + len(AWS_CHUNK_SIGNATURE) + 64 + \
+            2 + size + 2
+
+    full_chunks, last_size = divmod(length, chunk_size)
+    total = full_chunks * encoded_size(chunk_size) + encoded_size(0)
+    if last_size:
+        total += encoded_size(last_size)
+    return total
+
+
+def iter_aws_chunks(fp, length, secret_key, amz_date, seed_signature,
+                    chunk_size=AWS_CHUNK_SIZE):
+    '''
+    Generate the aws-chunked encoding of length bytes read from fp,
+    each chunk signed with the signature of the previous one,
+    starting with seed_signature, the signature of the request.
+    '''
+    sigv4 = signer.get_sigv4_signer()
+    signature = seed_signature
+    while True:
+        size = min(chunk_size, length)
+        chunk = fp.read(size) if size else b''
+        if len(chunk) != size:
+            raise Exception('file %s is truncated while uploading'
+                            % getattr(fp, 'name', fp))
+        signature = sigv4.sign_chunk(secret_key, amz_date, signature,
+                                     hashlib.sha256(chunk).hexdigest())
+        yield ('%x%s%s\r\n' % (size, AWS_CHUNK_SIGNATURE,
+                               signature)).encode('ascii')
+        if size == 0:
+            # The empty chunk signs the end of the body.
+            yield b'\r\n'
+            return
+        yield chunk
+        yield b'\r\n'
+        length -= size
+
+
+def iter_file_chunks(fp, chunk_size_list=None):
+    '''
+    Generate the chunked transfer encoding of a file object
+    or a filehelper.PseudoFile.
+    Chunk sizes are picked by _pick_chunk_size() from chunk_size_list.
+    A chunk larger than STREAM_BLOCK_SIZE is read and yielded
+    block by block, so memory usage is bounded whatever the chunk size is.
+    '''
+    if chunk_size_list is None:
+        chunk_size_list = []
+    while True:
+        chunk_size = _pick_chunk_size(chunk_size_list)
+        if chunk_size > 0:
+            remain = _remaining_size(fp)
+            if remain is None:
+                # Not a regular file, the size of the last chunk
+                # is only known after reading it.
+                chunk = fp.read(chunk_size)
+                if not chunk:
+                    break
+                yield _encode_chunk(chunk)
+                continue
+
+            size = min(chunk_size, remain)
+            if size == 0:
+                break
+            if size <= STREAM_BLOCK_SIZE:
+                yield _encode_chunk(fp.read(size))
+                continue
+
+            yield ('%x\r\n' % size).encode('ascii')
+            while size > 0:
+                block = fp.read(min(size, STREAM_BLOCK_SIZE))
+                if not block:
+                    raise Exception('file %s is truncated while uploading'
+                                    % getattr(fp, 'name', fp))
+                yield block
+                size -= len(block)
+            yield b'\r\n'
+        # It has no chance to send invalid chunk_size(such as 0 or -1)
+        # to ECS, because file read will eat it.
+        # So send the invalid size with test data directly to ECS,
+        # to test the negative scenario.
+        else:
+            yield ('%x\r\n' % chunk_size).encode('ascii')
+            yield b'1234567890\r\n'
+    yield b'0\r\n\r\n'
+
+
+def iter_content_chunks(content):
+    '''
+    Generate the chunked transfer encoding of an iterable of strings,
+    one chunk per string.
+    '''
+    for chunk in content:
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('utf-8')
+        yield _encode_chunk(chunk)
+    yield b'0\r\n\r\n'
+
+
+def _encode_chunk(chunk):
     ''' Encode data for chunked uploads. More details please refer to:
     http://en.wikipedia.org/wiki/Chunked_transfer_encoding
     '''
-    data += '%x\r\n' % len(chunk)
-    data += chunk
-    data += '\r\n'
-    return data
+    return b''.join([('%x\r\n' % len(chunk)).encode('ascii'),
+                     chunk,
+                     b'\r\n'])
+
+
+def _remaining_size(fp):
+    '''
+    Return how many bytes are left to read in a file object,
+    or None if it can't be told.
+    '''
+    if isinstance(fp, filehelper.PseudoFile):
+        return fp.filesize - fp.tell()
+    try:
+        return os.fstat(fp.fileno()).st_size - fp.tell()
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
 
 
 def _pick_chunk_size(chunk_size_list):
@@ -123,19 +293,62 @@ def _pick_chunk_size(chunk_size_list):
     return chunk_size
 
 
+def _get_http_connection(bucket):
+    '''
+    Return a connected http client to the endpoint of bucket.
+    '''
+    host = bucket.connection.host
+    port = bucket.connection.port
+    if bucket.connection.is_secure:
+        http = hlib.HTTPSConnection(host, port)
+    else:
+        http = hlib.HTTPConnection(host, port)
+    http.connect()
+    return http
+
+
+def _stream_request(bucket, method, url, headers, pieces):
+    '''
+    Send a request whose body is written piece by piece
+    from an iterable of bytes, as soon as each piece is produced.
+    Return a requests.Response so that callers get the same
+    response object as from s3requests.
+    '''
+    _, _, _, _, path, query, _ = parse_url(url)
+    request_resource = path or '/'
+    if query:
+        request_resource += '?' + query
+
+    http = _get_http_connection(bucket)
+    try:
+        http.putrequest(method, request_resource)
+        for k, v in headers.items():
+            http.putheader(k, v)
+        http.endheaders()
+
+        for piece in pieces:
+            http.send(piece)
+
+        resp = http.getresponse()
+        response = requests.Response()
+        response.status_code = resp.status
+        response.reason = resp.reason
+        response.headers = CaseInsensitiveDict(resp.getheaders())
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = url
+        response._content = resp.read()
+    finally:
+        http.close()
+    return response
+
+
 def _make_request(bucket, method, request_resource, headers, data):
     '''
     Set http client and request typically for POST
     since boto doesn't support POST method.
     '''
-    host = bucket.connection.host
-    port = bucket.connection.port
+    http = _get_http_connection(bucket)
     try:
-        if bucket.connection.is_secure:
-            http = hlib.HTTPSConnection(host, port)
-        else:
-            http = hlib.HTTPConnection(host, port)
-        http.connect()
         http.putrequest(method, request_resource)
         for k, v in headers.items():
             http.putheader(k, v)
@@ -144,22 +357,38 @@ def _make_request(bucket, method, request_resource, headers, data):
         # TODO: should refine PseudoFile act as a file object
         if isinstance(data, filehelper.PseudoFile):
             data.send(http)
-        else:
+        elif isinstance(data, six.text_type):
+            http.send(data.encode('utf-8'))
+        elif isinstance(data, bytes):
             http.send(data)
+        else:
+            # An iterable such as a chunk encoder, send as produced.
+            for piece in data:
+                http.send(piece)
         resp = http.getresponse()
-    except hlib.HTTPException as e:
-        logger.exception('exception occur: %s ', e.message)
-    except Exception as e:
+    except Exception:
+        # Raise the error itself, a large upload may be resumed
+        # from it, see multipart.ResumableUploader.
         logger.exception('http request failed')
+        raise
     finally:
         http.close()
     return resp
 
 
-# TODO: need to implement chunk upload with pseudo file if has requirement.
 def upload_pseudo_file(bucket, key_name, length,
                        chunk_size_list=None, **kwargs):
     '''Set contents of key from pseudofile with large size.
+    If chunk_size_list is not None, upload with chunked transfer encoding,
+    the chunks being generated from the pseudofile as they are sent.
+    An empty list uploads with the default chunk size.
+    Return the pseudofile, whose md5_digest is the MD5 of the data sent,
+    together with the response.
+    Pass seed to upload the content of a seeded PseudoFile,
+    and signature_version=4 to sign with SigV4 (UNSIGNED-PAYLOAD)
+    instead of the ECSTEST_SIGNATURE_VERSION default.
+    The upload is a single PUT, use multipart.ResumableUploader
+    for one which can be resumed after a failure.
     '''
     if 'headers' in kwargs:
         headers = kwargs['headers'].copy()
@@ -184,26 +413,47 @@ def upload_pseudo_file(bucket, key_name, length,
                              time.localtime(time.time()))
     headers['Date'] = utc_time
 
-    hash_string = 'PUT' + '\n' + '\n' + '\n' + utc_time + '\n'
-
     request_resource = '/' + urllib.quote(bucket.name, '') + \
                        '/' + urllib.quote(key_name, '')
 
     if query_args:
         request_resource += '?' + query_args
-    hash_string += request_resource
-
-    signature = get_signature(bucket.connection.provider.secret_key,
-                              hash_string)
-    authorization = 'AWS' + ' ' + bucket.connection.provider.access_key + \
-                    ":" + signature
 
-    pseudofile = filehelper.PseudoFile(length)
-    if not find_matching_headers('Content-Length', headers):
-        headers['Content-Length'] = length
+    signature_version = kwargs.get('signature_version',
+                                   cfg['SIGNATURE_VERSION'])
+    if int(signature_version) == 4:
+        url = '%s://%s:%s%s' % ('https' if bucket.connection.is_secure
+                                else 'http',
+                                bucket.connection.host,
+                                bucket.connection.port,
+                                request_resource)
+        _, headers, _ = signer.sign_request_v4(
+            'PUT', url, bucket.connection.provider.access_key,
+            bucket.connection.provider.secret_key, headers,
+            payload_hash=signer.UNSIGNED_PAYLOAD)
+        authorization = headers['Authorization']
+    else:
+        hash_string = 'PUT' + '\n' + '\n' + '\n' + utc_time + '\n' + \
+            request_resource
+        signature = get_signature(bucket.connection.provider.secret_key,
+                                  hash_string)
+        authorization = 'AWS' + ' ' + \
+            bucket.connection.provider.access_key + ":" + signature
+
+    pseudofile = filehelper.PseudoFile(length, seed=kwargs.get('seed', 0))
+    if chunk_size_list is not None:
+        # Do deep copy since this list will be changed
+        # that may affect top level.
+        data = iter_file_chunks(pseudofile, chunk_size_list[:])
+        if not find_matching_headers(constants.TRANSFER_ENCODING, headers):
+            headers[constants.TRANSFER_ENCODING] = 'chunked'
+    else:
+        data = pseudofile
+        if not find_matching_headers('Content-Length', headers):
+            headers['Content-Length'] = length
 
     if not find_matching_headers('Authorization', headers):
         headers['Authorization'] = authorization
 
     return pseudofile, _make_request(bucket, 'PUT', request_resource,
-                                     headers, pseudofile)
+                                     headers, data)
@@ -16,9 +16,16 @@ Test clients allow the creation of both valid and invalid requests and return
 low level response objects for use in TestCase assertions.
 """
 
+import threading
+import time
+
 import requests
 
+from ecstest.logger import logger
+from ecstest import config
 from ecstest import constants
+from ecstest import sessionpool
+from ecstest import signer
 from ecstest.controlplane_client.user_management import UserManagement
 from ecstest.controlplane_client.secret_key_management import SecretKeyManagement
 
@@ -26,6 +33,12 @@ from ecstest.controlplane_client.secret_key_management import SecretKeyManagemen
 requests.packages.urllib3.disable_warnings()
 
 
+cfg = config.get_config()
+
+# Routing of EcsDataPlaneClient requests.
+ROUTE_ROUND_ROBIN = 'round_robin'
+ROUTE_LEAST_OUTSTANDING = 'least_outstanding'
+
 ERROR_SCHEMA = {
     "$schema": "http://json-schema.org/draft-04/schema#",
     "id": "http://jsonschema.net",
@@ -52,7 +65,8 @@ class EcsControlPlaneClient(object):
     def __init__(self, username=None, password=None, token=None,
                  ecs_endpoint=None, token_endpoint=None, verify_ssl=False,
                  token_filename='/tmp/ecstest.token',
-                 request_timeout=15.0, cache_token=True):
+                 request_timeout=15.0, cache_token=True,
+                 token_manager=None):
         """
         Creates an instance of client class used for interacting
         with the ECS control plane.
@@ -68,6 +82,9 @@ class EcsControlPlaneClient(object):
         :param cache_token: Whether to cache the token, by default this is true
         you should only switch this to false when you want to directly fetch
         a token for a user
+        :param token_manager: Share the token of a tokenmanager.TokenManager
+        instead of logging in, requests rejected with 401 are retried once
+        with a refreshed token
         """
 
         self.username = username
@@ -81,6 +98,9 @@ class EcsControlPlaneClient(object):
         self.cache_token = cache_token
         self.session = requests.Session()
         self.token = None
+        self.token_manager = token_manager
+        if token_manager is not None:
+            self.session.hooks['response'].append(self._retry_unauthorized)
 
         # Create client classes as attributes.
         self.user_management = UserManagement(self)
@@ -138,7 +158,29 @@ class EcsControlPlaneClient(object):
 
         return response
 
+    def _retry_unauthorized(self, response, **kwargs):
+        """
+        Refresh the shared token and resend a request rejected with 401
+        """
+        request = response.request
+        stale_token = request.headers.get('X-SDS-AUTH-TOKEN')
+        if response.status_code != 401 or not stale_token or \
+                request.url.startswith(self.token_endpoint):
+            return response
+
+        self.token = self.token_manager.refresh(stale_token)
+        retry = request.copy()
+        retry.headers['X-SDS-AUTH-TOKEN'] = self.token
+        response.close()
+
+        # The hooks of the retry are not run, so it is sent only once.
+        retry.hooks = {'response': []}
+        return self.session.send(retry, **kwargs)
+
     def _base_request_headers(self, accept_header, content_type):
+        if self.token_manager is not None:
+            self.token = self.token_manager.get_token()
+
         headers = {
             'Accept': accept_header,
             'Content-Type': content_type,
@@ -148,6 +190,235 @@ class EcsControlPlaneClient(object):
         return headers
 
 
-class EcsDataPlaneClient():
-    def __init__(self):
-        pass
+class _DataNode(object):
+    """
+    Routing state of one data node
+    """
+
+    def __init__(self, host, base_url):
+        self.host = host
+        self.base_url = base_url
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0
+        self.requests = 0
+        self.errors = 0
+        self.ejections = 0
+
+    def stats(self):
+        return {
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'errors': self.errors,
+            'ejections': self.ejections,
+            'ejected': self.ejected_until > time.time(),
+        }
+
+
+class EcsDataPlaneClient(object):
+
+    def __init__(self, nodes, port=None, is_secure=None,
+                 access_key=None, secret_key=None,
+                 routing=ROUTE_ROUND_ROBIN, eject_after=3,
+                 readmit_after=30.0, verify_ssl=False,
+                 request_timeout=None, signature_version=None):
+        """
+        Creates an instance of client class used for sending signed
+        S3 requests to the data nodes of ECS, spreading them
+        over every node.
+
+        :param nodes: The hosts of the data nodes, e.g. the list returned
+        by utils.generate_node_list(), duplicates are ignored
+        :param port: The data port, ECSTEST_ACCESS_PORT by default
+        :param is_secure: Use https, ECSTEST_ACCESS_SSL by default
+        :param access_key: The access key to sign requests with
+        :param secret_key: The secret key to sign requests with
+        :param routing: ROUTE_ROUND_ROBIN to take the nodes in turn,
+        or ROUTE_LEAST_OUTSTANDING to take the node with the fewest
+        requests in flight
+        :param eject_after: How many consecutive connection errors or
+        5xx responses take a node out of the rotation
+        :param readmit_after: How many seconds an ejected node stays out,
+        it is then given one request to prove it is back
+        :param verify_ssl: Verify SSL certificates
+        :param request_timeout: How long to wait for a node to respond
+        :param signature_version: Sign requests with SigV2 or SigV4,
+        ECSTEST_SIGNATURE_VERSION by default
+        """
+
+        if routing not in (ROUTE_ROUND_ROBIN, ROUTE_LEAST_OUTSTANDING):
+            raise Exception('Unsupported routing: %s' % routing)
+        if port is None:
+            port = cfg['ACCESS_PORT']
+        if is_secure is None:
+            is_secure = cfg['ACCESS_SSL']
+        if request_timeout is None:
+            request_timeout = cfg['REQUEST_TIMEOUT']
+
+        scheme = 'https' if is_secure else 'http'
+        self.nodes = []
+        for host in nodes:
+            if host not in [node.host for node in self.nodes]:
+                base_url = '{0}://{1}:{2}'.format(scheme, host, port)
+                self.nodes.append(_DataNode(host, base_url))
+        if not self.nodes:
+            raise Exception('No data node to send requests to')
+
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.routing = routing
+        self.eject_after = eject_after
+        self.readmit_after = readmit_after
+        self.verify_ssl = verify_ssl
+        self.request_timeout = request_timeout
+        self.signature_version = signature_version
+
+        # One keep-alive connection pool per node.
+        self.sessions = sessionpool.SessionRegistry(idle_timeout=0)
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def _pick_node(self):
+        now = time.time()
+        with self._lock:
+            candidates = [node for node in self.nodes
+                          if node.ejected_until <= now]
+            if not candidates:
+                # Better to try the node back soonest than to fail.
+                candidates = [min(self.nodes,
+                                  key=lambda node: node.ejected_until)]
+
+            start = self._next % len(candidates)
+            self._next += 1
+            candidates = candidates[start:] + candidates[:start]
+            if self.routing == ROUTE_LEAST_OUTSTANDING:
+                node = min(candidates, key=lambda node: node.outstanding)
+            else:
+                node = candidates[0]
+
+            node.outstanding += 1
+            node.requests += 1
+            return node
+
+    def _release_node(self, node, failed):
+        with self._lock:
+            node.outstanding -= 1
+            if not failed:
+                node.failures = 0
+                node.ejected_until = 0
+                return
+
+            node.errors += 1
+            node.failures += 1
+            if node.failures >= self.eject_after:
+                node.ejected_until = time.time() + self.readmit_after
+                node.ejections += 1
+                # A readmitted node is ejected again by one more error.
+                node.failures = self.eject_after - 1
+                logger.warn('eject data node %s for %ss',
+                            node.host, self.readmit_after)
+
+    def request(self, method, path, access_key=None, secret_key=None,
+                node=None, signature_version=None, **kwargs):
+        """
+        Sign and send a request to the next node, return the response.
+        path is '/bucket/key', params/headers/data/stream/... are the
+        arguments of requests. data may be a file-like object or a
+        generator to stream the body, stream=True streams the response.
+        node sends the request to a given host instead of routing it.
+        signature_version and payload_hash are the ones of
+        s3requests.request(), signature_version defaults to the one
+        of the client.
+        The node of a streamed response counts as outstanding until
+        its body is consumed or the response is closed.
+        """
+
+        if access_key is None:
+            access_key = self.access_key
+        if secret_key is None:
+            secret_key = self.secret_key
+        if signature_version is None:
+            signature_version = self.signature_version
+
+        if node is None:
+            data_node = self._pick_node()
+        else:
+            matches = [n for n in self.nodes if n.host == node]
+            if not matches:
+                raise Exception('Unknown data node: %s' % node)
+            data_node = matches[0]
+            with self._lock:
+                data_node.outstanding += 1
+                data_node.requests += 1
+
+        failed = True
+        release = True
+        try:
+            url, headers, params = signer.sign(
+                method, data_node.base_url + path,
+                access_key, secret_key,
+                kwargs.get('headers'), kwargs.get('params'),
+                signature_version=signature_version,
+                payload_hash=kwargs.pop('payload_hash', None),
+                body=kwargs.get('data'))
+            kwargs['headers'] = headers
+            kwargs['params'] = params
+            kwargs.setdefault('verify', self.verify_ssl)
+            kwargs.setdefault('timeout', self.request_timeout)
+            if method == 'HEAD':
+                kwargs.setdefault('allow_redirects', False)
+
+            session = self.sessions.get_session(url)
+            response = session.request(method, url, **kwargs)
+            failed = response.status_code >= 500
+            if kwargs.get('stream') and method != 'HEAD' and \
+                    response.status_code not in (204, 304) and \
+                    response.headers.get('Content-Length') != '0':
+                self._release_on_close(response, data_node, failed)
+                release = False
+            return response
+        finally:
+            if release:
+                self._release_node(data_node, failed)
+
+    def _release_on_close(self, response, node, failed):
+        # The body of a streamed response is still in flight. urllib3
+        # gives the connection back once the body is read or the
+        # response is closed, release the node then too.
+        raw = response.raw
+        release_conn = raw.release_conn
+        released = []
+
+        def release():
+            if not released:
+                released.append(True)
+                self._release_node(node, failed)
+            release_conn()
+
+        raw.release_conn = release
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def head(self, path, **kwargs):
+        return self.request('HEAD', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def stats(self):
+        """
+        Return the routing counters of every node, keyed by host
+        """
+
+        with self._lock:
+            return dict((node.host, node.stats()) for node in self.nodes)
+
+    def close(self):
+        self.sessions.close()
@@ -96,4 +96,56 @@ def get_config():
         'NODES_PER_SITE': int(env.get('ECSTEST_NODES_PER_SITE', 1)),
         'RUN_DISABLED': _env_to_bool('ECSTEST_RUN_DISABLED'),
         'REUSE_BUCKET_NAME': env.get('ECSTEST_REUSE_BUCKET_NAME'),
+        'TOPOLOGY_TTL': float(env.get('ECSTEST_TOPOLOGY_TTL', 600)),
+        'TOPOLOGY_CACHE_FILE': env.get(
+            'ECSTEST_TOPOLOGY_CACHE_FILE', '/tmp/ecstest.topology'
+        ),
+        'TOPOLOGY_REFRESH_INTERVAL': float(env.get(
+            'ECSTEST_TOPOLOGY_REFRESH_INTERVAL', 0
+        )),
+        'SHARE_TOKEN': _env_to_bool('ECSTEST_SHARE_TOKEN', 0),
+        'MAX_ACTIVE_TOKENS': int(env.get('ECSTEST_MAX_ACTIVE_TOKENS', 50)),
+        'POOL_CONNECTIONS': int(env.get('ECSTEST_POOL_CONNECTIONS', 10)),
+        'POOL_MAXSIZE': int(env.get('ECSTEST_POOL_MAXSIZE', 10)),
+        'POOL_BLOCK': _env_to_bool('ECSTEST_POOL_BLOCK', 0),
+        'POOL_IDLE_TIMEOUT': float(env.get('ECSTEST_POOL_IDLE_TIMEOUT', 60.0)),
+        'SIGNATURE_VERSION': int(env.get('ECSTEST_SIGNATURE_VERSION', 2)),
+        'SIGV4_REGION': env.get('ECSTEST_SIGV4_REGION', 'us-east-1'),
+        'ASYNC_MAX_CONCURRENCY': int(env.get(
+            'ECSTEST_ASYNC_MAX_CONCURRENCY', 10000
+        )),
+        'ASYNC_LIMIT_PER_HOST': int(env.get(
+            'ECSTEST_ASYNC_LIMIT_PER_HOST', 500
+        )),
+        'PURGE_THREADS': int(env.get(
+            'ECSTEST_PURGE_THREADS', constants.DEFAULT_THREAD_NUMBER
+        )),
+        'BUCKET_POOL_SIZE': int(env.get('ECSTEST_BUCKET_POOL_SIZE', 0)),
+        'USER_POOL_SIZE': int(env.get('ECSTEST_USER_POOL_SIZE', 0)),
+        'USER_POOL_STATE_FILE': env.get('ECSTEST_USER_POOL_STATE_FILE', ''),
+        'USER_POOL_ROTATE_KEYS': _env_to_bool(
+            'ECSTEST_USER_POOL_ROTATE_KEYS', 0
+        ),
+        'ASYNC_TEARDOWN': _env_to_bool('ECSTEST_ASYNC_TEARDOWN', 0),
+        'TEARDOWN_THREADS': int(env.get(
+            'ECSTEST_TEARDOWN_THREADS', constants.DEFAULT_THREAD_NUMBER
+        )),
+        'TEARDOWN_QUEUE_SIZE': int(env.get(
+            'ECSTEST_TEARDOWN_QUEUE_SIZE', 100
+        )),
+        'MULTIPART_PART_SIZE': int(env.get(
+            'ECSTEST_MULTIPART_PART_SIZE', 16 * constants.ECS_1MB_OBJ_SIZE
+        )),
+        'MULTIPART_THREADS': int(env.get('ECSTEST_MULTIPART_THREADS', 10)),
+        'DOWNLOAD_RANGE_SIZE': int(env.get(
+            'ECSTEST_DOWNLOAD_RANGE_SIZE', 8 * constants.ECS_1MB_OBJ_SIZE
+        )),
+        'DOWNLOAD_THREADS': int(env.get('ECSTEST_DOWNLOAD_THREADS', 10)),
+        'POPULATE_THREADS': int(env.get('ECSTEST_POPULATE_THREADS', 20)),
+        'FILE_CACHE_DIR': env.get(
+            'ECSTEST_FILE_CACHE_DIR', '/var/tmp/ecstest-file-cache'
+        ),
+        'FILE_CACHE_SIZE': int(env.get(
+            'ECSTEST_FILE_CACHE_SIZE', 4 * constants.ECS_1GB_OBJ_SIZE
+        )),
     }
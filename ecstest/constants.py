@@ -27,6 +27,7 @@ VALID_TARGETS = (TARGET_ECS, TARGET_AWSS3, TARGET_FAKES3, TARGET_GOUDA, TARGET_B
 
 # http requests
 APPLICATION_JSON = 'application/json'
+APPLICATION_XML = 'application/xml'
 AUTH_TOKEN_HEADER = 'x-sds-auth-token'
 CONTENT_LENGTH = 'Content-Length'
 DATE = 'Date'
@@ -13,7 +13,7 @@
 Author: Rubicon ISE team
 '''
 
-from ecstest import constants, config, client
+from ecstest import constants, config, client, tokenmanager
 
 cfg = config.get_config()
 
@@ -24,21 +24,28 @@ class BaseMgmt(object):
     def __init__(self, username, password):
         self.username = username
         self.password = password
-        self.client = client.EcsControlPlaneClient(username=username,
-                                                   password=password,
-                                                   token=cfg['TOKEN'],
-                                                   ecs_endpoint=cfg['CONTROL_ENDPOINT'],
-                                                   token_endpoint=cfg['TOKEN_ENDPOINT'],
-                                                   verify_ssl=cfg['VERIFY_SSL'],
-                                                   token_filename=cfg['TOKEN_FILENAME'],
-                                                   request_timeout=cfg['REQUEST_TIMEOUT'],
-                                                   cache_token=cfg['CACHE_TOKEN']
-                                                  )
+        token_manager = None
+        if tokenmanager.is_enabled():
+            token_manager = tokenmanager.get_manager(username, password)
+        self.client = client.EcsControlPlaneClient(
+            username=username,
+            password=password,
+            token=cfg['TOKEN'],
+            ecs_endpoint=cfg['CONTROL_ENDPOINT'],
+            token_endpoint=cfg['TOKEN_ENDPOINT'],
+            verify_ssl=cfg['VERIFY_SSL'],
+            token_filename=cfg['TOKEN_FILENAME'],
+            request_timeout=cfg['REQUEST_TIMEOUT'],
+            cache_token=cfg['CACHE_TOKEN'],
+            token_manager=token_manager)
 
     def login(self, accept_header=constants.APPLICATION_JSON):
         '''
         Request a new authentication token from ECS.
         '''
+        if self.client.token_manager is not None:
+            self.client.token = self.client.token_manager.get_token()
+            return self.client.token
         token = self.client.token
         if not token:
             response = self.client.make_login_request(self.username, self.password, accept_header)
@@ -52,6 +59,10 @@ class BaseMgmt(object):
                content_type=constants.APPLICATION_JSON):
         '''
         End http session.
+        A shared token is logged out only when the process exits.
         '''
+        if self.client.token_manager is not None:
+            self.client.token = None
+            return None
         return self.client.make_logout_request(self.client.token, accept_header, content_type)
 
@@ -0,0 +1,338 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+import hashlib
+import os
+import threading
+import time
+
+from ecstest.logger import logger
+from ecstest import config
+from ecstest import constants
+from ecstest import filehelper
+from ecstest import multipart
+from ecstest import s3requests
+from ecstest import workerpool
+
+cfg = config.get_config()
+
+# Most bytes read from a response at once.
+STREAM_BLOCK_SIZE = constants.ECS_1MB_OBJ_SIZE
+
+
+def split_ranges(length, range_size):
+    '''Return the (index, offset, size) of the ranges of length bytes.'''
+    return [(i, offset, min(range_size, length - offset))
+            for i, offset in enumerate(range(0, length, range_size))]
+
+
+def _write_at(fd, data, offset, lock):
+    # os.pwrite() is python 3 only, seek and write under a lock instead.
+    if not hasattr(os, 'pwrite'):
+        with lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            os.write(fd, data)
+        return
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+class _OrderedDigest(object):
+    '''
+    The MD5 of ranges completed in any order. A range is hashed once
+    the ranges before it are, up to window ranges wait in memory,
+    wait_turn() blocks the producer of ranges beyond.
+    '''
+    def __init__(self, window):
+        self.window = window
+        self.md5 = hashlib.md5()
+        self.failed = False
+        self._next = 0
+        self._pending = {}
+        self._cond = threading.Condition()
+
+    def wait_turn(self, index):
+        '''Wait until range index may be fetched, or a range failed.'''
+        with self._cond:
+            while index >= self._next + self.window and not self.failed:
+                self._cond.wait()
+
+    def add(self, index, chunks):
+        with self._cond:
+            self._pending[index] = chunks
+            while self._next in self._pending:
+                for chunk in self._pending.pop(self._next):
+                    self.md5.update(chunk)
+                self._next += 1
+            self._cond.notify_all()
+
+    def fail(self):
+        with self._cond:
+            self.failed = True
+            self._cond.notify_all()
+
+
+class DownloadResult(object):
+    '''
+    The outcome of a download. computed_etag is computed from the data
+    received, None when the ETag of a multipart object can't be, etag
+    is the one returned by ECS. pseudo_valid tells whether the data is
+    the seeded PseudoFile content, None if it was not checked.
+    '''
+    def __init__(self, etag, computed_etag, size, seconds, retries,
+                 pseudo_valid=None):
+        self.etag = etag
+        self.computed_etag = computed_etag
+        self.size = size
+        self.seconds = seconds
+        self.retries = retries
+        self.pseudo_valid = pseudo_valid
+
+    def checked(self):
+        '''Tell whether the ETag or the content could be checked.'''
+        return self.computed_etag is not None or \
+            self.pseudo_valid is not None
+
+    def is_valid(self):
+        '''
+        Return True if every check made passed, False if one failed,
+        None if nothing was checked.
+        '''
+        if not self.checked():
+            return None
+        etag_valid = None
+        if self.computed_etag is not None:
+            etag_valid = self.etag == self.computed_etag
+        return etag_valid is not False and self.pseudo_valid is not False
+
+    def throughput(self):
+        '''Return the bytes received per second.'''
+        return self.size / self.seconds if self.seconds else 0.0
+
+
+class RangedDownloader(object):
+    '''
+    Download an object in byte ranges fetched concurrently by
+    num_workers threads over the pooled sessions of s3requests.
+    The ranges are written at their offset of a preallocated file,
+    or discarded, and the data is checked as it arrives, so it is
+    never read twice:
+
+    - a single part object has the MD5 of the ranges as ETag, they are
+      hashed in order, up to 2 * num_workers ranges wait in memory for
+      the ranges before them.
+    - a multipart object uploaded with part_size has the ETag of its
+      parts, download() then fetches one range per part.
+    - with seed, the data must be the content of a seeded PseudoFile.
+
+    A range which fails is fetched again up to max_retries times.
+
+    result = RangedDownloader(bucket, key_name).download(seed=0)
+    assert result.is_valid()
+    '''
+    def __init__(self, bucket, key_name,
+                 range_size=cfg['DOWNLOAD_RANGE_SIZE'],
+                 num_workers=cfg['DOWNLOAD_THREADS'],
+                 max_retries=3, signature_version=None):
+        self.key_name = key_name
+        self.url = s3requests.get_key_url(multipart.get_bucket_url(bucket),
+                                          key_name)
+        self.access_key = bucket.connection.provider.access_key
+        self.secret_key = bucket.connection.provider.secret_key
+        self.range_size = range_size
+        self.num_workers = num_workers
+        self.max_retries = max_retries
+        self.signature_version = signature_version
+        self._lock = threading.Lock()
+        self._retries = 0
+
+    def _request(self, method, **kwargs):
+        return s3requests.request(method, self.url, self.access_key,
+                                  self.secret_key,
+                                  signature_version=self.signature_version,
+                                  **kwargs)
+
+    def head(self):
+        '''Return the length and the ETag of the object.'''
+        response = self._request('HEAD')
+        response.raise_for_status()
+        return (int(response.headers['Content-Length']),
+                response.headers.get('ETag', '').strip('"'))
+
+    def download(self, filepath=None, part_size=None, seed=None):
+        '''
+        Download the object to filepath, or discard its data if None,
+        and return a DownloadResult.
+        :param part_size: the part size of a multipart object,
+            to check its ETag.
+        :param seed: check the data is the content of a PseudoFile
+            generated from seed.
+        '''
+        started = time.time()
+        self._retries = 0
+        length, etag = self.head()
+        num_parts = None
+        if '-' in etag:
+            num_parts = int(etag.rsplit('-', 1)[1])
+        if num_parts is not None and part_size:
+            ranges = split_ranges(length, part_size)
+            if len(ranges) != num_parts:
+                logger.warn('%s has %d parts, not %d of %d bytes',
+                            self.key_name, num_parts, len(ranges),
+                            part_size)
+        else:
+            ranges = split_ranges(length, self.range_size)
+
+        ordered = None
+        if num_parts is None:
+            ordered = _OrderedDigest(2 * self.num_workers)
+        digests = [None] * len(ranges)
+        verifiers = [None] * len(ranges)
+        fd = None
+        if filepath is not None:
+            fd = _create_file(filepath, length)
+
+        failed = threading.Event()
+
+        def fetch(index, offset, size):
+            try:
+                if not failed.is_set():
+                    digests[index], verifiers[index] = self._fetch_range(
+                        offset, size, fd, index, ordered, length, seed)
+            except Exception:
+                failed.set()
+                if ordered is not None:
+                    ordered.fail()
+                raise
+
+        try:
+            tasks = []
+            with workerpool.WorkerPool(
+                    self.num_workers, max_pending=self.num_workers,
+                    name='ecstest-download') as workers:
+                for index, offset, size in ranges:
+                    if ordered is not None:
+                        ordered.wait_turn(index)
+                    if failed.is_set():
+                        break
+                    tasks.append(workers.submit(fetch, index, offset, size))
+            for task in tasks:
+                if task.exception() is not None:
+                    task.result()
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+        if ordered is not None:
+            computed_etag = ordered.md5.hexdigest()
+        elif part_size and len(ranges) == num_parts:
+            computed_etag = multipart.multipart_etag(digests)
+        else:
+            computed_etag = None
+        pseudo_valid = None
+        if seed is not None:
+            pseudo_valid = all(verifier.is_valid(size) for verifier, (
+                _, _, size) in zip(verifiers, ranges))
+        result = DownloadResult(etag, computed_etag, length,
+                                time.time() - started, self._retries,
+                                pseudo_valid)
+        if not result.checked():
+            logger.warn('nothing verified of %s: the ETag of a multipart '
+                        'object needs part_size, or pass seed',
+                        self.key_name)
+        logger.debug('downloaded %s: %d bytes at %.1f MB/s', self.key_name,
+                     length, result.throughput() / constants.ECS_1MB_OBJ_SIZE)
+        return result
+
+    def _fetch_range(self, offset, size, fd, index, ordered, length, seed):
+        # Return the MD5 digest of the range and its PseudoFileVerifier.
+        attempt = 0
+        while True:
+            try:
+                return self._get_range(offset, size, fd, index, ordered,
+                                       length, seed)
+            except Exception as err:
+                if attempt >= self.max_retries or \
+                        not multipart.is_transient(err):
+                    raise
+                attempt += 1
+                with self._lock:
+                    self._retries += 1
+                logger.warn('range %d-%d of %s failed, retry %d: %s',
+                            offset, offset + size - 1, self.key_name,
+                            attempt, err)
+                time.sleep(multipart.RETRY_DELAY * 2 ** (attempt - 1))
+
+    def _get_range(self, offset, size, fd, index, ordered, length, seed):
+        response = self._request(
+            'GET', stream=True,
+            headers={'Range': 'bytes=%d-%d' % (offset, offset + size - 1)})
+        md5 = hashlib.md5()
+        verifier = None
+        if seed is not None:
+            verifier = filehelper.PseudoFileVerifier(length, offset, seed)
+        chunks = []
+        position = offset
+        try:
+            response.raise_for_status()
+            if response.status_code != 206 and size != length:
+                raise Exception('range %d-%d of %s is not honoured'
+                                % (offset, offset + size - 1,
+                                   self.key_name))
+            for chunk in response.iter_content(STREAM_BLOCK_SIZE):
+                md5.update(chunk)
+                if fd is not None:
+                    _write_at(fd, chunk, position, self._lock)
+                if verifier is not None:
+                    verifier.update(chunk)
+                if ordered is not None:
+                    chunks.append(chunk)
+                position += len(chunk)
+        finally:
+            response.close()
+        if position - offset != size:
+            raise Exception('got %d bytes of range %d-%d of %s'
+                            % (position - offset, offset, offset + size - 1,
+                               self.key_name))
+        if ordered is not None:
+            ordered.add(index, chunks)
+        return md5.digest(), verifier
+
+
+def _create_file(filepath, length):
+    # Return a descriptor of filepath, preallocated to length bytes.
+    fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        if length and hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(fd, 0, length)
+        else:
+            os.ftruncate(fd, length)
+    except OSError:
+        # Not supported by the file system, the file stays sparse.
+        os.ftruncate(fd, length)
+    return fd
+
+
+def download(bucket, key_name, filepath=None, part_size=None, seed=None,
+             **kwargs):
+    '''
+    Download key_name to filepath, or discard its data if None,
+    with a RangedDownloader. kwargs are the ones of RangedDownloader.
+    '''
+    return RangedDownloader(bucket, key_name, **kwargs).download(
+        filepath, part_size, seed)
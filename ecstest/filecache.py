@@ -0,0 +1,248 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+import contextlib
+import errno
+import fcntl
+import os
+import stat
+import tempfile
+
+from ecstest.logger import logger
+from ecstest import config
+from ecstest import filehelper
+
+cfg = config.get_config()
+
+CACHE_FILE_SUFFIX = '.bin'
+LOCK_FILE_SUFFIX = '.lock'
+READ_ONLY_MODE = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+@contextlib.contextmanager
+def _flock(path):
+    '''
+    Hold an exclusive lock on path, shared by threads and processes.
+    '''
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class FileCache(object):
+    '''
+    On-disk cache of generated files keyed by size and seed,
+    shared by tests and parallel test workers.
+
+    Files are generated once by filehelper.generate_seeded_file()
+    and handed out read-only, so a test must not modify them.
+    When the cached files exceed max_bytes in total,
+    the least recently handed out ones are removed,
+    except the ones leased with lease().
+    The directory may be on tmpfs, e.g. /dev/shm/ecstest-file-cache.
+    '''
+    def __init__(self, cache_dir=cfg['FILE_CACHE_DIR'],
+                 max_bytes=cfg['FILE_CACHE_SIZE']):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        try:
+            os.makedirs(cache_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        self._lock_path = os.path.join(cache_dir,
+                                       'cache' + LOCK_FILE_SUFFIX)
+
+    def get_path(self, size, seed=0):
+        '''Return the path a file of size and seed is cached at.'''
+        return os.path.join(self.cache_dir,
+                            '%d-%d%s' % (size, seed, CACHE_FILE_SUFFIX))
+
+    def get_file(self, size, seed=0):
+        '''
+        Return the path of a read-only file of size bytes
+        generated from seed, generating it on first use.
+        The file may be evicted by the next files generated,
+        lease() keeps it while it is read.
+        '''
+        path = self.get_path(size, seed)
+        if not self._touch(path):
+            # One lock per entry, so different sizes
+            # are generated concurrently.
+            with _flock(path + LOCK_FILE_SUFFIX):
+                if not self._touch(path):
+                    self._generate(path, size, seed)
+        return path
+
+    @contextlib.contextmanager
+    def lease(self, size, seed=0):
+        '''
+        Yield the path of the file get_file() returns,
+        which is not evicted before the with block ends.
+
+        with cache.lease(size) as path:
+            key.set_contents_from_filename(path)
+        '''
+        while True:
+            path = self.get_file(size, seed)
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                # Evicted meanwhile.
+                continue
+            # A shared lock per lease, evict() skips locked files.
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            try:
+                if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                    break
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    os.close(fd)
+                    raise
+            # Evicted before it was locked.
+            os.close(fd)
+        try:
+            yield path
+        finally:
+            # Closing the file releases the lock.
+            os.close(fd)
+
+    def _touch(self, path):
+        # The modification time records when the file was handed out last.
+        try:
+            os.utime(path, None)
+            return True
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+
+    def _generate(self, path, size, seed):
+        self.evict(size, keep=path)
+        logger.debug('generate cached file %s', path)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir,
+                                        prefix='.tmp-')
+        os.close(fd)
+        try:
+            filehelper.generate_seeded_file(size, tmp_path, seed)
+            os.chmod(tmp_path, READ_ONLY_MODE)
+            # rename is atomic, readers never see a partial file.
+            os.rename(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def _list_entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(CACHE_FILE_SUFFIX):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Evicted by another worker meanwhile.
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _remove(self, path):
+        '''
+        Remove the cached file at path and its entry lock,
+        return False if the file is leased and was kept.
+        '''
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return True
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError) as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                return False
+            logger.debug('evict cached file %s', path)
+            # A worker still waiting for the removed entry lock
+            # generates the file again, which is only wasted work.
+            for name in (path, path + LOCK_FILE_SUFFIX):
+                try:
+                    os.remove(name)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+            return True
+        finally:
+            os.close(fd)
+
+    def evict(self, reserve=0, keep=None):
+        '''
+        Remove the least recently used files until the cached files
+        and reserve more bytes fit in max_bytes. Leased files are kept,
+        so the cache may stay above max_bytes.
+        '''
+        with _flock(self._lock_path):
+            entries = sorted(self._list_entries())
+            total = sum(size for _, size, _ in entries) + reserve
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                if self._remove(path):
+                    total -= size
+                else:
+                    logger.debug('keep leased cached file %s', path)
+
+    def clear(self):
+        '''Remove every cached file, but the leased ones.'''
+        with _flock(self._lock_path):
+            for _, _, path in self._list_entries():
+                self._remove(path)
+
+
+_cache = None
+
+
+def get_cache():
+    '''Return the process-wide file cache.'''
+    global _cache
+    if _cache is None:
+        _cache = FileCache()
+    return _cache
+
+
+def get_cached_file(size, seed=0):
+    '''
+    Return the path of a read-only file of size bytes from the
+    process-wide cache. Replace generate_tmp_file() with it when
+    a test only reads the file.
+    '''
+    return get_cache().get_file(size, seed)
+
+
+def lease_cached_file(size, seed=0):
+    '''
+    Return a context manager yielding the path of a cached file
+    as get_cached_file() does, not evicted until the with block ends.
+    '''
+    return get_cache().lease(size, seed)
@@ -13,12 +13,16 @@
 Author: Rubicon ISE team
 '''
 
+import mmap
 import os
 import random
 import uuid
 import struct
 import hashlib
 
+from ecstest.logger import logger
+from ecstest import constants
+
 def generate_tmp_file(size, pathfn=None):
     '''Generate a file with given size.
     The content is read from /dev/urandom.
@@ -43,10 +47,33 @@ def generate_tmp_file(size, pathfn=None):
 
     return pathfn
 
+def generate_seeded_file(size, pathfn, seed=0):
+    '''Generate a file with given size whose content only
+    depends on seed, so the same file can be generated again.
+    Like generate_tmp_file(), a 1MB random buffer is repeated.
+    Return the file name.
+    '''
+    buff_size = min(size, constants.ECS_1MB_OBJ_SIZE)
+    digest_size = hashlib.sha512().digest_size
+    buff = b''.join([hashlib.sha512(('%d:%d' % (seed, i)).encode('ascii'))
+                     .digest()
+                     for i in range(buff_size // digest_size + 1)])
+    buff = buff[0:buff_size]
+
+    with open(pathfn, 'wb') as f:
+        while size > 0:
+            writesize = min(size, len(buff))
+            f.write(buff[0:writesize])
+            size -= writesize
+
+    return pathfn
+
 def get_file_range(offset, readsize, filepath):
     """
     Get range from local file and
     save as another temp file
+    Use FileRange or compare_file_range() to check a range
+    without copying it.
     """
     filesize = os.path.getsize(filepath)
     end = offset + readsize - 1
@@ -61,6 +88,188 @@ def get_file_range(offset, readsize, filepath):
             tf.write(buff)
     return temp_file
 
+class FileRange(object):
+    '''
+    A read-only view over readsize bytes of a local file from offset.
+    The file is mapped with mmap, so no data is copied or written
+    to another file, unlike get_file_range().
+
+    view is a buffer over the range, the object can also be read
+    as a file, e.g. passed as data to requests or boto:
+    with FileRange(offset, readsize, filepath) as file_range:
+        key.set_contents_from_file(file_range)
+    '''
+    mode = 'rb'
+
+    def __init__(self, offset, readsize, filepath):
+        filesize = os.path.getsize(filepath)
+        if offset < 0 or readsize <= 0 or offset + readsize > filesize:
+            raise Exception("Request invalid range from file %s, offset:%d "
+                            "readsize:%d filesize:%d"
+                            % (filepath, offset, readsize, filesize))
+        self.name = filepath
+        self.offset = offset
+        self.size = readsize
+        self.closed = False
+        self.__pos = 0
+
+        # mmap offset must be a multiple of the allocation granularity.
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        self.__start = offset - start
+        with open(filepath, 'rb') as f:
+            self.__mmap = mmap.mmap(f.fileno(), offset + readsize - start,
+                                    offset=start, access=mmap.ACCESS_READ)
+        self.view = _get_buffer(self.__mmap, self.__start, readsize)
+
+    def __len__(self):
+        return self.size
+
+    def tell(self):
+        return self.__pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            position = offset
+        elif whence == os.SEEK_CUR:
+            position = self.__pos + offset
+        elif whence == os.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError('invalid whence (%r)' % whence)
+        if position < 0:
+            raise IOError('negative seek position %d' % position)
+        self.__pos = position
+        return position
+
+    def read(self, size=-1):
+        length = max(0, self.size - self.__pos)
+        if size is not None and size >= 0:
+            length = min(size, length)
+        start = self.__start + self.__pos
+        self.__pos += length
+        return self.__mmap[start:start + length]
+
+    def iter_chunks(self, chunk_size=constants.ECS_1MB_OBJ_SIZE):
+        '''Generate buffers over consecutive chunks of the range.'''
+        for pos in range(0, self.size, chunk_size):
+            yield self.view[pos:pos + chunk_size]
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if hasattr(self.view, 'release'):
+            self.view.release()
+        try:
+            self.__mmap.close()
+        except BufferError:
+            # A buffer over the map is still in use,
+            # the map is unmapped when it is collected.
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _get_buffer(obj, offset, size):
+    '''
+    Return a zero-copy buffer over size bytes of obj from offset.
+    '''
+    try:
+        return memoryview(obj)[offset:offset + size]
+    except TypeError:
+        # mmap doesn't support memoryview under python 2.
+        return buffer(obj, offset, size)  # noqa
+
+
+class FileRangeVerifier(object):
+    '''
+    Check a stream, e.g. a response body, against readsize bytes of
+    a local file from offset, chunk by chunk as it arrives.
+    Same interface as PseudoFileVerifier.
+    '''
+    def __init__(self, filepath, offset=0, readsize=None):
+        if readsize is None:
+            readsize = os.path.getsize(filepath) - offset
+        self.offset = offset
+        self.size = readsize
+        self.verified = 0
+        self.mismatch_offset = None
+        self.__range = FileRange(offset, readsize, filepath)
+
+    def update(self, data):
+        '''
+        Compare the next bytes of the stream.
+        Return False once any byte did not match.
+        '''
+        if self.mismatch_offset is not None:
+            return False
+        size = len(data)
+        pos = self.verified
+        expected = self.__range.view[pos:pos + size]
+        if size > self.size - pos or expected != data:
+            for i in range(min(size, len(expected))):
+                if data[i:i + 1] != expected[i:i + 1]:
+                    break
+            else:
+                i = len(expected)
+            self.mismatch_offset = self.offset + pos + i
+            logger.debug('file data mismatch at offset %d',
+                         self.mismatch_offset)
+            return False
+        self.verified += size
+        return True
+
+    def is_valid(self, length=None):
+        '''
+        Return True if all data matched, and length bytes were checked,
+        the whole range by default.
+        '''
+        if length is None:
+            length = self.size
+        return self.mismatch_offset is None and self.verified == length
+
+    def close(self):
+        self.__range.close()
+
+
+def compare_file_range(stream, filepath, offset=0, readsize=None,
+                       chunk_size=constants.ECS_1MB_OBJ_SIZE):
+    '''
+    Return True if stream holds readsize bytes of the local file
+    from offset, by default up to its end.
+    stream may be a string, a file-like object or an iterable of strings
+    such as response.iter_content().
+    '''
+    verifier = FileRangeVerifier(filepath, offset, readsize)
+    try:
+        _feed_verifier(verifier, stream, chunk_size)
+        return verifier.is_valid()
+    finally:
+        verifier.close()
+
+
+def _feed_verifier(verifier, stream, chunk_size):
+    '''
+    Pass stream to verifier.update() chunk by chunk,
+    stop at the first mismatch.
+    '''
+    if isinstance(stream, (bytes, bytearray)):
+        verifier.update(stream)
+    elif hasattr(stream, 'read'):
+        while True:
+            data = stream.read(chunk_size)
+            if not data or not verifier.update(data):
+                break
+    else:
+        for data in stream:
+            if not verifier.update(data):
+                break
+
+
 def get_unique_tmpfile(prefix='tmpfile-'):
     '''
     Only get a unique temp file name
@@ -68,69 +277,267 @@ def get_unique_tmpfile(prefix='tmpfile-'):
     '''
     return prefix + str(uuid.uuid4())
 
-# For long-term solution, inherited from file object
-# and implement most common methods to act as a file object
-# but without real file
+
+# Every block of a PseudoFile is a fixed body followed by a trailer
+# of its block number and a stamp, so content is a pure function of
+# the seed and block number, and a misplaced block can be told
+# from its trailer.
+PSEUDO_BLOCK_SIZE = 4096
+PSEUDO_TRAILER = struct.Struct('<QQ')
+PSEUDO_MAGIC = 0x2174736574736365  # 'ecstest!'
+# Blocks are generated a span at a time into a reusable buffer.
+PSEUDO_SPAN_SIZE = 256 * PSEUDO_BLOCK_SIZE
+PSEUDO_BLOCKS_PER_SPAN = PSEUDO_SPAN_SIZE // PSEUDO_BLOCK_SIZE
+
+_pseudo_span_templates = {}
+
+
+def _get_pseudo_span_template(seed=0):
+    '''
+    Return a span of blocks with the body of seed and empty trailers,
+    built once per seed and copied by every PseudoFile.
+    '''
+    template = _pseudo_span_templates.get(seed)
+    if template is None:
+        body_size = PSEUDO_BLOCK_SIZE - PSEUDO_TRAILER.size
+        body = b''
+        counter = 0
+        while len(body) < body_size:
+            body += hashlib.md5(('%d:%d' % (seed, counter))
+                                .encode('ascii')).digest()
+            counter += 1
+        block = body[:body_size] + b'\0' * PSEUDO_TRAILER.size
+        template = block * PSEUDO_BLOCKS_PER_SPAN
+        _pseudo_span_templates[seed] = template
+    return template
+
+
 class PseudoFile(object):
     '''
     This is to generate huge size data for upload
     without too many local resources requirements.
+
+    It acts as a read-only binary file object: read(), readinto(),
+    seek() and tell() can be used by boto set_contents_from_file()
+    and requests to stream from it.
+    While data is read sequentially from offset 0, md5_digest is
+    the running MD5 of the data read so far. Reading elsewhere
+    sets it to None, seeking back to 0 restarts it.
+
+    Content only depends on seed, so any range of an object uploaded
+    from a PseudoFile can be regenerated later, in O(range),
+    with read_range() or checked with PseudoFileVerifier.
     '''
-    def __init__(self, filesize):
-        self.__bsize = 4096
-        self.__offset = 0
-        self.__data = None
+    mode = 'rb'
+
+    def __init__(self, filesize, compute_md5=True, seed=0):
         self.filesize = filesize
-        self.md5_digest = None
+        self.compute_md5 = compute_md5
+        self.seed = seed
+        self.md5_digest = hashlib.md5() if compute_md5 else None
+        self.closed = False
+        self.__offset = 0
+        self.__md5_offset = 0
+        self.__span = None
+        self.__stamp = (PSEUDO_MAGIC ^ seed) & 0xFFFFFFFFFFFFFFFF
+        self.__buffer = bytearray(_get_pseudo_span_template(seed))
+        self.__view = memoryview(self.__buffer)
 
     def _gen_block(self, blknum):
-        unit = struct.pack("I", blknum)
-        data = unit * ((self.__bsize - 16)/len(unit))
-        chksum = hashlib.md5()
-        chksum.update(data)
-        data = data + chksum.digest()
-        return data
-
-    def read(self):
-        if self.filesize < self.__bsize:
-            self.__bsize = self.filesize
-        length = self.filesize
-        data = ''
+        '''Return the content of a whole block.'''
+        self._load_span(blknum // PSEUDO_BLOCKS_PER_SPAN)
+        start = (blknum % PSEUDO_BLOCKS_PER_SPAN) * PSEUDO_BLOCK_SIZE
+        return self.__view[start:start + PSEUDO_BLOCK_SIZE].tobytes()
+
+    def _load_span(self, span):
+        '''
+        Stamp the block trailers of a span into the reusable buffer.
+        Bodies never change, so only 16 bytes per block are written.
+        '''
+        if self.__span == span:
+            return
+        blknum = span * PSEUDO_BLOCKS_PER_SPAN
+        pos = PSEUDO_BLOCK_SIZE - PSEUDO_TRAILER.size
+        pack_into = PSEUDO_TRAILER.pack_into
+        for i in range(PSEUDO_BLOCKS_PER_SPAN):
+            pack_into(self.__buffer, pos, blknum + i, self.__stamp)
+            pos += PSEUDO_BLOCK_SIZE
+        self.__span = span
+
+    def _iter_data(self, length):
+        '''
+        Generate views of at most length bytes from the current offset,
+        at most one span at a time, and update the running MD5.
+        A view is only valid until the next one is generated.
+        '''
+        length = min(length, self.filesize - self.__offset)
         while length > 0:
-            used = self.__offset % self.__bsize
-            if used == 0:
-                blknum = self.__offset / self.__bsize
-                self.__data = self._gen_block(blknum)
-
-            remain = self.__bsize - used
-            transfer = min(length, remain)
-            data += self.__data[0:transfer]
+            span, used = divmod(self.__offset, PSEUDO_SPAN_SIZE)
+            self._load_span(span)
+            transfer = min(length, PSEUDO_SPAN_SIZE - used)
+            data = self.__view[used:used + transfer]
+            self._update_md5(data)
             self.__offset += transfer
             length -= transfer
+            yield data
 
-        return data
+    def _update_md5(self, data):
+        if not self.compute_md5:
+            return
+        if self.__offset == 0:
+            self.md5_digest = hashlib.md5()
+            self.__md5_offset = 0
+        if self.__offset == self.__md5_offset and \
+                self.md5_digest is not None:
+            self.md5_digest.update(data)
+            self.__md5_offset += len(data)
+        else:
+            self.md5_digest = None
 
-    def send(self, http_conn):
-        if self.filesize < self.__bsize:
-            self.__bsize = self.filesize
-        length = self.filesize
-        data = ''
-        self.md5_digest = hashlib.md5()
-        while length > 0:
-            used = self.__offset % self.__bsize
-            if used == 0:
-                blknum = self.__offset / self.__bsize
-                self.__data = self._gen_block(blknum)
+    def tell(self):
+        return self.__offset
 
-            remain = self.__bsize - used
-            transfer = min(length, remain)
-            data = self.__data[0:transfer]
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            position = offset
+        elif whence == os.SEEK_CUR:
+            position = self.__offset + offset
+        elif whence == os.SEEK_END:
+            position = self.filesize + offset
+        else:
+            raise ValueError('invalid whence (%r)' % whence)
+        if position < 0:
+            raise IOError('negative seek position %d' % position)
+        self.__offset = position
+        return position
 
-            self.md5_digest.update(data)
+    def readable(self):
+        return True
 
-            self.__offset += transfer
-            length -= transfer
+    def seekable(self):
+        return True
 
-            # Send the data immediately once it is generated
-            # to avoid memory overflow when generate huge size data
+    def read(self, size=-1):
+        '''
+        Read at most size bytes from the current offset,
+        or up to the end if size is negative or omitted.
+        '''
+        length = self.filesize - self.__offset
+        if size is not None and size >= 0:
+            length = min(size, length)
+        return b''.join([data.tobytes() for data in self._iter_data(length)])
+
+    def read_range(self, offset, size):
+        '''
+        Return size bytes from offset, without moving the current offset
+        or touching the running MD5.
+        '''
+        size = max(0, min(size, self.filesize - offset))
+        pieces = []
+        while size > 0:
+            span, used = divmod(offset, PSEUDO_SPAN_SIZE)
+            self._load_span(span)
+            transfer = min(size, PSEUDO_SPAN_SIZE - used)
+            pieces.append(self.__view[used:used + transfer].tobytes())
+            offset += transfer
+            size -= transfer
+        return b''.join(pieces)
+
+    def readinto(self, b):
+        '''
+        Read up to len(b) bytes into the writable buffer b
+        and return the number of bytes read.
+        '''
+        view = memoryview(b)
+        pos = 0
+        for data in self._iter_data(len(view)):
+            view[pos:pos + len(data)] = data
+            pos += len(data)
+        return pos
+
+    def send(self, http_conn):
+        # Send the data immediately once it is generated
+        # to avoid memory overflow when generate huge size data
+        for data in self._iter_data(self.filesize - self.__offset):
             http_conn.send(data)
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PseudoFileVerifier(object):
+    '''
+    Check data downloaded from an object uploaded from a PseudoFile
+    against the regenerated content, chunk by chunk as it arrives,
+    so neither the object nor a local copy is kept.
+
+    verifier = PseudoFileVerifier(size, offset=start)
+    for chunk in response.iter_content(1024 * 1024):
+        verifier.update(chunk)
+    eq(verifier.is_valid(length), True)
+    '''
+    def __init__(self, filesize, offset=0, seed=0):
+        self.filesize = filesize
+        self.offset = offset
+        self.verified = 0
+        self.mismatch_offset = None
+        self.__pseudofile = PseudoFile(filesize, compute_md5=False, seed=seed)
+        self.__pseudofile.seek(offset)
+
+    def update(self, data):
+        '''
+        Compare the next bytes of the stream.
+        Return False once any byte did not match.
+        '''
+        if self.mismatch_offset is not None:
+            return False
+        view = memoryview(data)
+        pos = 0
+        for expected in self.__pseudofile._iter_data(len(view)):
+            size = len(expected)
+            if view[pos:pos + size] != expected:
+                self._set_mismatch(view[pos:pos + size].tobytes(),
+                                   expected.tobytes())
+                return False
+            pos += size
+            self.verified += size
+        if pos < len(view):
+            # More data than the pseudofile has.
+            self.mismatch_offset = self.offset + self.verified
+            return False
+        return True
+
+    def _set_mismatch(self, data, expected):
+        for i in range(len(data)):
+            if data[i] != expected[i]:
+                break
+        self.mismatch_offset = self.offset + self.verified + i
+        logger.debug('pseudofile data mismatch at offset %d',
+                     self.mismatch_offset)
+
+    def is_valid(self, length=None):
+        '''
+        Return True if all data matched, and length bytes were checked.
+        By default the data must run up to the end of the pseudofile.
+        '''
+        if length is None:
+            length = self.filesize - self.offset
+        return self.mismatch_offset is None and self.verified == length
+
+
+def verify_pseudo_data(stream, filesize, offset=0, length=None, seed=0,
+                       chunk_size=PSEUDO_SPAN_SIZE):
+    '''
+    Return True if stream holds the bytes of a PseudoFile of filesize
+    from offset, length bytes by default up to its end.
+    stream may be a string, a file-like object or an iterable of strings.
+    '''
+    verifier = PseudoFileVerifier(filesize, offset, seed)
+    _feed_verifier(verifier, stream, chunk_size)
+    return verifier.is_valid(length)
@@ -0,0 +1,158 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+import binascii
+import os
+
+import six
+
+# Marks where the file goes among the segments of a body.
+_FILE = object()
+
+
+def _to_bytes(value):
+    if isinstance(value, six.text_type):
+        return value.encode('utf-8')
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode('utf-8')
+
+
+class FormDataEncoder(object):
+    '''
+    A multipart/form-data body of form fields and a file, read as a file
+    object by requests, so that the file is streamed in constant memory
+    whatever its size. The length of the body is known up front,
+    it is sent with a Content-Length header.
+
+    The file is filepath, opened when it is first read and closed once
+    sent, fileobj, e.g. a PseudoFile, or content, a string.
+    The fields are a list of (name, value) sent in order before the file,
+    as requests does with data and files.
+
+    with FormDataEncoder(fields, filepath=pathfn) as body:
+        s3requests.post(url, data=body,
+                        headers={'Content-Type': body.content_type})
+    '''
+    def __init__(self, fields, filepath=None, fileobj=None, content=None,
+                 length=None, file_field='file', filename=None,
+                 boundary=None):
+        if boundary is None:
+            boundary = binascii.hexlify(os.urandom(16)).decode('ascii')
+        self.boundary = boundary
+        self.content_type = 'multipart/form-data; boundary=%s' % boundary
+        self.filepath = filepath
+        self._fp = fileobj
+        self._file_length = 0
+        self._file_sent = 0
+
+        segments = []
+        for name, value in fields:
+            segments.append(self._part_header(name) + _to_bytes(value) +
+                            b'\r\n')
+        if filepath is not None or fileobj is not None or \
+                content is not None:
+            if filename is None:
+                filename = os.path.basename(filepath or
+                                            getattr(fileobj, 'name', '') or
+                                            file_field)
+            segments.append(self._part_header(file_field, filename))
+            if content is not None:
+                segments.append(_to_bytes(content))
+            else:
+                self._file_length = self._get_file_length(length)
+                segments.append(_FILE)
+            segments.append(b'\r\n')
+        segments.append(_to_bytes('--%s--\r\n' % boundary))
+        self._segments = [segment for segment in segments
+                          if segment is _FILE or segment]
+        self.length = sum(len(segment) for segment in self._segments
+                          if segment is not _FILE) + self._file_length
+        self._index = 0
+        self._offset = 0
+        self._position = 0
+
+    def _part_header(self, name, filename=None):
+        disposition = 'form-data; name="%s"' % name
+        if filename is not None:
+            disposition += '; filename="%s"' % filename
+        return _to_bytes('--%s\r\nContent-Disposition: %s\r\n\r\n'
+                         % (self.boundary, disposition))
+
+    def _get_file_length(self, length):
+        if length is not None:
+            return length
+        if self.filepath is not None:
+            return os.path.getsize(self.filepath)
+        if hasattr(self._fp, 'filesize'):
+            # A PseudoFile.
+            return self._fp.filesize - self._fp.tell()
+        position = self._fp.tell()
+        self._fp.seek(0, os.SEEK_END)
+        end = self._fp.tell()
+        self._fp.seek(position)
+        return end - position
+
+    def __len__(self):
+        return self.length
+
+    def tell(self):
+        return self._position
+
+    def read(self, size=-1):
+        '''Read at most size bytes of the body, all by default.'''
+        if size is None or size < 0:
+            size = self.length - self._position
+        pieces = []
+        while size > 0 and self._index < len(self._segments):
+            segment = self._segments[self._index]
+            if segment is _FILE:
+                data = self._read_file(size)
+            else:
+                data = segment[self._offset:self._offset + size]
+                self._offset += len(data)
+                if self._offset >= len(segment):
+                    self._index += 1
+                    self._offset = 0
+            pieces.append(data)
+            size -= len(data)
+            self._position += len(data)
+        return b''.join(pieces)
+
+    def _read_file(self, size):
+        if self._fp is None:
+            self._fp = open(self.filepath, 'rb')
+        data = self._fp.read(min(size, self._file_length - self._file_sent))
+        self._file_sent += len(data)
+        if self._file_sent >= self._file_length:
+            self._index += 1
+            if self.filepath is not None:
+                self.close()
+        elif not data:
+            raise Exception('file ended after %d of %d bytes'
+                            % (self._file_sent, self._file_length))
+        return data
+
+    def close(self):
+        '''Close the file opened from filepath.'''
+        if self.filepath is not None and self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,558 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+import binascii
+import hashlib
+import json
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+from ecstest.logger import logger
+from ecstest import config
+from ecstest import constants
+from ecstest import filehelper
+from ecstest import s3requests
+from ecstest import workerpool
+
+cfg = config.get_config()
+
+# Most parts of a multipart upload.
+MAX_PART_NUMBER = 10000
+# Seconds to wait before the first retry of a part, doubled each time.
+RETRY_DELAY = 0.5
+# Least seconds between two writes of the state of a resumable upload.
+CHECKPOINT_INTERVAL = 1.0
+
+
+def get_bucket_url(bucket):
+    '''Return the url of a boto bucket, for s3requests.'''
+    return '%s://%s:%s/%s' % ('https' if bucket.connection.is_secure
+                              else 'http',
+                              bucket.connection.host,
+                              bucket.connection.port,
+                              bucket.name)
+
+
+def multipart_etag(md5_digests):
+    '''
+    Return the ETag of a multipart object from the binary MD5 digests
+    of its parts: the MD5 of the digests, dash, the number of parts.
+    '''
+    md5 = hashlib.md5(b''.join(md5_digests))
+    return '%s-%d' % (md5.hexdigest(), len(md5_digests))
+
+
+def split_parts(length, part_size):
+    '''
+    Return the (part number, offset, size) of the parts of length bytes.
+    part_size grows if length needs more than MAX_PART_NUMBER parts.
+    '''
+    if length <= 0:
+        raise Exception('cannot upload an empty object in parts')
+    part_size = max(part_size, -(-length // MAX_PART_NUMBER))
+    return [(i + 1, offset, min(part_size, length - offset))
+            for i, offset in enumerate(range(0, length, part_size))]
+
+
+def is_transient(err):
+    '''
+    Return whether a request which raised err may succeed if sent
+    again: errors without a response, 5xx, 408 and 429 (slow down).
+    '''
+    response = getattr(err, 'response', None)
+    if response is None:
+        return True
+    return response.status_code >= 500 or \
+        response.status_code in (408, 429)
+
+
+def _local_name(tag):
+    # Drop the namespace of '{namespace}name'.
+    return tag.rsplit('}', 1)[-1]
+
+
+def find_xml_text(content, name):
+    '''Return the text of the first element name of an S3 response.'''
+    for elem in ET.fromstring(content).iter():
+        if _local_name(elem.tag) == name:
+            return (elem.text or '').strip()
+    return None
+
+
+class PartReader(object):
+    '''
+    The size bytes of a part, read from the file object fp, as a body
+    for requests. The MD5 of the part is computed as it is sent,
+    so the data is only read once.
+    '''
+    def __init__(self, fp, size):
+        self.fp = fp
+        self.size = size
+        self.md5 = hashlib.md5()
+        self._remaining = size
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self.fp.read(size)
+        self._remaining -= len(data)
+        self.md5.update(data)
+        return data
+
+    def close(self):
+        self.fp.close()
+
+
+class FileSource(object):
+    '''Parts of a local file, read through mmap slices.'''
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.length = os.path.getsize(filepath)
+
+    def open_part(self, offset, size):
+        return filehelper.FileRange(offset, size, self.filepath)
+
+    def describe(self):
+        '''Return what identifies the content, saved with checkpoints.'''
+        return {'filepath': os.path.abspath(self.filepath),
+                'length': self.length,
+                'mtime': os.path.getmtime(self.filepath)}
+
+
+class PseudoFileSource(object):
+    '''Parts of a PseudoFile of length bytes generated from seed.'''
+    def __init__(self, length, seed=0):
+        self.length = length
+        self.seed = seed
+
+    def open_part(self, offset, size):
+        # A PseudoFile per part, they are not thread safe.
+        pseudofile = filehelper.PseudoFile(self.length, compute_md5=False,
+                                           seed=self.seed)
+        pseudofile.seek(offset)
+        return pseudofile
+
+    def describe(self):
+        return {'pseudofile': True, 'length': self.length, 'seed': self.seed}
+
+
+class UploadedPart(object):
+    '''A part sent to ECS, and the binary MD5 of its data.'''
+    def __init__(self, part_number, size, etag, md5_digest):
+        self.part_number = part_number
+        self.size = size
+        self.etag = etag
+        self.md5_digest = md5_digest
+
+
+class MultipartResult(object):
+    '''
+    The outcome of a multipart upload. expected_etag is computed from
+    the parts sent, etag is the one returned by ECS.
+    '''
+    def __init__(self, upload_id, etag, parts, size, seconds, retries):
+        self.upload_id = upload_id
+        self.etag = etag
+        self.parts = parts
+        self.size = size
+        self.seconds = seconds
+        self.retries = retries
+        self.expected_etag = multipart_etag(
+            [part.md5_digest for part in parts])
+
+    def is_valid(self):
+        return self.etag == self.expected_etag
+
+    def throughput(self):
+        '''Return the bytes sent per second.'''
+        return self.size / self.seconds if self.seconds else 0.0
+
+
+class MultipartUploader(object):
+    '''
+    Upload objects with multipart upload, the parts being sent
+    concurrently by num_workers threads over the pooled sessions
+    of s3requests. At most max_in_flight parts are sent at once.
+
+    A part which fails, or whose ETag doesn't match the MD5 of the data
+    sent, is sent again up to max_retries times, then the upload
+    is aborted. Keep ECSTEST_POOL_MAXSIZE at least num_workers,
+    or connections are not reused.
+
+    uploader = MultipartUploader(bucket, key_name)
+    result = uploader.upload_pseudo_file(constants.ECS_10GB_PLUS_OBJ_SIZE)
+    assert result.is_valid()
+    '''
+    def __init__(self, bucket, key_name,
+                 part_size=cfg['MULTIPART_PART_SIZE'],
+                 num_workers=cfg['MULTIPART_THREADS'],
+                 max_in_flight=None, max_retries=3, headers=None,
+                 signature_version=None):
+        self.bucket = bucket
+        self.key_name = key_name
+        self.url = s3requests.get_key_url(get_bucket_url(bucket), key_name)
+        self.access_key = bucket.connection.provider.access_key
+        self.secret_key = bucket.connection.provider.secret_key
+        self.part_size = max(part_size, constants.S3_MIN_PART_SIZE)
+        self.num_workers = num_workers
+        self.max_in_flight = max_in_flight or num_workers
+        self.max_retries = max_retries
+        self.headers = headers or {}
+        self.signature_version = signature_version
+        self._lock = threading.Lock()
+        self._retries = 0
+
+    def _request(self, method, **kwargs):
+        return s3requests.request(method, self.url, self.access_key,
+                                  self.secret_key,
+                                  signature_version=self.signature_version,
+                                  **kwargs)
+
+    def initiate(self):
+        '''Start a multipart upload and return its upload id.'''
+        response = self._request('POST', headers=self.headers,
+                                 params={'uploads': None})
+        response.raise_for_status()
+        return find_xml_text(response.content, 'UploadId')
+
+    def upload_part(self, upload_id, part_number, source, offset, size):
+        '''
+        Send a part read from source, retrying on failure,
+        and return it as an UploadedPart.
+        '''
+        attempt = 0
+        while True:
+            try:
+                return self._send_part(upload_id, part_number, source,
+                                       offset, size)
+            except Exception as err:
+                if attempt >= self.max_retries or not is_transient(err):
+                    raise
+                attempt += 1
+                with self._lock:
+                    self._retries += 1
+                logger.warn('part %d of %s failed, retry %d: %s',
+                            part_number, self.key_name, attempt, err)
+                time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+
+    def _send_part(self, upload_id, part_number, source, offset, size):
+        reader = PartReader(source.open_part(offset, size), size)
+        try:
+            response = self._request(
+                'PUT', data=reader,
+                params={'partNumber': str(part_number),
+                        'uploadId': upload_id})
+        finally:
+            reader.close()
+        response.raise_for_status()
+        etag = response.headers.get('ETag', '').strip('"')
+        if etag != reader.md5.hexdigest():
+            raise Exception('ETag %s of part %d is not the MD5 %s of the '
+                            'data sent' % (etag, part_number,
+                                           reader.md5.hexdigest()))
+        return UploadedPart(part_number, size, etag, reader.md5.digest())
+
+    def complete(self, upload_id, parts):
+        '''Complete the upload from its parts and return its ETag.'''
+        body = ''.join(
+            '<Part><PartNumber>%d</PartNumber><ETag>"%s"</ETag></Part>'
+            % (part.part_number, part.etag)
+            for part in sorted(parts, key=lambda part: part.part_number))
+        body = '<CompleteMultipartUpload>%s</CompleteMultipartUpload>' % body
+        response = self._request(
+            'POST', data=body.encode('utf-8'),
+            headers={constants.CONTENT_TYPE: constants.APPLICATION_XML},
+            params={'uploadId': upload_id})
+        response.raise_for_status()
+        # Errors may come after a 200, once ECS assembled the parts.
+        if _local_name(ET.fromstring(response.content).tag) == 'Error':
+            raise Exception('cannot complete upload %s of %s: %s'
+                            % (upload_id, self.key_name,
+                               find_xml_text(response.content, 'Message')))
+        return find_xml_text(response.content, 'ETag').strip('"')
+
+    def list_parts(self, upload_id):
+        '''
+        Return the (part number, ETag, size) of the parts of upload_id
+        stored by ECS, page by page.
+        '''
+        parts = []
+        marker = 0
+        while True:
+            response = self._request(
+                'GET', params={'uploadId': upload_id,
+                               'max-parts': str(
+                                   constants.MAX_LIST_PART_NUMBER),
+                               'part-number-marker': str(marker)})
+            response.raise_for_status()
+            truncated = False
+            for elem in ET.fromstring(response.content).iter():
+                name = _local_name(elem.tag)
+                if name == 'Part':
+                    fields = dict((_local_name(child.tag),
+                                   (child.text or '').strip())
+                                  for child in elem)
+                    parts.append((int(fields['PartNumber']),
+                                  fields['ETag'].strip('"'),
+                                  int(fields['Size'])))
+                elif name == 'IsTruncated':
+                    truncated = (elem.text or '').strip() == 'true'
+            if not truncated or not parts or parts[-1][0] <= marker:
+                return parts
+            marker = parts[-1][0]
+
+    def abort(self, upload_id):
+        response = self._request('DELETE', params={'uploadId': upload_id})
+        response.raise_for_status()
+
+    def upload(self, source):
+        '''
+        Upload the source.length bytes of source, a FileSource or
+        PseudoFileSource, and return a MultipartResult.
+        '''
+        started = time.time()
+        self._retries = 0
+        upload_id = self.initiate()
+        try:
+            parts = self.upload_parts(
+                upload_id, source,
+                split_parts(source.length, self.part_size))
+            etag = self.complete(upload_id, parts)
+        except Exception:
+            logger.warn('abort upload %s of %s', upload_id, self.key_name)
+            try:
+                self.abort(upload_id)
+            except Exception as err:
+                logger.warn('cannot abort upload %s: %s', upload_id, err)
+            raise
+        return MultipartResult(upload_id, etag, parts, source.length,
+                               time.time() - started, self._retries)
+
+    def upload_parts(self, upload_id, source, parts):
+        '''
+        Send the (part number, offset, size) parts of source concurrently
+        and return the UploadedPart list. The first failure is raised
+        once the parts in flight are done.
+        '''
+        in_flight = threading.BoundedSemaphore(self.max_in_flight)
+        failed = threading.Event()
+
+        def send(part_number, offset, size):
+            try:
+                # Parts not sent yet are skipped once a part failed.
+                if not failed.is_set():
+                    return self.upload_part(upload_id, part_number,
+                                            source, offset, size)
+            except Exception:
+                failed.set()
+                raise
+            finally:
+                in_flight.release()
+
+        tasks = []
+        with workerpool.WorkerPool(self.num_workers,
+                                   name='ecstest-multipart') as workers:
+            for part_number, offset, size in parts:
+                in_flight.acquire()
+                if failed.is_set():
+                    in_flight.release()
+                    break
+                tasks.append(workers.submit(send, part_number, offset, size))
+        for task in tasks:
+            if task.exception() is not None:
+                task.result()
+        return [task.result() for task in tasks]
+
+    def upload_file(self, filepath):
+        return self.upload(FileSource(filepath))
+
+    def upload_pseudo_file(self, length, seed=0):
+        '''
+        Upload length bytes of a PseudoFile generated from seed,
+        which filehelper.verify_pseudo_data() can check later.
+        '''
+        return self.upload(PseudoFileSource(length, seed))
+
+
+class ResumableUploader(MultipartUploader):
+    '''
+    A MultipartUploader whose upload survives failures and restarts.
+
+    The upload id and the parts sent are saved to state_file,
+    at most every CHECKPOINT_INTERVAL seconds. When upload() is called
+    again for the same key and content, the parts stored by ECS are
+    listed and only the missing ones are sent. A part stored but not
+    saved yet is kept if its ETag is the MD5 of the local data.
+    A failed upload is not aborted, state_file is removed once the
+    upload is completed.
+
+    uploader = ResumableUploader(bucket, key_name, '/var/tmp/big.upload')
+    result = uploader.upload_pseudo_file(constants.ECS_10GB_PLUS_OBJ_SIZE)
+    '''
+    def __init__(self, bucket, key_name, state_file, **kwargs):
+        MultipartUploader.__init__(self, bucket, key_name, **kwargs)
+        self.state_file = state_file
+        self.resumed_parts = 0
+        self._parts = {}
+        self._state = None
+        self._saved = 0
+
+    def upload(self, source):
+        started = time.time()
+        self._retries = 0
+        upload_id = self._resume(source)
+        if upload_id is None:
+            upload_id = self.initiate()
+            self._parts = {}
+            self._state = {'url': self.url,
+                           'source': source.describe(),
+                           'part_size': self.part_size,
+                           'upload_id': upload_id}
+            self._save_state()
+        logger.debug('upload %s of %s: %d parts already sent', upload_id,
+                     self.key_name, len(self._parts))
+        try:
+            missing = [part for part in
+                       split_parts(source.length, self.part_size)
+                       if part[0] not in self._parts]
+            self.upload_parts(upload_id, source, missing)
+            parts = [self._parts[number] for number in sorted(self._parts)]
+            etag = self.complete(upload_id, parts)
+        finally:
+            with self._lock:
+                if self._state is not None:
+                    self._save_state()
+        self._state = None
+        os.remove(self.state_file)
+        return MultipartResult(upload_id, etag, parts, source.length,
+                               time.time() - started, self._retries)
+
+    def upload_part(self, upload_id, part_number, source, offset, size):
+        part = MultipartUploader.upload_part(self, upload_id, part_number,
+                                             source, offset, size)
+        with self._lock:
+            self._parts[part_number] = part
+            if time.time() - self._saved >= CHECKPOINT_INTERVAL:
+                self._save_state()
+        return part
+
+    def _resume(self, source):
+        # Return the upload id of the saved upload of source and load
+        # its parts stored by ECS, or None to start a new upload.
+        state = self._load_state()
+        if state is None:
+            return None
+        if state.get('url') != self.url or \
+                state.get('source') != source.describe():
+            logger.warn('state file %s is for another upload, ignore it',
+                        self.state_file)
+            return None
+        upload_id = state['upload_id']
+        try:
+            stored = self.list_parts(upload_id)
+        except Exception as err:
+            logger.warn('cannot resume upload %s: %s', upload_id, err)
+            return None
+
+        self.part_size = state['part_size']
+        self._state = state
+        saved = dict((part[0], part) for part in state.get('parts', []))
+        expected = dict((part[0], part)
+                        for part in split_parts(source.length,
+                                                self.part_size))
+        self._parts = {}
+        for part_number, etag, size in stored:
+            _, offset, expected_size = expected.get(part_number,
+                                                    (None, 0, None))
+            if size != expected_size:
+                continue
+            if part_number in saved and saved[part_number][2] == etag:
+                md5_digest = binascii.unhexlify(saved[part_number][3])
+            else:
+                md5_digest = self._compute_md5(source, offset, size)
+                if binascii.hexlify(md5_digest).decode('ascii') != etag:
+                    continue
+            self._parts[part_number] = UploadedPart(part_number, size, etag,
+                                                    md5_digest)
+        self.resumed_parts = len(self._parts)
+        return upload_id
+
+    def _compute_md5(self, source, offset, size):
+        reader = PartReader(source.open_part(offset, size), size)
+        try:
+            while reader.read(filehelper.PSEUDO_SPAN_SIZE):
+                pass
+        finally:
+            reader.close()
+        return reader.md5.digest()
+
+    def _load_state(self):
+        if not os.path.exists(self.state_file):
+            return None
+        try:
+            with open(self.state_file) as state_file:
+                return json.load(state_file)
+        except (IOError, ValueError) as err:
+            logger.warn('ignore state file %s: %s', self.state_file, err)
+            return None
+
+    def _save_state(self):
+        # Caller holds self._lock but for a new upload.
+        self._state['parts'] = [
+            (part.part_number, part.size, part.etag,
+             binascii.hexlify(part.md5_digest).decode('ascii'))
+            for part in self._parts.values()]
+        tmp_path = '%s.%d' % (self.state_file, os.getpid())
+        with open(tmp_path, 'w') as state_file:
+            json.dump(self._state, state_file)
+        # rename is atomic, a crash never leaves a partial state file.
+        os.rename(tmp_path, self.state_file)
+        self._saved = time.time()
+
+
+def upload_file(bucket, key_name, filepath, **kwargs):
+    '''
+    Upload filepath to key_name with a parallel multipart upload,
+    kwargs are the ones of MultipartUploader.
+    '''
+    return MultipartUploader(bucket, key_name, **kwargs).upload_file(
+        filepath)
+
+
+def upload_pseudo_file(bucket, key_name, length, seed=0, **kwargs):
+    '''
+    Upload length bytes of a seeded PseudoFile to key_name with
+    a parallel multipart upload.
+    '''
+    return MultipartUploader(bucket, key_name, **kwargs).upload_pseudo_file(
+        length, seed)
+
+
+def upload_resumable(bucket, key_name, state_file, filepath=None,
+                     length=None, seed=0, **kwargs):
+    '''
+    Upload filepath, or length bytes of a PseudoFile generated from seed
+    if filepath is None, with a ResumableUploader. Call it again with
+    the same arguments to resume the upload after a failure.
+    '''
+    uploader = ResumableUploader(bucket, key_name, state_file, **kwargs)
+    if filepath is not None:
+        return uploader.upload_file(filepath)
+    return uploader.upload_pseudo_file(length, seed)
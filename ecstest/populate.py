@@ -0,0 +1,233 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+import hashlib
+import itertools
+import threading
+import time
+
+import six
+
+from ecstest.logger import logger
+from ecstest import config
+from ecstest import constants
+from ecstest import filehelper
+from ecstest import multipart
+from ecstest import s3requests
+from ecstest import topology
+from ecstest import workerpool
+
+cfg = config.get_config()
+
+
+class PopulatedObject(object):
+    '''An object stored by populate(), with its node and timing.'''
+    def __init__(self, name, etag, size, node, seconds, retries):
+        self.name = name
+        self.etag = etag
+        self.size = size
+        self.node = node
+        self.seconds = seconds
+        self.retries = retries
+
+
+class Manifest(object):
+    '''
+    The objects stored by populate(), in the order of their names,
+    and the time the whole population took.
+    '''
+    def __init__(self, objects, seconds):
+        self.objects = objects
+        self.seconds = seconds
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def names(self):
+        return [obj.name for obj in self.objects]
+
+    def etags(self):
+        '''Return a dict of object name to ETag.'''
+        return dict((obj.name, obj.etag) for obj in self.objects)
+
+    @property
+    def size(self):
+        return sum(obj.size for obj in self.objects)
+
+    @property
+    def retries(self):
+        return sum(obj.retries for obj in self.objects)
+
+    def objects_per_second(self):
+        return len(self.objects) / self.seconds if self.seconds else 0.0
+
+    def throughput(self):
+        '''Return the bytes sent per second.'''
+        return self.size / self.seconds if self.seconds else 0.0
+
+
+def get_nodes(bucket):
+    '''
+    Return the hosts to spread requests to bucket over: the nodes of
+    every VDC of the cached topology under ECS, which needs a control
+    plane login, the host of its connection otherwise.
+    Objects written to another VDC may not be listed at once through
+    the host of the bucket.
+    '''
+    if cfg['TEST_TARGET'] == constants.TARGET_ECS:
+        return topology.get_topology().get_nodes()
+    return [bucket.connection.host]
+
+
+class Populator(object):
+    '''
+    Store many objects in a bucket with num_workers threads, each PUT
+    going to the next node of nodes over its pooled session, the host
+    of the bucket connection by default, or e.g. get_nodes(bucket).
+    Names and contents are consumed as they are uploaded, so they may
+    be generators of any length. Every ETag is checked against the MD5
+    of the data sent, a PUT which fails with a transient error is sent
+    again up to max_retries times, the first other failure stops the
+    population and is raised.
+
+    manifest = Populator(bucket, nodes=get_nodes(bucket)).populate(
+        names, sizes=sizes)
+    '''
+    def __init__(self, bucket, num_workers=cfg['POPULATE_THREADS'],
+                 nodes=None, max_retries=3, headers=None,
+                 signature_version=None):
+        if nodes is None:
+            nodes = [bucket.connection.host]
+        if not nodes:
+            raise Exception('no node to populate bucket %s' % bucket.name)
+        self.bucket = bucket
+        self.access_key = bucket.connection.provider.access_key
+        self.secret_key = bucket.connection.provider.secret_key
+        self.num_workers = num_workers
+        self.max_retries = max_retries
+        self.headers = headers
+        self.signature_version = signature_version
+        scheme = 'https' if bucket.connection.is_secure else 'http'
+        self._bucket_urls = [(node, '%s://%s:%s/%s' % (
+            scheme, node, bucket.connection.port, bucket.name))
+            for node in nodes]
+        self._next_node = itertools.cycle(self._bucket_urls)
+        self._lock = threading.Lock()
+
+    def populate(self, names, contents=None, sizes=None, seed=0):
+        '''
+        Store an object for every name of names and return a Manifest.
+        :param contents: the content of each object, a string.
+        :param sizes: the size of each object, filled with a PseudoFile
+            generated from seed.
+        Without contents or sizes, every object contains its name.
+        '''
+        if contents is not None and sizes is not None:
+            raise Exception('contents and sizes are exclusive')
+        if contents is not None:
+            items = six.moves.zip(names, contents)
+        elif sizes is not None:
+            items = six.moves.zip(names, sizes)
+        else:
+            items = ((name, name) for name in names)
+
+        started = time.time()
+        failed = threading.Event()
+
+        def store(name, data):
+            try:
+                if not failed.is_set():
+                    return self._store(name, data, seed)
+            except Exception:
+                failed.set()
+                raise
+
+        tasks = []
+        # Bounded queue, so names are not consumed far ahead of PUTs.
+        with workerpool.WorkerPool(self.num_workers,
+                                   max_pending=self.num_workers,
+                                   name='ecstest-populate') as workers:
+            for name, data in items:
+                if failed.is_set():
+                    break
+                tasks.append(workers.submit(store, name, data))
+        for task in tasks:
+            if task.exception() is not None:
+                task.result()
+        manifest = Manifest([task.result() for task in tasks],
+                            time.time() - started)
+        logger.debug('populated bucket %s with %d objects in %.2fs '
+                     '(%.1f objects/s), %d retries', self.bucket.name,
+                     len(manifest), manifest.seconds,
+                     manifest.objects_per_second(), manifest.retries)
+        return manifest
+
+    def _store(self, name, data, seed):
+        with self._lock:
+            node, bucket_url = next(self._next_node)
+        url = s3requests.get_key_url(bucket_url, name)
+        started = time.time()
+        attempt = 0
+        while True:
+            try:
+                etag, size = self._put(url, name, data, seed)
+                return PopulatedObject(name, etag, size, node,
+                                       time.time() - started, attempt)
+            except Exception as err:
+                if attempt >= self.max_retries or \
+                        not multipart.is_transient(err):
+                    raise
+                attempt += 1
+                logger.warn('PUT %s to %s failed, retry %d: %s',
+                            name, node, attempt, err)
+                time.sleep(multipart.RETRY_DELAY * 2 ** (attempt - 1))
+
+    def _put(self, url, name, data, seed):
+        if isinstance(data, six.integer_types):
+            # A PseudoFile is read again from its start by a retry.
+            body = filehelper.PseudoFile(data, seed=seed)
+            size = data
+        else:
+            if isinstance(data, six.text_type):
+                data = data.encode('utf-8')
+            body = data
+            size = len(data)
+        response = s3requests.put(url, self.access_key, self.secret_key,
+                                  data=body, headers=self.headers,
+                                  signature_version=self.signature_version)
+        # Read the body, so the connection goes back to the pool.
+        response.content
+        response.raise_for_status()
+        if isinstance(body, filehelper.PseudoFile):
+            md5 = body.md5_digest.hexdigest()
+        else:
+            md5 = hashlib.md5(body).hexdigest()
+        etag = response.headers.get('ETag', '').strip('"')
+        if etag != md5:
+            raise Exception('ETag %s of %s is not the MD5 %s of the data '
+                            'sent' % (etag, name, md5))
+        return etag, size
+
+
+def populate(bucket, names, contents=None, sizes=None, seed=0, **kwargs):
+    '''
+    Store an object for every name of names in bucket with a Populator
+    and return its Manifest. kwargs are the ones of Populator.
+    '''
+    return Populator(bucket, **kwargs).populate(names, contents, sizes,
+                                                seed)
@@ -15,97 +15,270 @@ Author: Rubicon ISE team
 
 import base64
 import json
+import threading
 import time
 
 from boto import utils
 
+from ecstest.logger import logger
+from ecstest import config
+from ecstest import constants
+from ecstest import filehelper
+from ecstest import formdata
 from ecstest import s3requests
+from ecstest import signer
+from ecstest import workerpool
 from ecstest.utils import get_signature
 
+cfg = config.get_config()
 
-def post_from_string(bucket, key_name, content, user_metadata=None):
+# A PostPolicy is signed again when it expires within these seconds.
+RENEW_MARGIN = 60
+
+
+def post_from_string(bucket, key_name, content, user_metadata=None,
+                     signature_version=None):
     '''
     Set contents of key by POST method from string.
     '''
     return _post(bucket,
                  key_name,
                  content=content,
-                 user_metadata=user_metadata)
+                 user_metadata=user_metadata,
+                 signature_version=signature_version)
 
 
-def post_from_filename(bucket, key_name, pathfn, user_metadata=None):
+def post_from_filename(bucket, key_name, pathfn, user_metadata=None,
+                       signature_version=None):
     '''
     Set contents of key by POST method from filepath.
     '''
     return _post(bucket,
                  key_name,
                  pathfn=pathfn,
-                 user_metadata=user_metadata)
+                 user_metadata=user_metadata,
+                 signature_version=signature_version)
 
 
-def _post(bucket, key_name, pathfn=None, content=None, user_metadata=None):
+def post_from_pseudo_file(bucket, key_name, length, seed=0,
+                          user_metadata=None, signature_version=None):
     '''
-    Support post with file or text together with user metadata
+    Set contents of key by POST method from a PseudoFile of length
+    bytes generated from seed, streamed as it is generated.
+    Return the pseudofile, whose md5_digest is the MD5 of the data sent,
+    together with the response.
     '''
-    # The policy document contains the expiration and conditions.
-    # The expiration element specifies the expiration date of
-    # the policy in ISO 8601 UTC date format.
-    # Expiration is required in a policy.
-    # The conditions in the policy document validate
-    # the contents of the uploaded object.
-    # Each form field that you specify in the form
-    # (except AWSAccessKeyId, signature, file, policy,
-    # and field names that have an x-ignore- prefix)
-    # must be included in the list of conditions.
-    expiration_time = time.gmtime(time.time() + 3600)
-    policy = {
-        "expiration": time.strftime(utils.ISO8601, expiration_time),
-        "conditions": [
-            {"bucket": bucket.name},
-            {"key": key_name},
-            {"acl": "public-read"},
-            ["starts-with", "$Content-Type", "application/"],
-        ]
-    }
-
-    # Any user metadata should be at policy
-    if user_metadata is not None:
-        for k, v in user_metadata.items():
-            policy['conditions'].append({k: v})
-
-    # Encode the policy by using UTF-8 of json dumps default encoding
-    policy_encoded = base64.b64encode(json.dumps(policy))
-    signature = get_signature(bucket.connection.provider.secret_key,
-                              policy_encoded)
-
-    # Order is retained if form_fields is a list of 2-tuples
-    # but arbitrary if it is supplied as a dict.
-    form_fields = [
-        ('key', key_name),
-        ('acl', 'public-read'),
-        ('Content-Type', 'application/octet-stream'),
-        ('AWSAccessKeyId', bucket.connection.provider.access_key),
-        ('Policy', policy_encoded),
-        ('Signature', signature),
-    ]
-
-    # Any user metadata should be as one form field
-    if user_metadata is not None:
-        for k, v in user_metadata.items():
-            form_fields.append((k, v))
-
-    files = {}
-    if pathfn is not None:
-        # This is to post a file.
-        files = {'file': open(pathfn, 'rb')}
-    elif content is not None:
-        # This is to post a text content.
-        files = {'file': content}
-
-    # Send a http request with post method by requests.
-    # Since boto doesn't support POST at make_request().
-    url = "http://%s:%s/%s/" % (bucket.connection.host,
-                                bucket.connection.port,
-                                bucket.name)
-    response = s3requests.post(url, data=form_fields, files=files)
-    return response
+    pseudofile = filehelper.PseudoFile(length, seed=seed)
+    return pseudofile, _post(bucket,
+                             key_name,
+                             fileobj=pseudofile,
+                             user_metadata=user_metadata,
+                             signature_version=signature_version)
+
+
+def _post(bucket, key_name, pathfn=None, content=None, user_metadata=None,
+          signature_version=None, fileobj=None):
+    '''
+    Support post with file or text together with user metadata.
+    The form is streamed by formdata.FormDataEncoder, so the file
+    is never held in memory.
+    The policy is signed with signature_version 2 or 4,
+    ECSTEST_SIGNATURE_VERSION by default.
+    '''
+    policy = PostPolicy(bucket,
+                        key_name=key_name,
+                        user_metadata=user_metadata,
+                        signature_version=signature_version)
+    return policy.post(key_name, pathfn=pathfn, content=content,
+                       fileobj=fileobj)
+
+
+class PostPolicy(object):
+    '''
+    A POST policy of bucket, signed once and reused for many POSTs.
+    It allows any key starting with key_prefix, or only key_name,
+    and expires after expires_in seconds. It is signed again
+    when it is about to expire, so it can be used for as long as needed.
+    user_metadata are sent with, and required by, every POST.
+
+    policy = PostPolicy(bucket, key_prefix='batch/')
+    for i in range(1000):
+        policy.post('batch/%d' % i, content='data')
+    '''
+    def __init__(self, bucket, key_prefix='', key_name=None,
+                 expires_in=3600, acl='public-read', user_metadata=None,
+                 signature_version=None):
+        if signature_version is None:
+            signature_version = cfg['SIGNATURE_VERSION']
+        self.bucket = bucket
+        self.key_prefix = key_prefix
+        self.key_name = key_name
+        self.expires_in = expires_in
+        self.acl = acl
+        self.user_metadata = user_metadata
+        self.signature_version = int(signature_version)
+        # Send a http request with post method by requests.
+        # Since boto doesn't support POST at make_request().
+        self.url = "http://%s:%s/%s/" % (bucket.connection.host,
+                                         bucket.connection.port,
+                                         bucket.name)
+        self.expires = 0
+        self._fields = None
+        self._lock = threading.Lock()
+
+    def _sign(self):
+        # The policy document contains the expiration and conditions.
+        # The expiration element specifies the expiration date of
+        # the policy in ISO 8601 UTC date format.
+        # Expiration is required in a policy.
+        # The conditions in the policy document validate
+        # the contents of the uploaded object.
+        # Each form field that you specify in the form
+        # (except AWSAccessKeyId, signature, file, policy,
+        # and field names that have an x-ignore- prefix)
+        # must be included in the list of conditions.
+        provider = self.bucket.connection.provider
+        now = time.time()
+        if self.key_name is not None:
+            key_condition = {"key": self.key_name}
+        else:
+            key_condition = ["starts-with", "$key", self.key_prefix]
+        policy = {
+            "expiration": time.strftime(utils.ISO8601,
+                                        time.gmtime(now + self.expires_in)),
+            "conditions": [
+                {"bucket": self.bucket.name},
+                key_condition,
+                {"acl": self.acl},
+                ["starts-with", "$Content-Type", "application/"],
+            ]
+        }
+
+        # Any user metadata should be at policy
+        if self.user_metadata is not None:
+            for k, v in self.user_metadata.items():
+                policy['conditions'].append({k: v})
+
+        if self.signature_version == 4:
+            # The SigV4 fields are signed by the policy itself.
+            sigv4 = signer.get_sigv4_signer()
+            amz_date = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(now))
+            credential = '%s/%s' % (provider.access_key,
+                                    sigv4.get_scope(amz_date[:8]))
+            auth_fields = [
+                ('x-amz-algorithm', signer.SIGV4_ALGORITHM),
+                ('x-amz-credential', credential),
+                ('x-amz-date', amz_date),
+            ]
+            for k, v in auth_fields:
+                policy['conditions'].append({k: v})
+
+        # Encode the policy by using UTF-8 of json dumps default encoding
+        policy_encoded = base64.b64encode(
+            json.dumps(policy).encode('utf-8')).decode('ascii')
+
+        if self.signature_version == 4:
+            signature = sigv4.sign_string(provider.secret_key,
+                                          amz_date[:8], policy_encoded)
+            auth_fields += [
+                ('Policy', policy_encoded),
+                ('x-amz-signature', signature),
+            ]
+        else:
+            signature = get_signature(provider.secret_key, policy_encoded)
+            auth_fields = [
+                ('AWSAccessKeyId', provider.access_key),
+                ('Policy', policy_encoded),
+                ('Signature', signature),
+            ]
+
+        # Any user metadata should be as one form field
+        if self.user_metadata is not None:
+            auth_fields += list(self.user_metadata.items())
+        self._fields = auth_fields
+        self.expires = now + self.expires_in
+
+    def form_fields(self, key_name):
+        '''
+        Return the form fields to POST key_name, signing the policy
+        if it expires within RENEW_MARGIN seconds.
+        '''
+        if self.key_name is not None and key_name != self.key_name:
+            raise Exception('the policy only allows key %s, not %s'
+                            % (self.key_name, key_name))
+        if not key_name.startswith(self.key_prefix):
+            raise Exception('key %s does not start with %s'
+                            % (key_name, self.key_prefix))
+        with self._lock:
+            if time.time() + RENEW_MARGIN >= self.expires:
+                self._sign()
+            fields = self._fields
+        # Order is retained if form_fields is a list of 2-tuples
+        # but arbitrary if it is supplied as a dict.
+        return [
+            ('key', key_name),
+            ('acl', self.acl),
+            ('Content-Type', 'application/octet-stream'),
+        ] + fields
+
+    def post(self, key_name, pathfn=None, content=None, fileobj=None,
+             pooled=True):
+        '''
+        Set contents of key_name by POST method from pathfn, content
+        or fileobj and return the response.
+        '''
+        with formdata.FormDataEncoder(self.form_fields(key_name),
+                                      filepath=pathfn, fileobj=fileobj,
+                                      content=content) as body:
+            return s3requests.post(
+                self.url, data=body, pooled=pooled,
+                headers={constants.CONTENT_TYPE: body.content_type})
+
+
+def post_batch(policy, key_names, content=None, length=None, seed=0,
+               num_workers=constants.DEFAULT_THREAD_NUMBER, pooled=True):
+    '''
+    POST every key of key_names concurrently with policy, signed once,
+    e.g. to measure the POST rate of ECS apart from the signing cost,
+    and return the stats of the run: requests, errors, seconds,
+    requests_per_second and statuses, the count of responses per
+    status code.
+    Every key is set to content, or to a PseudoFile of length bytes
+    generated from seed.
+    '''
+    if content is None and length is None:
+        raise Exception('either content or length is required')
+    statuses = {}
+    errors = [0]
+    lock = threading.Lock()
+
+    def send(key_name):
+        fileobj = None
+        if content is None:
+            fileobj = filehelper.PseudoFile(length, compute_md5=False,
+                                            seed=seed)
+        try:
+            response = policy.post(key_name, content=content,
+                                   fileobj=fileobj, pooled=pooled)
+            # Read the body, so the connection goes back to the pool.
+            response.content
+            status = response.status_code
+        except Exception as err:
+            logger.debug('POST %s failed: %s', key_name, err)
+            status = None
+        with lock:
+            if status is None or status >= 400:
+                errors[0] += 1
+            if status is not None:
+                statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.time()
+    with workerpool.WorkerPool(num_workers,
+                               name='ecstest-post') as workers:
+        count = len(workers.map(send, key_names))
+    seconds = time.time() - started
+    return {'requests': count,
+            'errors': errors[0],
+            'seconds': seconds,
+            'requests_per_second': count / seconds if seconds else 0.0,
+            'statuses': statuses}
@@ -0,0 +1,189 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+import threading
+import time
+
+from boto.s3.bucket import Bucket
+from boto.s3.key import Key
+
+from ecstest.logger import logger
+from ecstest import config
+from ecstest import constants
+from ecstest import workerpool
+
+cfg = config.get_config()
+
+
+def clone_bucket(bucket):
+    '''
+    Return the same bucket over a new connection with the same
+    endpoint and credentials, for use by another thread.
+    '''
+    conn = bucket.connection
+    new_conn = conn.__class__(
+        aws_access_key_id=conn.aws_access_key_id,
+        aws_secret_access_key=conn.aws_secret_access_key,
+        is_secure=conn.is_secure,
+        port=conn.port,
+        host=conn.host,
+        calling_format=conn.calling_format)
+    return Bucket(new_conn, bucket.name)
+
+
+class BucketPurger(object):
+    '''
+    Delete every key of a bucket, and every version and delete marker
+    when versioning is or was enabled on it.
+
+    Listing is pipelined with deletion: each page of up to 1000 keys
+    is deleted by a multi-object delete while the next page is listed,
+    num_workers deletes running concurrently.
+    Under FAKES3, which doesn't support multi-object delete finely,
+    keys are deleted one by one by the workers.
+    '''
+    def __init__(self, bucket, target,
+                 num_workers=cfg['PURGE_THREADS'],
+                 versions=None, max_passes=3):
+        self.bucket = bucket
+        self.target = target
+        self.num_workers = num_workers
+        self.versions = versions
+        self.max_passes = max_passes
+        self._local = threading.local()
+
+    def _get_bucket(self):
+        # boto connections are not shared between threads.
+        bucket = getattr(self._local, 'bucket', None)
+        if bucket is None:
+            bucket = clone_bucket(self.bucket)
+            self._local.bucket = bucket
+        return bucket
+
+    def _is_versioned(self):
+        if self.versions is not None:
+            return self.versions
+        try:
+            # The status is empty if versioning has never been enabled.
+            return bool(self.bucket.get_versioning_status())
+        except Exception as err:
+            logger.debug('get versioning status of bucket %s failed: %s',
+                         self.bucket.name, err)
+            return False
+
+    def purge(self):
+        '''
+        Delete all keys and return stats of the purge:
+        deleted, errors, passes, seconds and keys_per_second.
+        '''
+        stats = {'deleted': 0, 'errors': 0, 'passes': 0}
+        start = time.time()
+        if self.target == constants.TARGET_FAKES3:
+            self._purge_one_by_one(stats)
+        else:
+            versions = self._is_versioned()
+            # Another pass picks up keys whose delete failed.
+            while stats['passes'] < self.max_passes:
+                stats['passes'] += 1
+                errors = stats['errors']
+                self._purge_pages(versions, stats)
+                if stats['errors'] == errors:
+                    break
+        stats['seconds'] = time.time() - start
+        stats['keys_per_second'] = \
+            stats['deleted'] / stats['seconds'] if stats['seconds'] else 0.0
+        logger.debug('purged %d keys of bucket %s in %.2fs (%.1f keys/s), '
+                     '%d errors', stats['deleted'], self.bucket.name,
+                     stats['seconds'], stats['keys_per_second'],
+                     stats['errors'])
+        return stats
+
+    def _purge_pages(self, versions, stats):
+        # Bounded queue, so listing doesn't run far ahead of deletes.
+        pool = workerpool.WorkerPool(self.num_workers,
+                                     max_pending=self.num_workers,
+                                     name='ecstest-purge')
+        tasks = []
+        try:
+            if versions:
+                pages = self._iter_version_pages()
+            else:
+                pages = self._iter_key_pages()
+            for page in pages:
+                tasks.append(pool.submit(self._delete_page, page))
+        finally:
+            pool.shutdown()
+        for task in tasks:
+            deleted, errors = task.result()
+            stats['deleted'] += deleted
+            stats['errors'] += errors
+
+    def _iter_key_pages(self):
+        marker = ''
+        while True:
+            # The most keys of S3/fakes3/ecs returned
+            # by each time is 1000.
+            page = self.bucket.get_all_keys(marker=marker)
+            if len(page) == 0:
+                return
+            yield list(page)
+            if not page.is_truncated:
+                return
+            marker = page[-1].name
+
+    def _iter_version_pages(self):
+        key_marker = ''
+        version_id_marker = ''
+        while True:
+            page = self.bucket.get_all_versions(
+                key_marker=key_marker,
+                version_id_marker=version_id_marker)
+            if len(page) == 0:
+                return
+            yield list(page)
+            if not page.is_truncated:
+                return
+            key_marker = page.next_key_marker
+            version_id_marker = page.next_version_id_marker
+
+    def _delete_page(self, page):
+        result = self._get_bucket().delete_keys(page, quiet=True)
+        for error in result.errors:
+            logger.debug('delete key %s(%s) failed: %s',
+                         error.key, error.version_id, error.message)
+        return len(page) - len(result.errors), len(result.errors)
+
+    def _delete_key(self, name):
+        Key(self._get_bucket(), name).delete()
+
+    def _purge_one_by_one(self, stats):
+        with workerpool.WorkerPool(self.num_workers,
+                                   name='ecstest-purge') as pool:
+            while True:
+                # Fakes3 doesn't support markers finely, so list from
+                # the start once the previous page is deleted.
+                key_list = self.bucket.get_all_keys()
+                if len(key_list) == 0:
+                    break
+                stats['passes'] += 1
+                tasks = [pool.submit(self._delete_key, key.name)
+                         for key in key_list]
+                deleted = len([task for task in tasks
+                               if task.exception() is None])
+                stats['deleted'] += deleted
+                stats['errors'] += len(tasks) - deleted
+                if deleted == 0:
+                    # Nothing can be deleted, don't list it forever.
+                    break
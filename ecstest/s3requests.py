@@ -13,14 +13,19 @@
 Author: Rubicon ISE team
 '''
 
-import requests
-from email.utils import formatdate
-from requests.packages.urllib3.util import parse_url
+import multiprocessing
+import threading
+import time
+
+import six
+from six.moves.urllib.parse import quote
 
 from ecstest.logger import logger
-from ecstest import constants
 from ecstest import config
-from ecstest import utils
+from ecstest import constants
+from ecstest import sessionpool
+from ecstest import signer
+from ecstest import workerpool
 
 cfg = config.get_config()
 
@@ -61,9 +66,12 @@ def post(url, **kwargs):
         if none will use default.
     :param secret_key: secret_key for signature usage.
         if none will use default.
+    :param pooled: reuse the shared keep-alive session of the host,
+        set False to send over a brand-new session.
     :param **kwargs: Optional arguments that ``request`` takes.
     """
-    return requests.Session().post(url, **kwargs)
+    pooled = kwargs.pop('pooled', True)
+    return sessionpool.get_session(url, pooled).post(url, **kwargs)
 
 
 def head(url, access_key=None, secret_key=None, **kwargs):
@@ -126,118 +134,141 @@ def request(method, url, access_key, secret_key, **kwargs):
     This is to construct a whole headers by adding basic header
     e.g. Date/Authorization besides user defined.
     And also sort params by its name for signature.
+    The request goes over the shared keep-alive session of the host
+    unless ``pooled=False`` is given, e.g. to force a cold connection.
+    ``signature_version=4`` signs with SigV4 instead of the
+    ECSTEST_SIGNATURE_VERSION default, ``payload_hash`` then gives
+    the SHA256 of data computed beforehand, or signer.UNSIGNED_PAYLOAD.
     """
-    if access_key is None:
-        access_key = cfg['ACCESS_KEY']
-    if secret_key is None:
-        secret_key = cfg['ACCESS_SECRET']
-    logger.debug('access_key: %s, secret_key: %s', access_key, secret_key)
-
-    if 'headers' in kwargs:
-        headers = kwargs['headers'].copy()
-    else:
-        headers = {}
-
-    if not find_matching_headers(constants.DATE, headers):
-        headers[constants.DATE] = formatdate(usegmt=True)
-
-    string_to_sign = '%s\n' % method
-    if find_matching_headers(constants.CONTENT_MD5, headers):
-        string_to_sign += '%s\n' % headers[constants.CONTENT_MD5]
-    else:
-        string_to_sign += '\n'
-
-    if find_matching_headers(constants.CONTENT_TYPE, headers):
-        string_to_sign += '%s\n' % headers[constants.CONTENT_TYPE]
-    else:
-        string_to_sign += '\n'
-
-    string_to_sign += headers[constants.DATE] + '\n'
-
-    # Sort canonicalizedAmzHeaders by name
-    amz_keys = [h for h in headers if h.lower().startswith('x-amz-')]
-    amz_keys.sort()
-    for key in amz_keys:
-        string_to_sign += '%s:%s\n' % (key, headers[key].strip())
-
-    canonicalized_resource = ''
-
-    # The subresources that must be included
-    # when constructing the CanonicalizedResource
-    # for calculating signature.
-    subresources = ['acl', 'lifecycle', 'location', 'logging',
-                    'notification', 'partNumber', 'policy',
-                    'requestPayment', 'torrent', 'uploadId',
-                    'uploads', 'versionId', 'versioning',
-                    'versions', 'website']
-
-    _, _, _, _, path, _, _ = parse_url(url)
-
-    if not path:
-        path = '/'
-
-    canonicalized_resource += path
-
-    if 'params' in kwargs:
-        params = kwargs['params'].copy()
-    else:
-        params = {}
-
-    subresource_without_value = []
-    subresource_to_sign = []
-
-    # Sort subresource by name, otherwise signature will not match.
-    # If the value of key in dict params is none, e.g. ?acl,
-    # it will not be appended to query string by requests parsing.
-    # So need to pick it up from params to query string by manual.
-    params = sorted(params.items(), key=lambda d: d[0])
-    for key, value in params:
-        if key in subresources:
-            # subresource has value
-            if value is not None:
-                subresource_to_sign.append('%s=%s' % (key, value))
-            else:
-                subresource_to_sign.append('%s' % key)
-                subresource_without_value.append('%s' % key)
-        else:
-            if value is None:
-                subresource_without_value.append('%s' % key)
-
-    if subresource_to_sign:
-        canonicalized_resource += '?'
-        canonicalized_resource += '&'.join(subresource_to_sign)
-
-    if subresource_without_value:
-        url += '?'
-        url += '&'.join(subresource_without_value)
-
-    string_to_sign += canonicalized_resource
-    logger.debug('string to sign:\n%s', string_to_sign)
-    logger.debug('request url:\n%s', url)
-
-    headers[constants.AUTHORIZATION] = 'AWS %s:%s' \
-                                       % (access_key,
-                                          utils.get_signature(secret_key,
-                                                              string_to_sign))
-    logger.debug('headers is ' + repr(headers))
+    pooled = kwargs.pop('pooled', True)
+    url, headers, params = signer.sign(
+        method, url, access_key, secret_key,
+        kwargs.get('headers'), kwargs.get('params'),
+        signature_version=kwargs.pop('signature_version', None),
+        payload_hash=kwargs.pop('payload_hash', None),
+        body=kwargs.get('data'))
 
     if 'verify' not in kwargs:
         kwargs['verify'] = False
 
     kwargs['timeout'] = cfg['REQUEST_TIMEOUT']
     kwargs['headers'] = headers
-    logger.debug('kwargs headers is ' + repr(kwargs['headers']))
+    logger.debug('kwargs headers is %r', headers)
     kwargs['params'] = params
-    logger.debug('kwargs params is ' + repr(kwargs['params']))
+    logger.debug('kwargs params is %r', params)
 
-    session = requests.Session()
+    session = sessionpool.get_session(url, pooled)
     response = session.request(method, url, **kwargs)
     return response
 
 
-def find_matching_headers(name, headers):
+def presign(method, url, access_key=None, secret_key=None, expires_in=3600,
+            params=None, signature_version=None):
+    """Return a presigned url, which anyone can send method to
+    within expires_in seconds, without an Authorization header.
+    :param url: URL of the object, combined of
+        scheme://host:port/path, not include query string
+    :param params: subresources to sign, e.g. {'versionId': ...}
+    :param signature_version: 2 or 4,
+        ECSTEST_SIGNATURE_VERSION by default.
+    """
+    return signer.presign(method, url, access_key, secret_key, expires_in,
+                          params, signature_version)
+
+
+def presign_batch(method, bucket_url, key_names, access_key=None,
+                  secret_key=None, expires_in=3600, signature_version=None,
+                  processes=0):
+    """Presign method on every key of bucket_url up front,
+    and return the urls in the order of key_names.
+    :param bucket_url: URL of the bucket, e.g. http://host:port/bucket
+    :param processes: spread the signing over that many processes,
+        worth it for tens of thousands of keys only.
     """
-    Takes a specific header name and a dict of headers {"name": "value"}.
-    Returns a list of matching header names, case-insensitive.
+    if access_key is None:
+        access_key = cfg['ACCESS_KEY']
+    if secret_key is None:
+        secret_key = cfg['ACCESS_SECRET']
+    if signature_version is None:
+        signature_version = cfg['SIGNATURE_VERSION']
+
+    key_names = list(key_names)
+    if processes <= 1 or len(key_names) < 2 * processes:
+        return _presign_keys((method, bucket_url, key_names, access_key,
+                              secret_key, expires_in, signature_version))
+
+    # Every process gets a single slice, not one task per key.
+    size = (len(key_names) + processes - 1) // processes
+    slices = [(method, bucket_url, key_names[i:i + size], access_key,
+               secret_key, expires_in, signature_version)
+              for i in range(0, len(key_names), size)]
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_presign_keys, slices)
+    finally:
+        pool.close()
+        pool.join()
+    return [url for urls in results for url in urls]
+
+
+def _presign_keys(args):
+    # Run by the processes of presign_batch, must stay picklable.
+    (method, bucket_url, key_names, access_key, secret_key, expires_in,
+     signature_version) = args
+    bucket_url = bucket_url.rstrip('/')
+    return [signer.presign(method, get_key_url(bucket_url, key_name),
+                           access_key, secret_key, expires_in,
+                           signature_version=signature_version)
+            for key_name in key_names]
+
+
+def get_key_url(bucket_url, key_name):
+    """Return the url of key_name in bucket_url, quoted."""
+    if isinstance(key_name, six.text_type):
+        key_name = key_name.encode('utf-8')
+    return '%s/%s' % (bucket_url.rstrip('/'), quote(key_name, safe='/~'))
+
+
+def replay_presigned(method, urls, data=None, headers=None,
+                     num_workers=constants.DEFAULT_THREAD_NUMBER,
+                     pooled=True):
+    """Send method to every presigned url concurrently,
+    with no signing cost per request, e.g. to measure the pure
+    request rate of ECS, and return the stats of the run:
+    requests, errors, seconds, requests_per_second and statuses,
+    the count of responses per status code.
+    :param data: the body of every PUT.
+    :param headers: headers sent with every request, they must be
+        the ones the urls were signed with, if any.
     """
-    return [h for h in headers if h.lower() == name.lower()]
+    statuses = {}
+    errors = [0]
+    lock = threading.Lock()
+
+    def send(url):
+        try:
+            response = sessionpool.get_session(url, pooled).request(
+                method, url, data=data, headers=headers, verify=False,
+                timeout=cfg['REQUEST_TIMEOUT'])
+            # Read the body, so the connection goes back to the pool.
+            response.content
+            status = response.status_code
+        except Exception as err:
+            logger.debug('presigned %s %s failed: %s', method, url, err)
+            status = None
+        with lock:
+            if status is None or status >= 400:
+                errors[0] += 1
+            if status is not None:
+                statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.time()
+    with workerpool.WorkerPool(num_workers,
+                               name='ecstest-presigned') as workers:
+        count = len(workers.map(send, urls))
+    seconds = time.time() - started
+    return {'requests': count,
+            'errors': errors[0],
+            'seconds': seconds,
+            'requests_per_second': count / seconds if seconds else 0.0,
+            'statuses': statuses}
@@ -0,0 +1,240 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+import atexit
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util import parse_url
+from requests.sessions import merge_setting
+from requests.utils import get_environ_proxies
+
+from ecstest.logger import logger
+from ecstest import config
+
+cfg = config.get_config()
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def get_pool_key(url):
+    '''
+    Return the (scheme, host, port) tuple a pooled session is keyed by.
+    '''
+    parsed = parse_url(url)
+    scheme = (parsed.scheme or 'http').lower()
+    host = (parsed.host or '').lower()
+    port = parsed.port or DEFAULT_PORTS.get(scheme)
+    return scheme, host, port
+
+
+class _HostSession(requests.Session):
+    '''
+    A requests.Session for the host of url, which reads the proxies
+    and CA bundle of the environment once. requests.Session scans
+    os.environ for them again on every request.
+    '''
+    def __init__(self, url):
+        requests.Session.__init__(self)
+        self.env_proxies = get_environ_proxies(url)
+        self.env_verify = (os.environ.get('REQUESTS_CA_BUNDLE') or
+                           os.environ.get('CURL_CA_BUNDLE'))
+
+    def merge_environment_settings(self, url, proxies, stream, verify,
+                                   cert):
+        # Same as requests.Session, with the environment read above.
+        if self.trust_env:
+            if proxies is not None:
+                for name, value in self.env_proxies.items():
+                    proxies.setdefault(name, value)
+            if (verify is True or verify is None) and self.env_verify:
+                verify = self.env_verify
+        return {'proxies': merge_setting(proxies, self.proxies),
+                'stream': merge_setting(stream, self.stream),
+                'verify': merge_setting(verify, self.verify),
+                'cert': merge_setting(cert, self.cert)}
+
+
+class _PooledSession(object):
+    '''
+    A keep-alive requests.Session bound to one scheme/host/port.
+    '''
+    def __init__(self, key, pool_connections, pool_maxsize, pool_block):
+        self.key = key
+        self.session = _HostSession('%s://%s:%s' % key)
+        self.adapter = HTTPAdapter(pool_connections=pool_connections,
+                                   pool_maxsize=pool_maxsize,
+                                   pool_block=pool_block)
+        self.session.mount('%s://' % key[0], self.adapter)
+        self.leases = 0
+        self.created = time.time()
+        self.last_used = self.created
+
+    def touch(self):
+        self.leases += 1
+        self.last_used = time.time()
+
+    def stats(self):
+        '''
+        Sum the urllib3 counters over every connection pool of the adapter.
+        '''
+        opened = 0
+        sent = 0
+        pools = self.adapter.poolmanager.pools
+        for pool_key in list(pools.keys()):
+            try:
+                pool = pools[pool_key]
+            except KeyError:
+                # Evicted by urllib3 between keys() and lookup.
+                continue
+            opened += pool.num_connections
+            sent += pool.num_requests
+        return {
+            'leases': self.leases,
+            'requests': sent,
+            'connections_opened': opened,
+            'reuse_count': max(sent - opened, 0),
+            'idle_seconds': time.time() - self.last_used,
+        }
+
+    def close(self):
+        self.session.close()
+
+
+class SessionRegistry(object):
+    '''
+    Thread-safe registry of keep-alive sessions keyed by scheme/host/port.
+
+    Sessions idle for longer than idle_timeout seconds are closed and
+    dropped the next time the registry is used.
+    '''
+    def __init__(self,
+                 pool_connections=cfg['POOL_CONNECTIONS'],
+                 pool_maxsize=cfg['POOL_MAXSIZE'],
+                 pool_block=cfg['POOL_BLOCK'],
+                 idle_timeout=cfg['POOL_IDLE_TIMEOUT']):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._retired = {}
+
+    def get_session(self, url):
+        '''
+        Return the shared session serving the scheme/host/port of url.
+        '''
+        key = get_pool_key(url)
+        with self._lock:
+            self._evict_idle()
+            pooled = self._sessions.get(key)
+            if pooled is None:
+                logger.debug('open session pool for %s://%s:%s', *key)
+                pooled = _PooledSession(key,
+                                        self.pool_connections,
+                                        self.pool_maxsize,
+                                        self.pool_block)
+                self._sessions[key] = pooled
+            pooled.touch()
+            return pooled.session
+
+    def _evict_idle(self):
+        # Caller holds self._lock.
+        if not self.idle_timeout or self.idle_timeout <= 0:
+            return
+        now = time.time()
+        for key, pooled in list(self._sessions.items()):
+            if now - pooled.last_used > self.idle_timeout:
+                logger.debug('evict idle session pool for %s://%s:%s', *key)
+                self._retire(key, pooled)
+
+    def _retire(self, key, pooled):
+        # Keep the counters of closed pools so stats stay cumulative.
+        retired = self._retired.setdefault(key, {'leases': 0,
+                                                 'requests': 0,
+                                                 'connections_opened': 0,
+                                                 'reuse_count': 0})
+        for name, value in pooled.stats().items():
+            if name in retired:
+                retired[name] += value
+        del self._sessions[key]
+        pooled.close()
+
+    def stats(self):
+        '''
+        Return per-pool counters as a dict keyed by 'scheme://host:port'.
+        '''
+        result = {}
+        with self._lock:
+            keys = set(self._sessions) | set(self._retired)
+            for key in keys:
+                entry = {'leases': 0,
+                         'requests': 0,
+                         'connections_opened': 0,
+                         'reuse_count': 0,
+                         'idle_seconds': None}
+                for name, value in self._retired.get(key, {}).items():
+                    entry[name] += value
+                pooled = self._sessions.get(key)
+                if pooled is not None:
+                    for name, value in pooled.stats().items():
+                        if name == 'idle_seconds':
+                            entry[name] = value
+                        else:
+                            entry[name] += value
+                result['%s://%s:%s' % key] = entry
+        return result
+
+    def close(self):
+        '''
+        Close every pooled session. Later calls open new ones on demand.
+        '''
+        with self._lock:
+            for key, pooled in list(self._sessions.items()):
+                self._retire(key, pooled)
+
+
+_registry = SessionRegistry()
+atexit.register(_registry.close)
+
+
+def get_registry():
+    '''Return the process-wide session registry.'''
+    return _registry
+
+
+def get_session(url, pooled=True):
+    '''
+    Return a session for url.
+    A shared keep-alive session by default, or a brand-new one
+    when pooled is False, e.g. for tests that need a cold connection.
+    '''
+    if not pooled:
+        return requests.Session()
+    return _registry.get_session(url)
+
+
+def get_pool_stats():
+    '''Return the per-pool stats of the process-wide registry.'''
+    return _registry.stats()
+
+
+def close_sessions():
+    '''Close all sessions of the process-wide registry.'''
+    _registry.close()
@@ -0,0 +1,479 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+import binascii
+import hashlib
+import hmac
+import re
+import threading
+import time
+
+import six
+from email.utils import formatdate
+from requests.packages.urllib3.util import parse_url
+from six.moves.urllib.parse import quote, unquote, urlencode
+
+from ecstest.logger import logger
+from ecstest import constants
+from ecstest import config
+
+cfg = config.get_config()
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+SIGV4_ALGORITHM = 'AWS4-HMAC-SHA256'
+UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+# The payload of aws-chunked uploads, each chunk being signed.
+STREAMING_PAYLOAD = 'STREAMING-AWS4-HMAC-SHA256-PAYLOAD'
+CHUNK_ALGORITHM = 'AWS4-HMAC-SHA256-PAYLOAD'
+EMPTY_SHA256 = hashlib.sha256(b'').hexdigest()
+# The subresources that must be included
+# when constructing the CanonicalizedResource
+# for calculating signature.
+SUBRESOURCES = frozenset([
+    'acl', 'lifecycle', 'location', 'logging', 'notification',
+    'partNumber', 'policy', 'requestPayment', 'torrent', 'uploadId',
+    'uploads', 'versionId', 'versioning', 'versions', 'website'])
+# A path parse_url() leaves as it is.
+_PLAIN_PATH = re.compile(r"[A-Za-z0-9_~!$&'()*+,;=:@./-]*$")
+# Headers which may be changed on the way to the server.
+SIGV4_UNSIGNED_HEADERS = ('authorization', 'expect', 'user-agent',
+                          'x-amzn-trace-id')
+
+
+def get_signature(secret_key, string_to_sign):
+    '''
+    Get the signature for authorization
+    '''
+    hashed = hmac.new(secret_key.encode('utf-8'),
+                      string_to_sign.encode('utf-8'), hashlib.sha1)
+    signature = binascii.b2a_base64(hashed.digest()).strip()
+    if not isinstance(signature, str):
+        # bytes under python 3
+        signature = signature.decode('ascii')
+    return signature
+
+
+def sign_request(method, url, access_key=None, secret_key=None,
+                 headers=None, params=None):
+    """Sign a request without sending it.
+    Add Date/Authorization to a copy of headers, and append
+    subresources without value to url.
+    Return a tuple of (url, headers, params), params being
+    the sorted list of (name, value) pairs to send.
+    """
+    return _sigv2_signer.sign_request(method, url, access_key, secret_key,
+                                      headers, params)
+
+
+def presign_url(method, url, access_key=None, secret_key=None,
+                expires_in=3600, headers=None, params=None):
+    """Return url with SigV2 query string authentication,
+    valid for expires_in seconds.
+    headers are the Content-MD5, Content-Type and x-amz-* headers
+    the request will be sent with, if any.
+    """
+    if access_key is None:
+        access_key = cfg['ACCESS_KEY']
+    if secret_key is None:
+        secret_key = cfg['ACCESS_SECRET']
+
+    expires = str(int(time.time() + expires_in))
+    string_to_sign, url, params = _sigv2_signer.get_string_to_sign(
+        method, url, headers or {}, expires, params)
+    query = [(key, value) for key, value in params if value is not None]
+    query += [('AWSAccessKeyId', access_key),
+              ('Expires', expires),
+              ('Signature', get_signature(secret_key, string_to_sign))]
+    return '%s%s%s' % (url, '&' if '?' in url else '?', urlencode(query))
+
+
+def find_matching_headers(name, headers):
+    """
+    Takes a specific header name and a dict of headers {"name": "value"}.
+    Returns a list of matching header names, case-insensitive.
+    """
+    return [h for h in headers if h.lower() == name.lower()]
+
+
+class SigV2Signer(object):
+    '''
+    Sign requests with AWS Signature Version 2.
+
+    Every request sent by s3requests goes through sign_request(),
+    so the headers are scanned once into their canonical fields
+    and the Date header is formatted once per second.
+    '''
+    def __init__(self):
+        self._date = (None, None)
+
+    def get_date(self):
+        '''Return the Date header of the current second.'''
+        now = int(time.time())
+        # One tuple, so threads never see a date of another second.
+        second, date = self._date
+        if second != now:
+            date = formatdate(now, usegmt=True)
+            self._date = (now, date)
+        return date
+
+    def sign_request(self, method, url, access_key=None, secret_key=None,
+                     headers=None, params=None):
+        """Sign a request without sending it, see sign_request()."""
+        if access_key is None:
+            access_key = cfg['ACCESS_KEY']
+        if secret_key is None:
+            secret_key = cfg['ACCESS_SECRET']
+
+        if headers is not None:
+            headers = headers.copy()
+        else:
+            headers = {}
+
+        date = None
+        for name, value in headers.items():
+            if name.lower() == 'date':
+                date = value
+                break
+        if date is None:
+            date = headers[constants.DATE] = self.get_date()
+
+        string_to_sign, url, params = self.get_string_to_sign(
+            method, url, headers, date, params)
+        headers[constants.AUTHORIZATION] = 'AWS %s:%s' % (
+            access_key, get_signature(secret_key, string_to_sign))
+        logger.debug('headers is %r', headers)
+        return url, headers, params
+
+    def get_string_to_sign(self, method, url, headers, date_or_expires,
+                           params):
+        '''
+        Return the string to sign, url with the subresources
+        without value appended, and the sorted list of params.
+        '''
+        content_md5 = content_type = ''
+        amz_headers = []
+        for name, value in headers.items():
+            lower_name = name.lower()
+            if lower_name == 'content-md5':
+                content_md5 = value
+            elif lower_name == 'content-type':
+                content_type = value
+            elif lower_name.startswith('x-amz-'):
+                amz_headers.append((name, value))
+        # Sort canonicalizedAmzHeaders by name
+        amz_headers.sort()
+
+        lines = [method, content_md5, content_type, date_or_expires]
+        lines.extend('%s:%s' % (name, value.strip())
+                     for name, value in amz_headers)
+
+        # Sort subresource by name, otherwise signature will not match.
+        # If the value of key in dict params is none, e.g. ?acl,
+        # it will not be appended to query string by requests parsing.
+        # So need to pick it up from params to query string by manual.
+        if params:
+            params = sorted(params.items(), key=lambda d: d[0])
+        else:
+            params = []
+        subresource_to_sign = []
+        subresource_without_value = []
+        for key, value in params:
+            if value is None:
+                subresource_without_value.append(key)
+                if key in SUBRESOURCES:
+                    subresource_to_sign.append(key)
+            elif key in SUBRESOURCES:
+                subresource_to_sign.append('%s=%s' % (key, value))
+
+        canonicalized_resource = _get_path(url)
+        if subresource_to_sign:
+            canonicalized_resource += '?' + '&'.join(subresource_to_sign)
+        lines.append(canonicalized_resource)
+
+        if subresource_without_value:
+            url += '?' + '&'.join(subresource_without_value)
+
+        string_to_sign = '\n'.join(lines)
+        logger.debug('string to sign:\n%s', string_to_sign)
+        logger.debug('request url:\n%s', url)
+        return string_to_sign, url, params
+
+
+def _get_path(url):
+    # The path of url as parse_url() returns it. A plain path is
+    # sliced out of url, parse_url() normalizes the others.
+    start = url.find('/', url.find('://') + 3)
+    if start < 0:
+        return '/'
+    end = len(url)
+    for separator in '?#':
+        index = url.find(separator, start)
+        if 0 <= index < end:
+            end = index
+    path = url[start:end]
+    if _PLAIN_PATH.match(path) and '/.' not in path:
+        return path
+    return parse_url(url).path or '/'
+
+
+_sigv2_signer = SigV2Signer()
+
+
+def get_sigv2_signer():
+    '''Return the process-wide SigV2 signer.'''
+    return _sigv2_signer
+
+
+class SigV4Signer(object):
+    '''
+    Sign requests with AWS Signature Version 4.
+
+    The signing key derived from the secret key takes four HMACs,
+    it is cached per secret key, date, region and service,
+    so a signature costs one HMAC once the key of the day is known.
+    The payload is hashed only when it is given as bytes, pass
+    payload_hash to reuse a hash computed while the body was
+    generated, or UNSIGNED_PAYLOAD not to hash a large body at all.
+    max_cached_keys=0 disables the cache.
+    '''
+    def __init__(self, region=cfg['SIGV4_REGION'], service='s3',
+                 max_cached_keys=64):
+        self.region = region
+        self.service = service
+        self.max_cached_keys = max_cached_keys
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def get_signing_key(self, secret_key, datestamp):
+        '''Return the key signing the requests of datestamp.'''
+        cache_key = (secret_key, datestamp)
+        signing_key = self._keys.get(cache_key)
+        if signing_key is None:
+            signing_key = _hmac_sha256(
+                ('AWS4' + secret_key).encode('utf-8'), datestamp)
+            for part in (self.region, self.service, 'aws4_request'):
+                signing_key = _hmac_sha256(signing_key, part)
+            if self.max_cached_keys > 0:
+                with self._lock:
+                    if len(self._keys) >= self.max_cached_keys:
+                        self._keys.clear()
+                    self._keys[cache_key] = signing_key
+        return signing_key
+
+    def get_scope(self, datestamp):
+        return '%s/%s/%s/aws4_request' % (datestamp, self.region,
+                                          self.service)
+
+    def sign_string(self, secret_key, datestamp, string_to_sign):
+        '''Return the hex signature of string_to_sign.'''
+        return hmac.new(self.get_signing_key(secret_key, datestamp),
+                        string_to_sign.encode('utf-8'),
+                        hashlib.sha256).hexdigest()
+
+    def sign_chunk(self, secret_key, amz_date, previous_signature,
+                   chunk_hash):
+        '''
+        Return the signature of a chunk of an aws-chunked body
+        from the hex SHA256 of the chunk, chained to the signature
+        of the previous chunk, or of the request for the first one.
+        '''
+        datestamp = amz_date[:8]
+        string_to_sign = '\n'.join([
+            CHUNK_ALGORITHM, amz_date, self.get_scope(datestamp),
+            previous_signature, EMPTY_SHA256, chunk_hash])
+        return self.sign_string(secret_key, datestamp, string_to_sign)
+
+    def sign_request(self, method, url, access_key=None, secret_key=None,
+                     headers=None, params=None, payload_hash=None,
+                     body=None):
+        """Sign a request without sending it, as sign_request() does.
+        Add x-amz-date, x-amz-content-sha256 and Authorization
+        to a copy of headers. Host and every header given are signed.
+        :param payload_hash: the hex SHA256 of the body,
+            or UNSIGNED_PAYLOAD.
+        :param body: the body as bytes, hashed when payload_hash
+            is None. A body of another type is sent unsigned.
+        """
+        if access_key is None:
+            access_key = cfg['ACCESS_KEY']
+        if secret_key is None:
+            secret_key = cfg['ACCESS_SECRET']
+
+        if headers is not None:
+            headers = headers.copy()
+        else:
+            headers = {}
+
+        if payload_hash is None:
+            if body is None:
+                payload_hash = EMPTY_SHA256
+            elif isinstance(body, (bytes, bytearray)):
+                payload_hash = hashlib.sha256(body).hexdigest()
+            elif isinstance(body, six.text_type):
+                payload_hash = hashlib.sha256(
+                    body.encode('utf-8')).hexdigest()
+            else:
+                payload_hash = UNSIGNED_PAYLOAD
+
+        amz_date = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+        datestamp = amz_date[:8]
+        for name in find_matching_headers(constants.DATE, headers):
+            del headers[name]
+        headers['x-amz-date'] = amz_date
+        headers['x-amz-content-sha256'] = payload_hash
+
+        # The Host header is added by the http client, as computed here.
+        canonical_headers = {'host': _get_host(url)}
+        for name, value in headers.items():
+            if name.lower() not in SIGV4_UNSIGNED_HEADERS:
+                canonical_headers[name.lower()] = \
+                    ' '.join(str(value).split())
+
+        if params is not None:
+            params = sorted(params.items(), key=lambda d: d[0])
+        else:
+            params = []
+
+        # Requests drops the params without value, e.g. ?acl.
+        subresource_without_value = [key for key, value in params
+                                     if value is None]
+        signature, signed_headers = self._sign_canonical_request(
+            method, url, params, canonical_headers, payload_hash,
+            secret_key, amz_date)
+        if subresource_without_value:
+            url += '?' + '&'.join(subresource_without_value)
+
+        headers[constants.AUTHORIZATION] = \
+            '%s Credential=%s/%s, SignedHeaders=%s, Signature=%s' % (
+                SIGV4_ALGORITHM, access_key, self.get_scope(datestamp),
+                signed_headers, signature)
+        return url, headers, params
+
+    def presign_url(self, method, url, access_key=None, secret_key=None,
+                    expires_in=3600, params=None):
+        """Return url with SigV4 query string authentication,
+        valid for expires_in seconds. Only the host is signed,
+        and the payload is UNSIGNED-PAYLOAD.
+        """
+        if access_key is None:
+            access_key = cfg['ACCESS_KEY']
+        if secret_key is None:
+            secret_key = cfg['ACCESS_SECRET']
+
+        amz_date = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+        query = list((params or {}).items()) + [
+            ('X-Amz-Algorithm', SIGV4_ALGORITHM),
+            ('X-Amz-Credential', '%s/%s' % (
+                access_key, self.get_scope(amz_date[:8]))),
+            ('X-Amz-Date', amz_date),
+            ('X-Amz-Expires', str(int(expires_in))),
+            ('X-Amz-SignedHeaders', 'host'),
+        ]
+        signature, _ = self._sign_canonical_request(
+            method, url, query, {'host': _get_host(url)},
+            UNSIGNED_PAYLOAD, secret_key, amz_date)
+        return '%s?%s&X-Amz-Signature=%s' % (url, _canonical_query(query),
+                                             signature)
+
+    def _sign_canonical_request(self, method, url, query, canonical_headers,
+                                payload_hash, secret_key, amz_date):
+        # Return the signature and the signed headers of a request.
+        signed_headers = ';'.join(sorted(canonical_headers))
+        canonical_request = '\n'.join([
+            method,
+            _uri_encode(unquote(parse_url(url).path or '/'), safe='/~'),
+            _canonical_query(query),
+            ''.join('%s:%s\n' % (name, canonical_headers[name])
+                    for name in sorted(canonical_headers)),
+            signed_headers,
+            payload_hash])
+        logger.debug('canonical request:\n%s', canonical_request)
+
+        datestamp = amz_date[:8]
+        string_to_sign = '\n'.join([
+            SIGV4_ALGORITHM, amz_date, self.get_scope(datestamp),
+            hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()])
+        return (self.sign_string(secret_key, datestamp, string_to_sign),
+                signed_headers)
+
+
+def _get_host(url):
+    # The Host header sent for url, with the port unless it is default.
+    parsed = parse_url(url)
+    if parsed.port and parsed.port != DEFAULT_PORTS.get(parsed.scheme):
+        return '%s:%s' % (parsed.host, parsed.port)
+    return parsed.host
+
+
+def _canonical_query(query):
+    return '&'.join(sorted(
+        '%s=%s' % (_uri_encode(key), _uri_encode(value or ''))
+        for key, value in query))
+
+
+def _hmac_sha256(key, msg):
+    return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+
+def _uri_encode(value, safe='-_.~'):
+    if isinstance(value, six.text_type):
+        value = value.encode('utf-8')
+    return quote(value, safe=safe)
+
+
+_sigv4_signer = SigV4Signer()
+
+
+def get_sigv4_signer():
+    '''Return the process-wide SigV4 signer and its key cache.'''
+    return _sigv4_signer
+
+
+def sign_request_v4(method, url, access_key=None, secret_key=None,
+                    headers=None, params=None, payload_hash=None,
+                    body=None):
+    """Sign a request with SigV4, see SigV4Signer.sign_request()."""
+    return _sigv4_signer.sign_request(method, url, access_key, secret_key,
+                                      headers, params, payload_hash, body)
+
+
+def sign(method, url, access_key=None, secret_key=None, headers=None,
+         params=None, signature_version=None, payload_hash=None,
+         body=None):
+    """Sign a request with signature_version 2 or 4,
+    ECSTEST_SIGNATURE_VERSION by default.
+    payload_hash and body are only used by SigV4.
+    """
+    if signature_version is None:
+        signature_version = cfg['SIGNATURE_VERSION']
+    if int(signature_version) == 4:
+        return sign_request_v4(method, url, access_key, secret_key,
+                               headers, params, payload_hash, body)
+    return sign_request(method, url, access_key, secret_key,
+                        headers, params)
+
+
+def presign(method, url, access_key=None, secret_key=None, expires_in=3600,
+            params=None, signature_version=None):
+    """Return url with query string authentication (a presigned url)
+    with signature_version 2 or 4, ECSTEST_SIGNATURE_VERSION by default.
+    """
+    if signature_version is None:
+        signature_version = cfg['SIGNATURE_VERSION']
+    if int(signature_version) == 4:
+        return _sigv4_signer.presign_url(method, url, access_key,
+                                         secret_key, expires_in, params)
+    return presign_url(method, url, access_key, secret_key, expires_in,
+                       params=params)
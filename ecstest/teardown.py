@@ -0,0 +1,146 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+import atexit
+import shutil
+import threading
+
+from ecstest.logger import logger
+from ecstest import config
+from ecstest import purge
+from ecstest import workerpool
+
+cfg = config.get_config()
+
+
+class TeardownExecutor(object):
+    '''
+    Run the cleanup of test resources (buckets, tmpdirs, alt users,
+    secret keys) on worker threads while the next test runs.
+
+    At most max_pending cleanups wait for a worker, then submit()
+    blocks, so a fast test run can't pile up unbounded work.
+    Cleanups that fail are logged and kept in failures,
+    reported by drain(), which also runs when the process exits.
+
+    When async_mode is False, submit() runs the cleanup right away
+    and its exception is raised to the caller, as a plain tearDown does.
+    '''
+    def __init__(self, async_mode=cfg['ASYNC_TEARDOWN'],
+                 num_workers=cfg['TEARDOWN_THREADS'],
+                 max_pending=cfg['TEARDOWN_QUEUE_SIZE']):
+        self.async_mode = async_mode
+        self.num_workers = num_workers
+        self.max_pending = max_pending
+        self.failures = []
+        self.done = 0
+        self._lock = threading.Lock()
+        self._workers = None
+
+    def submit(self, description, func, *args, **kwargs):
+        '''
+        Schedule func(*args, **kwargs) to clean up the resource
+        described by description.
+        '''
+        if not self.async_mode:
+            return func(*args, **kwargs)
+        with self._lock:
+            if self._workers is None:
+                self._workers = workerpool.WorkerPool(
+                    self.num_workers, max_pending=self.max_pending,
+                    name='ecstest-teardown')
+            workers = self._workers
+        logger.debug('schedule cleanup of %s', description)
+        workers.submit(self._run, description, func, args, kwargs)
+
+    def _run(self, description, func, args, kwargs):
+        try:
+            func(*args, **kwargs)
+        except Exception as err:
+            logger.warn('cleanup of %s failed: %s', description, err)
+            with self._lock:
+                self.failures.append((description, str(err)))
+        else:
+            with self._lock:
+                self.done += 1
+
+    def remove_tmpdir(self, path):
+        self.submit('tmpdir %s' % path, shutil.rmtree, path)
+
+    def delete_bucket(self, conn, bucket, target, keep_bucket=False):
+        '''
+        Delete all keys of bucket, and bucket itself
+        unless keep_bucket is True.
+        '''
+        self.submit('bucket %s' % bucket.name, _delete_bucket,
+                    conn, bucket, target, keep_bucket)
+
+    def delete_user(self, user_admin, username):
+        '''Delete all secret keys of an object user, then the user.'''
+        self.submit('user %s' % username, _delete_user,
+                    user_admin, username)
+
+    def delete_secret_key(self, user_admin, username, secret_key):
+        self.submit('secret key of user %s' % username,
+                    _delete_secret_key, user_admin, username, secret_key)
+
+    def drain(self):
+        '''
+        Wait for every scheduled cleanup and return the failures,
+        a list of (description, error).
+        '''
+        with self._lock:
+            workers = self._workers
+        if workers is not None:
+            workers.join()
+        with self._lock:
+            failures = list(self.failures)
+        return failures
+
+    def report(self):
+        '''Drain the executor and log anything that failed to clean.'''
+        failures = self.drain()
+        if not self.async_mode:
+            return failures
+        logger.info('background teardown cleaned %d resources, '
+                    '%d failed', self.done, len(failures))
+        for description, error in failures:
+            logger.warn('not cleaned: %s: %s', description, error)
+        return failures
+
+
+def _delete_bucket(conn, bucket, target, keep_bucket):
+    logger.debug("delete all keys in bucket: %s", bucket.name)
+    purge.BucketPurger(bucket, target).purge()
+    if not keep_bucket:
+        conn.delete_bucket(bucket.name)
+
+
+def _delete_secret_key(user_admin, username, secret_key):
+    user_admin.delete_secret_key(username, secret_key).raise_for_status()
+
+
+def _delete_user(user_admin, username):
+    user_admin.delete_secret_key(username).raise_for_status()
+    user_admin.delete_user(username).raise_for_status()
+
+
+_executor = TeardownExecutor()
+atexit.register(_executor.report)
+
+
+def get_executor():
+    '''Return the process-wide teardown executor.'''
+    return _executor
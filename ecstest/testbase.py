@@ -13,7 +13,6 @@
 Author: Rubicon ISE team
 '''
 
-import shutil
 import tempfile
 import testtools
 
@@ -21,9 +20,12 @@ from boto.s3.connection import S3Connection
 from boto.s3.connection import OrdinaryCallingFormat
 
 from ecstest import bucketname
+from ecstest import bucketpool
 from ecstest import client
 from ecstest import config
 from ecstest import constants
+from ecstest import teardown
+from ecstest import tokenmanager
 from ecstest import utils
 from ecstest.extensions import matchers
 from ecstest.logger import logger
@@ -59,7 +61,10 @@ class EcsControlPlaneTestBase(EcsTestBase):
 
         # Peform login so that the requests in each test class
         # are authenticated.
-        cls.client.make_login_request()
+        if cls.client.token_manager is not None:
+            cls.client.token = cls.client.token_manager.get_token()
+        else:
+            cls.client.make_login_request()
 
     @classmethod
     def tearDownClass(cls):
@@ -67,7 +72,8 @@ class EcsControlPlaneTestBase(EcsTestBase):
 
         # This call is important, because we want to make sure and release the
         # token back to ECS; there is a limit on the number of active tokens.
-        if cls.client.token:
+        # A shared token is logged out when the process exits.
+        if cls.client.token and cls.client.token_manager is None:
             cls.client.make_logout_request()
 
     @classmethod
@@ -81,6 +87,12 @@ class EcsControlPlaneTestBase(EcsTestBase):
             ecs_endpoint = cfg['CONTROL_ENDPOINT']
             token_endpoint = cfg['TOKEN_ENDPOINT']
 
+        token_manager = None
+        if tokenmanager.is_enabled():
+            token_manager = tokenmanager.get_manager(
+                cfg['ADMIN_USERNAME'], cfg['ADMIN_PASSWORD'],
+                ecs_endpoint, token_endpoint)
+
         controlplane_client = client.EcsControlPlaneClient(
             username=cfg['ADMIN_USERNAME'],
             password=cfg['ADMIN_PASSWORD'],
@@ -90,7 +102,8 @@ class EcsControlPlaneTestBase(EcsTestBase):
             verify_ssl=cfg['VERIFY_SSL'],
             token_filename=cfg['TOKEN_FILENAME'],
             request_timeout=cfg['REQUEST_TIMEOUT'],
-            cache_token=cfg['CACHE_TOKEN']
+            cache_token=cfg['CACHE_TOKEN'],
+            token_manager=token_manager
         )
 
         return controlplane_client
@@ -102,7 +115,14 @@ class EcsDataPlaneTestBase(EcsTestBase):
     def setUp(self,
               create_tmpdir=False,
               create_bucket=False,
-              allow_reuse_bucket=True):
+              allow_reuse_bucket=True,
+              fresh_bucket=False):
+        """
+        :param fresh_bucket: create and delete a bucket for this test,
+            instead of leasing one from the bucket pool when
+            ECSTEST_BUCKET_POOL_SIZE is set. A test changing bucket
+            settings other than keys and ACL must use a fresh bucket.
+        """
         super(EcsDataPlaneTestBase, self).setUp()
 
         config.set_boto_config()
@@ -124,15 +144,20 @@ class EcsDataPlaneTestBase(EcsTestBase):
         else:
             self.__tmpdir = None
 
+        self.__bucket_leased = False
         if create_bucket:
             # 1 when test case allows to reuse bucket name and
             # env variable ECSTEST_REUSE_BUCKET_NAME is set, reuse name
-            # 2 all rest situation to use new name.
+            # 2 when the bucket pool is enabled, lease a bucket from it
+            # unless the test asks for a fresh one
+            # 3 all rest situation to use new name.
             self.allow_reuse_bucket_flag = \
                 allow_reuse_bucket is True and \
                 self.cfg['REUSE_BUCKET_NAME'] is not None
             if self.allow_reuse_bucket_flag is True:
                 self._reuse_bucket()
+            elif fresh_bucket is False and bucketpool.is_enabled():
+                self._lease_bucket()
             else:
                 prefix = bucketname.get_unique_bucket_name_prefix()
                 self.__bucket_name = bucketname.get_unique_bucket_name(prefix)
@@ -162,22 +187,44 @@ class EcsDataPlaneTestBase(EcsTestBase):
             logger.debug("create bucket %s for reuse", self.__bucket_name)
             self.__bucket = self.data_conn.create_bucket(self.__bucket_name)
 
+    def _lease_bucket(self):
+        '''
+        Lease an empty bucket from the bucket pool.
+        '''
+        self.__bucket_name = bucketpool.get_pool().lease()
+        self.bucket_name = self.__bucket_name
+        logger.debug("leased bucket: %s", self.bucket_name)
+        self.__bucket = self.data_conn.get_bucket(self.__bucket_name,
+                                                  validate=False)
+        self.__bucket_leased = True
+
     def tearDown(self):
+        # With ECSTEST_ASYNC_TEARDOWN set, tmpdir and bucket
+        # are cleaned in the background while the next test runs.
+        executor = teardown.get_executor()
+
         if self.__tmpdir is not None:
             logger.debug("delete tmpdir: %s", self.__tmpdir)
-            shutil.rmtree(self.__tmpdir)
+            executor.remove_tmpdir(self.__tmpdir)
             self.__tmpdir = None
 
-        if self.__bucket is not None:
+        if self.__bucket is not None and self.__bucket_leased:
+            # The pool empties the bucket in the background.
+            logger.debug("release leased bucket: %s", self.__bucket_name)
+            bucketpool.get_pool().release(self.__bucket_name)
+        elif self.__bucket is not None:
             logger.debug("delete all keys in bucket: %s", self.__bucket_name)
             # Sometime the bucket just disappears
             # Since this is the tearDown() function, just ignore it
             # Case: object_post_test.py:TestObjectPost.test_post_object_with_special_valid_name
-            utils.delete_keys(self.__bucket, self.target)
             if self.allow_reuse_bucket_flag is True:
+                # The next test uses the same bucket,
+                # so it must be emptied before that.
+                utils.delete_keys(self.__bucket, self.target)
                 logger.debug("reuse bucket will not be deleted")
             else:
-                self.data_conn.delete_bucket(self.__bucket_name)
+                executor.delete_bucket(self.data_conn, self.__bucket,
+                                       self.target)
 
         super(EcsDataPlaneTestBase, self).tearDown()
 
@@ -200,3 +247,14 @@ class EcsDataPlaneTestBase(EcsTestBase):
             calling_format=calling_format)
 
         return dataplane_conn
+
+    def get_data_client(self, num=None, **kwargs):
+        """
+        Return a client spreading signed requests over the nodes
+        of utils.generate_node_list(num). kwargs are the arguments
+        of client.EcsDataPlaneClient.
+        """
+        data_client = client.EcsDataPlaneClient(
+            utils.generate_node_list(num), **kwargs)
+        self.addCleanup(data_client.close)
+        return data_client
@@ -20,9 +20,10 @@ from nose.tools import eq_ as eq
 
 from ecstest import bucketname
 from ecstest import keyname
+from ecstest import populate
 from ecstest import tag
+from ecstest import teardown
 from ecstest import testbase
-from ecstest import utils
 from ecstest.dec import not_supported
 from ecstest.dec import triage
 from ecstest.logger import logger
@@ -49,9 +50,7 @@ def _create_keys(bucket, keys=[]):
     Populate a (specified or new) bucket with objects with
     specified names (and contents identical to their names).
     """
-    for s in keys:
-        key = bucket.new_key(s)
-        key.set_contents_from_string(s)
+    populate.populate(bucket, keys, nodes=[bucket.connection.host])
 
 
 @attr(tags=[tag.DATA_PLANE, tag.BUCKET_ACCESS])
@@ -65,11 +64,11 @@ class TestBucketAccess(testbase.EcsDataPlaneTestBase):
         self.bucket_list = []
 
     def tearDown(self):
+        executor = teardown.get_executor()
         for bucket in self.bucket_list:
             try:
                 logger.debug("delete all keys in bucket: %s", bucket.name)
-                utils.delete_keys(bucket, self.target)
-                self.data_conn.delete_bucket(bucket.name)
+                executor.delete_bucket(self.data_conn, bucket, self.target)
             except Exception as err:
                 logger.warn("Delete bucket exception: %s", str(err))
         super(TestBucketAccess, self).tearDown()
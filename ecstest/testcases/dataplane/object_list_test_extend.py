@@ -20,6 +20,7 @@ from nose.tools import eq_ as eq
 
 from ecstest import bucketname
 from ecstest import keyname
+from ecstest import populate
 from ecstest import tag
 from ecstest import testbase
 from ecstest import utils
@@ -67,9 +68,8 @@ class TestObjectList(testbase.EcsDataPlaneTestBase):
         Populate a (specified or new) bucket with objects with
         specified names (and contents identical to their names).
         """
-        for s in keys:
-            key = self.bucket.new_key(s)
-            key.set_contents_from_string(s)
+        populate.populate(self.bucket, keys,
+                          nodes=[self.bucket.connection.host])
 
     @triage
     # port from test case: test_bucket_list_distinct() of https://github.com/
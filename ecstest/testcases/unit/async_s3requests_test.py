@@ -0,0 +1,144 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+
+Check AsyncS3Engine against the in-memory StandInServer,
+python 3.7 and later only.
+'''
+
+import asyncio
+import unittest
+
+from ecstest import async_s3requests
+
+
+class TestAsyncS3Engine(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = async_s3requests.StandInServer()
+        self.url = self.loop.run_until_complete(self.server.start())
+        self.engine = None
+
+    def tearDown(self):
+        if self.engine is not None:
+            self.loop.run_until_complete(self.engine.close())
+        self.loop.run_until_complete(self.server.stop())
+        self.loop.close()
+
+    def _run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def _engine(self, **kwargs):
+        self.engine = async_s3requests.AsyncS3Engine(timeout=10, **kwargs)
+        return self.engine
+
+    def _key_url(self, name):
+        return '%s/bucket/%s' % (self.url, name)
+
+    def test_put_get_head_delete(self):
+        engine = self._engine()
+        url = self._key_url('key')
+
+        async def run():
+            put = await engine.put(url, 'user', 'secret', data=b'content')
+            get = await engine.get(url, 'user', 'secret')
+            head = await engine.head(url, 'user', 'secret')
+            delete = await engine.delete(url, 'user', 'secret')
+            missing = await engine.get(url, 'user', 'secret')
+            return put, get, head, delete, missing
+
+        put, get, head, delete, missing = self._run(run())
+        self.assertEqual(put.status_code, 200)
+        self.assertEqual(get.status_code, 200)
+        self.assertEqual(get.content, b'content')
+        self.assertEqual(head.status_code, 200)
+        self.assertEqual(head.headers['Content-Length'], '7')
+        self.assertEqual(head.content, b'')
+        self.assertEqual(delete.status_code, 204)
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(self.server.objects, {})
+
+    def test_stream_request_body(self):
+        engine = self._engine()
+        url = self._key_url('chunked')
+        blocks = [b'a' * 1000, b'', b'b' * 70000, b'c']
+
+        async def generate():
+            for block in blocks:
+                yield block
+
+        async def run():
+            await engine.put(url, 'user', 'secret', data=generate())
+            await engine.put(url + '.sync', 'user', 'secret',
+                             data=iter(blocks))
+
+        self._run(run())
+        self.assertEqual(self.server.objects['/bucket/chunked'],
+                         b''.join(blocks))
+        self.assertEqual(self.server.objects['/bucket/chunked.sync'],
+                         b''.join(blocks))
+
+    def test_stream_response_body(self):
+        engine = self._engine()
+        url = self._key_url('big')
+        data = bytes(range(256)) * 1024
+
+        async def run():
+            await engine.put(url, 'user', 'secret', data=data)
+            response = await engine.get(url, 'user', 'secret', stream=True)
+            blocks = [block async for block in
+                      response.iter_content(chunk_size=10000)]
+            # The connection is given back once the body is read.
+            return response, blocks, engine.in_flight
+
+        response, blocks, in_flight = self._run(run())
+        self.assertEqual(b''.join(blocks), data)
+        self.assertTrue(all(len(block) <= 10000 for block in blocks))
+        self.assertEqual(in_flight, 0)
+        self.assertRaises(Exception, getattr, response, 'content')
+
+    def test_max_concurrency(self):
+        engine = self._engine(max_concurrency=4, limit_per_host=16)
+
+        async def run():
+            return await asyncio.gather(
+                *[engine.put(self._key_url('key%d' % i), 'user', 'secret',
+                             data=b'x' * 100)
+                  for i in range(50)])
+
+        responses = self._run(run())
+        self.assertEqual([r.status_code for r in responses], [200] * 50)
+        stats = engine.stats()
+        self.assertEqual(stats['requests'], 50)
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertLessEqual(stats['max_in_flight'], 4)
+        self.assertLessEqual(stats['connections_opened'], 4)
+        self.assertEqual(len(self.server.objects), 50)
+
+    def test_connection_reuse(self):
+        engine = self._engine()
+
+        async def run():
+            for i in range(20):
+                await engine.put(self._key_url('key%d' % i), 'user',
+                                 'secret', data=b'x')
+
+        self._run(run())
+        stats = engine.stats()
+        self.assertEqual(stats['connections_opened'], 1)
+        self.assertEqual(stats['reuse_count'], 19)
+
+
+if __name__ == '__main__':
+    unittest.main()
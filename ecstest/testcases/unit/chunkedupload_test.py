@@ -0,0 +1,150 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+import io
+import os
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from ecstest import chunkedupload
+from ecstest import filehelper
+from ecstest import signer
+
+# The secret key and request signature of the aws-chunked example
+# of the AWS S3 documentation.
+SECRET_KEY = 'wJalrXUtnFEMI/K7MDENG/bPxRfiCYEXAMPLEKEY'
+SEED_SIGNATURE = \
+    '4f232c4386841ef735655705268965c44a0e4690baa4adea153f7db9fa80a0a9'
+
+
+def _decode_chunked(body):
+    # Return the chunks of a chunked transfer encoded body.
+    chunks = []
+    while True:
+        line, body = body.split(b'\r\n', 1)
+        size = int(line, 16)
+        if size == 0:
+            if body != b'\r\n':
+                raise AssertionError('data after the last chunk')
+            return chunks
+        chunks.append(body[:size])
+        if body[size:size + 2] != b'\r\n':
+            raise AssertionError('chunk of %d bytes not ended by CRLF'
+                                 % size)
+        body = body[size + 2:]
+
+
+class TestChunkedTransfer(unittest.TestCase):
+
+    def _temp_file(self, data):
+        fd, path = tempfile.mkstemp(prefix='ecstest-unit-')
+        os.write(fd, data)
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        return open(path, 'rb')
+
+    def test_encode_chunk(self):
+        self.assertEqual(chunkedupload._encode_chunk(b'x' * 26),
+                         b'1a\r\n' + b'x' * 26 + b'\r\n')
+
+    def test_content_chunks(self):
+        body = b''.join(chunkedupload.iter_content_chunks(
+            [b'abc', u'd\xe9f', b'']))
+        self.assertEqual(body, b'3\r\nabc\r\n4\r\nd\xc3\xa9f\r\n'
+                               b'0\r\n\r\n0\r\n\r\n')
+
+    def test_file_chunks(self):
+        data = os.urandom(1000)
+        with self._temp_file(data) as fp:
+            chunks = _decode_chunked(b''.join(
+                chunkedupload.iter_file_chunks(fp, [100, 300])))
+        # The default size once the list is exhausted.
+        self.assertEqual([len(chunk) for chunk in chunks], [100, 300, 600])
+        self.assertEqual(b''.join(chunks), data)
+
+    def test_stream_chunks(self):
+        # The size of a stream is not known, the last chunk is short.
+        data = os.urandom(1000)
+        chunks = _decode_chunked(b''.join(
+            chunkedupload.iter_file_chunks(io.BytesIO(data), [400] * 3)))
+        self.assertEqual([len(chunk) for chunk in chunks], [400, 400, 200])
+        self.assertEqual(b''.join(chunks), data)
+
+    def test_large_chunk_is_streamed(self):
+        size = 2 * chunkedupload.STREAM_BLOCK_SIZE + 10
+        pseudofile = filehelper.PseudoFile(size, seed=3)
+        pieces = list(chunkedupload.iter_file_chunks(pseudofile, [size]))
+        self.assertTrue(all(len(piece) <= chunkedupload.STREAM_BLOCK_SIZE
+                            for piece in pieces))
+        chunks = _decode_chunked(b''.join(pieces))
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(chunks[0],
+                         filehelper.PseudoFile(size, seed=3).read())
+
+    def test_invalid_chunk_size(self):
+        body = b''.join(chunkedupload.iter_file_chunks(io.BytesIO(b''),
+                                                       [0]))
+        self.assertEqual(body, b'0\r\n1234567890\r\n0\r\n\r\n')
+
+
+class TestAwsChunked(unittest.TestCase):
+
+    def setUp(self):
+        # Chunks are signed by the process-wide signer.
+        patcher = mock.patch.object(signer, '_sigv4_signer',
+                                    signer.SigV4Signer(region='us-east-1'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_length(self):
+        self.assertEqual(chunkedupload.aws_chunked_length(66560), 66824)
+        # Only the final empty chunk.
+        self.assertEqual(chunkedupload.aws_chunked_length(0), 86)
+        self.assertEqual(chunkedupload.aws_chunked_length(2048, 1024),
+                         2 * (3 + 17 + 64 + 4 + 1024) + 86)
+
+    def test_chunk_signatures(self):
+        pieces = list(chunkedupload.iter_aws_chunks(
+            io.BytesIO(b'a' * 66560), 66560, SECRET_KEY,
+            '20130524T000000Z', SEED_SIGNATURE))
+        body = b''.join(pieces)
+        self.assertEqual(len(body), chunkedupload.aws_chunked_length(66560))
+        self.assertEqual(
+            [line for line in body.split(b'\r\n')
+             if b';chunk-signature=' in line],
+            [b'10000;chunk-signature=ad80c730a21e5b8d04586a2213dd63b9a0e99e'
+             b'0e2307b0ade35a65485a288648',
+             b'400;chunk-signature=0055627c9e194cb4542bae2aa5492e3c1575bbb8'
+             b'1b612b7d234b86a503ef5497',
+             b'0;chunk-signature=b6c6ea8a5354eaf15b3cb7646744f4275b71ea724f'
+             b'ed81ceb9323e279d449df9'])
+        self.assertTrue(body.endswith(b'\r\n\r\n'))
+        # Chunks are yielded as read, never joined.
+        self.assertIn(b'a' * 65536, pieces)
+
+    def test_truncated_file(self):
+        chunks = chunkedupload.iter_aws_chunks(
+            io.BytesIO(b'a' * 100), 200, SECRET_KEY, '20130524T000000Z',
+            SEED_SIGNATURE)
+        self.assertRaises(Exception, list, chunks)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+import hashlib
+import os
+import random
+import threading
+import unittest
+
+from ecstest import download
+
+
+class TestSplitRanges(unittest.TestCase):
+
+    def test_split(self):
+        self.assertEqual(download.split_ranges(10, 4),
+                         [(0, 0, 4), (1, 4, 4), (2, 8, 2)])
+        self.assertEqual(download.split_ranges(8, 4), [(0, 0, 4), (1, 4, 4)])
+        self.assertEqual(download.split_ranges(0, 4), [])
+
+
+class TestOrderedDigest(unittest.TestCase):
+
+    def test_any_order(self):
+        chunks = [[os.urandom(100), os.urandom(10)] for _ in range(50)]
+        order = list(range(50))
+        random.Random(1).shuffle(order)
+        ordered = download._OrderedDigest(window=50)
+        for index in order:
+            ordered.add(index, chunks[index])
+        self.assertEqual(ordered.md5.hexdigest(), hashlib.md5(b''.join(
+            b''.join(pieces) for pieces in chunks)).hexdigest())
+        self.assertEqual(ordered._pending, {})
+
+    def test_window(self):
+        ordered = download._OrderedDigest(window=2)
+        turns = []
+
+        def wait():
+            ordered.wait_turn(3)
+            turns.append(ordered._next)
+
+        thread = threading.Thread(target=wait)
+        thread.start()
+        ordered.add(1, [b'b'])
+        thread.join(0.1)
+        self.assertTrue(thread.is_alive())
+        # Ranges 0 and 1 are hashed, range 3 is in the window.
+        ordered.add(0, [b'a'])
+        thread.join(5)
+        self.assertEqual(turns, [2])
+        self.assertEqual(ordered.md5.hexdigest(),
+                         hashlib.md5(b'ab').hexdigest())
+
+    def test_fail_wakes_up_producer(self):
+        ordered = download._OrderedDigest(window=1)
+        thread = threading.Thread(target=ordered.wait_turn, args=(5,))
+        thread.start()
+        ordered.fail()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+
+class TestDownloadResult(unittest.TestCase):
+
+    def _result(self, etag, computed_etag, pseudo_valid=None):
+        return download.DownloadResult(etag, computed_etag, 10, 1.0, 0,
+                                       pseudo_valid)
+
+    def test_is_valid(self):
+        self.assertTrue(self._result('a', 'a').is_valid())
+        self.assertFalse(self._result('a', 'b').is_valid())
+        self.assertTrue(self._result('a-2', None, True).is_valid())
+        self.assertFalse(self._result('a-2', None, False).is_valid())
+        self.assertFalse(self._result('a', 'a', False).is_valid())
+
+    def test_not_checked(self):
+        result = self._result('a-2', None)
+        self.assertFalse(result.checked())
+        self.assertIsNone(result.is_valid())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ecstest import filecache
+from ecstest import filehelper
+
+
+class TestFileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='ecstest-unit-')
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.cache = filecache.FileCache(self.cache_dir, max_bytes=250)
+
+    def _cached(self):
+        return sorted(name for name in os.listdir(self.cache_dir)
+                      if name.endswith(filecache.CACHE_FILE_SUFFIX))
+
+    def test_get_file(self):
+        path = self.cache.get_file(100, seed=2)
+        self.assertEqual(path, self.cache.get_path(100, seed=2))
+        expected = os.path.join(self.cache_dir, 'expected')
+        filehelper.generate_seeded_file(100, expected, seed=2)
+        with open(path, 'rb') as cached, open(expected, 'rb') as generated:
+            self.assertEqual(cached.read(), generated.read())
+        self.assertEqual(os.stat(path).st_mode & 0o777,
+                         filecache.READ_ONLY_MODE)
+        # Handed out again without being generated.
+        mtime = os.stat(path).st_mtime
+        os.utime(path, (mtime - 100, mtime - 100))
+        self.assertEqual(self.cache.get_file(100, seed=2), path)
+        self.assertGreater(os.stat(path).st_mtime, mtime - 100)
+
+    def test_evict_least_recently_used(self):
+        first = self.cache.get_file(100, seed=1)
+        second = self.cache.get_file(100, seed=2)
+        os.utime(second, (1, 1))
+        self.cache.get_file(100, seed=3)
+        self.assertTrue(os.path.exists(first))
+        self.assertFalse(os.path.exists(second))
+        self.assertFalse(os.path.exists(second + filecache.LOCK_FILE_SUFFIX))
+        self.assertEqual(self._cached(), ['100-1.bin', '100-3.bin'])
+
+    def test_leased_file_is_kept(self):
+        with self.cache.lease(100, seed=1) as leased:
+            os.utime(leased, (1, 1))
+            self.cache.get_file(100, seed=2)
+            self.cache.get_file(100, seed=3)
+            # The least recently used file but the leased one is evicted.
+            self.assertTrue(os.path.exists(leased))
+            self.assertEqual(self._cached(), ['100-1.bin', '100-3.bin'])
+            self.cache.clear()
+            self.assertEqual(self._cached(), ['100-1.bin'])
+        self.cache.clear()
+        self.assertEqual(self._cached(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
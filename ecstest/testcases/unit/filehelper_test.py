@@ -0,0 +1,199 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+import hashlib
+import io
+import os
+import struct
+import unittest
+
+from ecstest import filehelper
+
+# Spans across two spans and ends in a partial block.
+SIZE = filehelper.PSEUDO_SPAN_SIZE + 3 * filehelper.PSEUDO_BLOCK_SIZE + 123
+
+
+class _Connection(object):
+    # Collect what PseudoFile.send() writes.
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data):
+        # A view is only valid until the next one is sent.
+        self.sent.append(data.tobytes())
+
+
+class TestPseudoFile(unittest.TestCase):
+
+    def test_read(self):
+        pseudofile = filehelper.PseudoFile(SIZE)
+        data = pseudofile.read()
+        self.assertEqual(len(data), SIZE)
+        self.assertEqual(pseudofile.tell(), SIZE)
+        self.assertEqual(pseudofile.read(), b'')
+        self.assertEqual(pseudofile.md5_digest.hexdigest(),
+                         hashlib.md5(data).hexdigest())
+
+    def test_read_by_blocks(self):
+        data = filehelper.PseudoFile(SIZE).read()
+        pseudofile = filehelper.PseudoFile(SIZE)
+        blocks = []
+        while True:
+            block = pseudofile.read(10000)
+            if not block:
+                break
+            blocks.append(block)
+        self.assertEqual(b''.join(blocks), data)
+        self.assertEqual(pseudofile.md5_digest.hexdigest(),
+                         hashlib.md5(data).hexdigest())
+
+    def test_readinto(self):
+        data = filehelper.PseudoFile(SIZE).read()
+        pseudofile = filehelper.PseudoFile(SIZE)
+        buf = bytearray(SIZE + 10)
+        self.assertEqual(pseudofile.readinto(buf), SIZE)
+        self.assertEqual(bytes(buf[:SIZE]), data)
+        self.assertEqual(pseudofile.readinto(buf), 0)
+
+    def test_seek(self):
+        data = filehelper.PseudoFile(SIZE).read()
+        pseudofile = filehelper.PseudoFile(SIZE)
+        self.assertEqual(pseudofile.seek(100), 100)
+        self.assertEqual(pseudofile.read(10), data[100:110])
+        self.assertEqual(pseudofile.seek(-20, os.SEEK_CUR), 90)
+        self.assertEqual(pseudofile.seek(-5, os.SEEK_END), SIZE - 5)
+        self.assertEqual(pseudofile.read(), data[-5:])
+        self.assertRaises(ValueError, pseudofile.seek, 0, 3)
+        self.assertRaises(IOError, pseudofile.seek, -1)
+
+    def test_md5_of_sequential_reads_only(self):
+        pseudofile = filehelper.PseudoFile(SIZE)
+        pseudofile.seek(10)
+        pseudofile.read(10)
+        self.assertIsNone(pseudofile.md5_digest)
+        # Reading again from the start restarts it.
+        pseudofile.seek(0)
+        data = pseudofile.read()
+        self.assertEqual(pseudofile.md5_digest.hexdigest(),
+                         hashlib.md5(data).hexdigest())
+        self.assertIsNone(filehelper.PseudoFile(SIZE, compute_md5=False)
+                          .md5_digest)
+
+    def test_send(self):
+        conn = _Connection()
+        pseudofile = filehelper.PseudoFile(SIZE)
+        pseudofile.send(conn)
+        self.assertEqual(b''.join(conn.sent),
+                         filehelper.PseudoFile(SIZE).read())
+        self.assertTrue(all(len(data) <= filehelper.PSEUDO_SPAN_SIZE
+                            for data in conn.sent))
+
+
+def _expected_block(blknum, seed):
+    # A block as documented: the MD5s of '<seed>:<counter>' up to
+    # the trailer of the block number and the stamp of seed.
+    body = b''.join(hashlib.md5(('%d:%d' % (seed, i)).encode('ascii'))
+                    .digest() for i in range(255))
+    stamp = 0x2174736574736365 ^ seed
+    return body + struct.pack('<QQ', blknum, stamp)
+
+
+class TestPseudoContent(unittest.TestCase):
+
+    def test_blocks(self):
+        block_size = filehelper.PSEUDO_BLOCK_SIZE
+        for seed in (0, 7):
+            data = filehelper.PseudoFile(SIZE, seed=seed).read()
+            for blknum in (0, 1, 255, 256, 258):
+                self.assertEqual(
+                    data[blknum * block_size:(blknum + 1) * block_size],
+                    _expected_block(blknum, seed))
+            last = SIZE // block_size
+            self.assertEqual(data[last * block_size:],
+                             _expected_block(last, seed)[:123])
+
+    def test_seeds_differ(self):
+        self.assertNotEqual(filehelper.PseudoFile(1000, seed=1).read(),
+                            filehelper.PseudoFile(1000, seed=2).read())
+
+    def test_read_range(self):
+        data = filehelper.PseudoFile(SIZE, seed=3).read()
+        pseudofile = filehelper.PseudoFile(SIZE, seed=3)
+        pseudofile.read(10)
+        span = filehelper.PSEUDO_SPAN_SIZE
+        for offset, size in [(0, 1), (4090, 20), (span - 5, 10),
+                             (SIZE - 10, 100), (SIZE, 10)]:
+            self.assertEqual(pseudofile.read_range(offset, size),
+                             data[offset:offset + size])
+        # The offset and the running MD5 are left as they are.
+        self.assertEqual(pseudofile.tell(), 10)
+        self.assertEqual(pseudofile.read(), data[10:])
+        self.assertEqual(pseudofile.md5_digest.hexdigest(),
+                         hashlib.md5(data).hexdigest())
+
+
+class TestPseudoFileVerifier(unittest.TestCase):
+
+    def setUp(self):
+        self.data = filehelper.PseudoFile(SIZE, seed=5).read()
+
+    def test_valid(self):
+        verifier = filehelper.PseudoFileVerifier(SIZE, seed=5)
+        for pos in range(0, SIZE, 100000):
+            self.assertTrue(verifier.update(self.data[pos:pos + 100000]))
+        self.assertTrue(verifier.is_valid())
+        self.assertIsNone(verifier.mismatch_offset)
+
+    def test_range(self):
+        verifier = filehelper.PseudoFileVerifier(SIZE, offset=5000, seed=5)
+        verifier.update(self.data[5000:6000])
+        self.assertTrue(verifier.is_valid(1000))
+        # Not up to the end of the pseudofile.
+        self.assertFalse(verifier.is_valid())
+
+    def test_mismatch(self):
+        data = bytearray(self.data)
+        data[70000] ^= 1
+        verifier = filehelper.PseudoFileVerifier(SIZE, seed=5)
+        self.assertTrue(verifier.update(bytes(data[:65536])))
+        self.assertFalse(verifier.update(bytes(data[65536:])))
+        self.assertEqual(verifier.mismatch_offset, 70000)
+        self.assertFalse(verifier.update(b''))
+        self.assertFalse(verifier.is_valid())
+
+    def test_wrong_seed(self):
+        verifier = filehelper.PseudoFileVerifier(SIZE, seed=6)
+        self.assertFalse(verifier.update(self.data))
+        self.assertEqual(verifier.mismatch_offset, 0)
+
+    def test_extra_data(self):
+        verifier = filehelper.PseudoFileVerifier(100, seed=5)
+        self.assertFalse(verifier.update(self.data[:101]))
+        self.assertEqual(verifier.mismatch_offset, 100)
+
+    def test_verify_pseudo_data(self):
+        data = self.data
+        self.assertTrue(filehelper.verify_pseudo_data(data, SIZE, seed=5))
+        self.assertTrue(filehelper.verify_pseudo_data(
+            io.BytesIO(data[100:]), SIZE, offset=100, seed=5,
+            chunk_size=4096))
+        self.assertTrue(filehelper.verify_pseudo_data(
+            [data[:10], data[10:20]], SIZE, length=20, seed=5))
+        self.assertFalse(filehelper.verify_pseudo_data(data[:-1], SIZE,
+                                                       seed=5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+import io
+import os
+import tempfile
+import unittest
+
+from ecstest import filehelper
+from ecstest.formdata import FormDataEncoder
+
+FIELDS = [('key', 'dir/key'), ('acl', u'private'), ('x-amz-meta-n', 3)]
+# The body of FIELDS and the content 'hello' with boundary b0.
+EXPECTED = (
+    b'--b0\r\nContent-Disposition: form-data; name="key"\r\n\r\n'
+    b'dir/key\r\n'
+    b'--b0\r\nContent-Disposition: form-data; name="acl"\r\n\r\n'
+    b'private\r\n'
+    b'--b0\r\nContent-Disposition: form-data; name="x-amz-meta-n"\r\n\r\n'
+    b'3\r\n'
+    b'--b0\r\nContent-Disposition: form-data; name="file"; '
+    b'filename="key.txt"\r\n\r\n'
+    b'hello\r\n'
+    b'--b0--\r\n')
+
+
+def _read_by(body, size):
+    pieces = []
+    while True:
+        data = body.read(size)
+        if not data:
+            return b''.join(pieces)
+        pieces.append(data)
+
+
+class TestFormDataEncoder(unittest.TestCase):
+
+    def test_content(self):
+        body = FormDataEncoder(FIELDS, content='hello', filename='key.txt',
+                               boundary='b0')
+        self.assertEqual(body.content_type,
+                         'multipart/form-data; boundary=b0')
+        self.assertEqual(len(body), len(EXPECTED))
+        self.assertEqual(body.read(), EXPECTED)
+        self.assertEqual(body.tell(), len(EXPECTED))
+        self.assertEqual(body.read(), b'')
+
+    def test_read_by_small_sizes(self):
+        for size in (1, 7, 64):
+            body = FormDataEncoder(FIELDS, content=b'hello',
+                                   filename='key.txt', boundary='b0')
+            self.assertEqual(_read_by(body, size), EXPECTED)
+
+    def test_no_file(self):
+        body = FormDataEncoder([('key', 'k')], boundary='b0')
+        self.assertEqual(body.read(), b'--b0\r\nContent-Disposition: '
+                                      b'form-data; name="key"\r\n\r\n'
+                                      b'k\r\n--b0--\r\n')
+
+    def test_text_content(self):
+        body = FormDataEncoder([], content=u'caf\xe9', boundary='b0')
+        data = body.read()
+        self.assertIn(b'filename="file"\r\n\r\ncaf\xc3\xa9\r\n', data)
+        self.assertEqual(len(body), len(data))
+
+    def test_filepath(self):
+        content = os.urandom(100000)
+        fd, path = tempfile.mkstemp(prefix='ecstest-unit-')
+        os.write(fd, content)
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        with FormDataEncoder(FIELDS, filepath=path, boundary='b0') as body:
+            data = _read_by(body, 8192)
+            # The file is closed once sent.
+            self.assertIsNone(body._fp)
+        self.assertEqual(len(data), len(body))
+        self.assertIn(('filename="%s"\r\n\r\n' % os.path.basename(path))
+                      .encode('ascii') + content + b'\r\n--b0--\r\n', data)
+
+    def test_pseudo_file(self):
+        size = 3 * filehelper.PSEUDO_SPAN_SIZE + 5
+        body = FormDataEncoder(FIELDS, fileobj=filehelper.PseudoFile(size),
+                               filename='key.txt', boundary='b0')
+        self.assertEqual(len(body), len(EXPECTED) - len(b'hello') + size)
+        data = _read_by(body, 100000)
+        self.assertEqual(len(data), len(body))
+        self.assertTrue(filehelper.verify_pseudo_data(
+            data[len(EXPECTED) - len(b'hello\r\n--b0--\r\n'):-10], size))
+
+    def test_fileobj_from_its_position(self):
+        fileobj = io.BytesIO(b'skip hello')
+        fileobj.seek(5)
+        body = FormDataEncoder(FIELDS, fileobj=fileobj, filename='key.txt',
+                               boundary='b0')
+        self.assertEqual(body.read(), EXPECTED)
+
+    def test_truncated_file(self):
+        body = FormDataEncoder([], fileobj=io.BytesIO(b'short'), length=10,
+                               boundary='b0')
+        self.assertRaises(Exception, body.read)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,252 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from ecstest import constants
+from ecstest import multipart
+
+
+class _Response(object):
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise _HTTPError(self.status_code)
+
+
+class _HTTPError(Exception):
+    def __init__(self, status_code):
+        Exception.__init__(self, status_code)
+        self.response = _Response(status_code)
+
+
+class TestParts(unittest.TestCase):
+
+    def test_split_parts(self):
+        self.assertEqual(multipart.split_parts(10, 4),
+                         [(1, 0, 4), (2, 4, 4), (3, 8, 2)])
+        self.assertEqual(multipart.split_parts(4, 4), [(1, 0, 4)])
+        self.assertRaises(Exception, multipart.split_parts, 0, 4)
+
+    def test_split_parts_grows_part_size(self):
+        parts = multipart.split_parts(multipart.MAX_PART_NUMBER * 10 + 1, 5)
+        # The smallest part size fitting in MAX_PART_NUMBER parts.
+        self.assertEqual(parts[0], (1, 0, 11))
+        self.assertLessEqual(len(parts), multipart.MAX_PART_NUMBER)
+        self.assertEqual(sum(size for _, _, size in parts),
+                         multipart.MAX_PART_NUMBER * 10 + 1)
+
+    def test_multipart_etag(self):
+        # The ETag S3 gives an object of the parts 'a' and 'b'.
+        digests = [hashlib.md5(b'a').digest(), hashlib.md5(b'b').digest()]
+        self.assertEqual(multipart.multipart_etag(digests),
+                         '96e024ba2074fe77e8e965ba43a704be-2')
+
+    def test_is_transient(self):
+        self.assertTrue(multipart.is_transient(Exception('reset')))
+        for status_code in (500, 503, 408, 429):
+            self.assertTrue(multipart.is_transient(_HTTPError(status_code)))
+        for status_code in (400, 403, 404):
+            self.assertFalse(multipart.is_transient(_HTTPError(status_code)))
+
+    def test_part_reader(self):
+        fp = io.BytesIO(b'0123456789')
+        fp.seek(2)
+        reader = multipart.PartReader(fp, 5)
+        self.assertEqual(len(reader), 5)
+        self.assertEqual(reader.read(3), b'234')
+        self.assertEqual(reader.read(), b'56')
+        self.assertEqual(reader.read(), b'')
+        self.assertEqual(reader.md5.hexdigest(),
+                         hashlib.md5(b'23456').hexdigest())
+
+    def test_find_xml_text(self):
+        content = (b'<InitiateMultipartUploadResult xmlns="http://s3.'
+                   b'amazonaws.com/doc/2006-03-01/"><Bucket>b</Bucket>'
+                   b'<UploadId> id1 </UploadId>'
+                   b'</InitiateMultipartUploadResult>')
+        self.assertEqual(multipart.find_xml_text(content, 'UploadId'), 'id1')
+        self.assertIsNone(multipart.find_xml_text(content, 'ETag'))
+
+
+class _Provider(object):
+    access_key = 'user'
+    secret_key = 'secret'
+
+
+class _Connection(object):
+    host = 'ecs.invalid'
+    port = 9020
+    is_secure = False
+    provider = _Provider()
+
+
+class _Bucket(object):
+    name = 'bucket'
+    connection = _Connection()
+
+
+class _MultipartServer(object):
+    '''
+    The multipart upload API of S3, in memory.
+    Sending the parts of fail_parts fails with a 403 once.
+    '''
+    def __init__(self):
+        self.uploads = {}
+        self.sent = []
+        self.fail_parts = set()
+
+    def request(self, method, params=None, data=None, headers=None):
+        params = params or {}
+        if method == 'POST' and 'uploads' in params:
+            upload_id = 'upload%d' % len(self.uploads)
+            self.uploads[upload_id] = {}
+            return _Response(200, (
+                '<InitiateMultipartUploadResult><UploadId>%s</UploadId>'
+                '</InitiateMultipartUploadResult>' % upload_id).encode())
+        parts = self.uploads[params['uploadId']]
+        if method == 'PUT':
+            part_number = int(params['partNumber'])
+            body = data.read()
+            if part_number in self.fail_parts:
+                self.fail_parts.discard(part_number)
+                return _Response(403)
+            self.sent.append(part_number)
+            parts[part_number] = (hashlib.md5(body).hexdigest(), len(body))
+            return _Response(200, headers={
+                'ETag': '"%s"' % parts[part_number][0]})
+        if method == 'GET':
+            return _Response(200, (
+                '<ListPartsResult>%s<IsTruncated>false</IsTruncated>'
+                '</ListPartsResult>' % ''.join(
+                    '<Part><PartNumber>%d</PartNumber><ETag>"%s"</ETag>'
+                    '<Size>%d</Size></Part>' % (number, etag, size)
+                    for number, (etag, size) in sorted(parts.items()))
+            ).encode())
+        if method == 'POST':
+            etag = multipart.multipart_etag(
+                [bytes(bytearray.fromhex(parts[number][0]))
+                 for number in sorted(parts)])
+            return _Response(200, (
+                '<CompleteMultipartUploadResult><ETag>"%s"</ETag>'
+                '</CompleteMultipartUploadResult>' % etag).encode())
+        raise AssertionError('unexpected %s' % method)
+
+
+class TestResumableUploader(unittest.TestCase):
+
+    LENGTH = 2 * constants.S3_MIN_PART_SIZE + 1000
+
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp(prefix='ecstest-unit-')
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.state_file = os.path.join(tmp_dir, 'upload.state')
+        self.server = _MultipartServer()
+        # Every part is saved to the state file.
+        patcher = mock.patch.object(multipart, 'CHECKPOINT_INTERVAL', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _uploader(self):
+        uploader = multipart.ResumableUploader(
+            _Bucket(), 'key', self.state_file, num_workers=1,
+            part_size=constants.S3_MIN_PART_SIZE)
+        uploader._request = lambda method, **kwargs: \
+            self.server.request(method, **kwargs)
+        return uploader
+
+    def _load_state(self):
+        with open(self.state_file) as state_file:
+            return json.load(state_file)
+
+    def _fail_first_upload(self):
+        self.server.fail_parts.add(2)
+        self.assertRaises(_HTTPError, self._uploader().upload_pseudo_file,
+                          self.LENGTH, seed=4)
+        self.assertEqual(self.server.sent, [1])
+
+    def test_upload(self):
+        result = self._uploader().upload_pseudo_file(self.LENGTH, seed=4)
+        self.assertTrue(result.is_valid())
+        self.assertEqual(self.server.sent, [1, 2, 3])
+        self.assertFalse(os.path.exists(self.state_file))
+
+    def test_state_file(self):
+        self._fail_first_upload()
+        state = self._load_state()
+        self.assertEqual(state['upload_id'], 'upload0')
+        self.assertEqual(state['url'], 'http://ecs.invalid:9020/bucket/key')
+        self.assertEqual(state['source'], {'pseudofile': True,
+                                           'length': self.LENGTH,
+                                           'seed': 4})
+        self.assertEqual(state['part_size'], constants.S3_MIN_PART_SIZE)
+        etag = self.server.uploads['upload0'][1][0]
+        self.assertEqual([tuple(part) for part in state['parts']],
+                         [(1, constants.S3_MIN_PART_SIZE, etag, etag)])
+
+    def test_resume(self):
+        self._fail_first_upload()
+        uploader = self._uploader()
+        result = uploader.upload_pseudo_file(self.LENGTH, seed=4)
+        self.assertEqual(uploader.resumed_parts, 1)
+        self.assertEqual(self.server.sent, [1, 2, 3])
+        self.assertEqual(result.upload_id, 'upload0')
+        self.assertTrue(result.is_valid())
+        self.assertFalse(os.path.exists(self.state_file))
+
+    def test_resume_part_not_saved(self):
+        # A part stored by ECS is kept if it has the MD5 of the data.
+        self._fail_first_upload()
+        state = self._load_state()
+        state['parts'] = []
+        with open(self.state_file, 'w') as state_file:
+            json.dump(state, state_file)
+        uploader = self._uploader()
+        result = uploader.upload_pseudo_file(self.LENGTH, seed=4)
+        self.assertEqual(uploader.resumed_parts, 1)
+        self.assertEqual(self.server.sent, [1, 2, 3])
+        self.assertTrue(result.is_valid())
+
+    def test_other_source(self):
+        self._fail_first_upload()
+        result = self._uploader().upload_pseudo_file(self.LENGTH, seed=5)
+        self.assertEqual(result.upload_id, 'upload1')
+        self.assertEqual(self.server.sent, [1, 1, 2, 3])
+
+    def test_corrupted_state_file(self):
+        with open(self.state_file, 'w') as state_file:
+            state_file.write('{"upload_id":')
+        result = self._uploader().upload_pseudo_file(self.LENGTH, seed=4)
+        self.assertEqual(result.upload_id, 'upload0')
+        self.assertTrue(result.is_valid())
+
+
+if __name__ == '__main__':
+    unittest.main()
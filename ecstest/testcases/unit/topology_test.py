@@ -0,0 +1,173 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+import collections
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from ecstest import topology
+
+VDC_LIST = b'''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<vdcs xmlns="http://www.emc.com/ecs">
+  <vdc>
+    <vdcId>urn:storageos:VirtualDataCenterData:1</vdcId>
+    <vdcName>vdc1</vdcName>
+    <interVdcEndPoints>10.0.0.1, 10.0.0.2,10.0.0.3</interVdcEndPoints>
+  </vdc>
+  <vdc>
+    <vdcId>urn:storageos:VirtualDataCenterData:2</vdcId>
+    <interVdcEndPoints>10.0.1.1</interVdcEndPoints>
+  </vdc>
+  <vdc>
+    <vdcName>empty</vdcName>
+    <interVdcEndPoints></interVdcEndPoints>
+  </vdc>
+  <vdc>
+    <interVdcEndPoints>10.0.2.1,10.0.2.2</interVdcEndPoints>
+  </vdc>
+</vdcs>'''
+
+VDCS = [('vdc1', ['10.0.0.1', '10.0.0.2', '10.0.0.3']),
+        ('vdc2', ['10.0.1.1']),
+        ('vdc3', ['10.0.2.1', '10.0.2.2'])]
+
+
+class TestParseVdcList(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(topology.parse_vdc_list(io.BytesIO(VDC_LIST)), [
+            ('vdc1', ['10.0.0.1', '10.0.0.2', '10.0.0.3']),
+            ('urn:storageos:VirtualDataCenterData:2', ['10.0.1.1']),
+            # Named after its position among the VDCs kept.
+            ('vdc2', ['10.0.2.1', '10.0.2.2'])])
+
+    def test_no_vdc(self):
+        self.assertEqual(topology.parse_vdc_list(io.BytesIO(b'<vdcs/>')),
+                         [])
+
+
+class TestNodeIterator(unittest.TestCase):
+
+    def test_interleave_nodes(self):
+        self.assertEqual(topology.interleave_nodes(VDCS),
+                         ['10.0.0.1', '10.0.1.1', '10.0.2.1',
+                          '10.0.0.2', '10.0.2.2', '10.0.0.3'])
+        self.assertEqual(topology.interleave_nodes([]), [])
+
+    def test_unweighted(self):
+        nodes = topology.NodeIterator(VDCS)
+        order = topology.interleave_nodes(VDCS)
+        self.assertEqual([next(nodes) for _ in range(2 * len(order))],
+                         order * 2)
+
+    def test_weighted(self):
+        nodes = topology.NodeIterator(VDCS, weights={'vdc1': 3, 'vdc2': 1,
+                                                     'vdc3': 0})
+        picked = [next(nodes) for _ in range(400)]
+        counts = collections.Counter(picked)
+        self.assertEqual(counts['10.0.1.1'], 100)
+        for node in VDCS[0][1]:
+            self.assertEqual(counts[node], 100)
+        self.assertNotIn('10.0.2.1', counts)
+        # Smooth: vdc2 comes once in every 4 picks.
+        self.assertEqual([i % 4 for i, node in enumerate(picked)
+                          if node == '10.0.1.1'],
+                         [picked.index('10.0.1.1')] * 100)
+
+    def test_no_node(self):
+        self.assertRaises(Exception, topology.NodeIterator, [])
+        self.assertRaises(Exception, topology.NodeIterator, VDCS,
+                          {'other': 1})
+
+    def test_threads(self):
+        nodes = topology.NodeIterator(VDCS)
+        picked = []
+
+        def pick():
+            for _ in range(600):
+                picked.append(next(nodes))
+
+        threads = [threading.Thread(target=pick) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counts = collections.Counter(picked)
+        self.assertEqual(set(counts.values()), set([400]))
+
+
+class TestTopology(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp(prefix='ecstest-unit-')
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.cache_file = os.path.join(tmp_dir, 'topology.json')
+        patcher = mock.patch.object(topology, 'fetch_vdc_list',
+                                    return_value=VDCS)
+        self.fetch = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cached(self):
+        first = topology.Topology(ttl=60, cache_file=self.cache_file)
+        self.assertEqual(first.get_vdcs(), VDCS)
+        self.assertEqual(first.get_nodes('vdc2'), ['10.0.1.1'])
+        self.assertEqual(len(first.get_nodes()), 6)
+        self.assertEqual(first.get_vdc_names(), ['vdc1', 'vdc2', 'vdc3'])
+        self.assertRaises(Exception, first.get_nodes, 'other')
+        # Another process reads the cache file.
+        second = topology.Topology(ttl=60, cache_file=self.cache_file)
+        self.assertEqual(second.get_vdcs(), VDCS)
+        self.assertEqual(self.fetch.call_count, 1)
+
+    def test_expired(self):
+        cached = topology.Topology(ttl=0, cache_file=self.cache_file)
+        cached.get_vdcs()
+        cached.get_vdcs()
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_no_vdc(self):
+        self.fetch.return_value = []
+        cached = topology.Topology(ttl=60, cache_file=None)
+        self.assertRaises(Exception, cached.get_vdcs)
+
+    def test_refresh_keeps_topology_on_failure(self):
+        cached = topology.Topology(ttl=60, cache_file=None)
+        cached.get_vdcs()
+        self.fetch.side_effect = Exception('control plane is down')
+        self.assertRaises(Exception, cached.refresh)
+        self.assertEqual(cached.get_vdcs(), VDCS)
+
+    def test_stop_refresh(self):
+        cached = topology.Topology(ttl=60, cache_file=None)
+        cached.start_refresh(0.01)
+        thread = cached._thread
+        cached.stop_refresh()
+        self.assertFalse(thread.is_alive())
+        cached.start_refresh(0.01)
+        self.assertIsNot(cached._thread, thread)
+        cached.stop_refresh()
+
+
+if __name__ == '__main__':
+    unittest.main()
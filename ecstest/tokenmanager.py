@@ -0,0 +1,245 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+import atexit
+import hashlib
+import threading
+import time
+
+from ecstest.logger import logger
+from ecstest import client
+from ecstest import config
+from ecstest import constants
+
+cfg = config.get_config()
+
+
+class _TokenSlots(object):
+    '''
+    Count the tokens held by all managers,
+    to stay below the active-token limit of ECS.
+    '''
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout):
+        deadline = time.time() + timeout
+        with self._cond:
+            while self.used >= self.limit:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise Exception('more than %d control plane tokens '
+                                    'are in use' % self.limit)
+                self._cond.wait(remaining)
+            self.used += 1
+
+    def release(self):
+        with self._cond:
+            self.used -= 1
+            self._cond.notify()
+
+
+_slots = _TokenSlots(cfg['MAX_ACTIVE_TOKENS'])
+
+
+class TokenManager(object):
+    '''
+    One authentication token of a control plane user,
+    shared by every client and thread of the process.
+
+    The token cached by a previous run in a file of username and
+    ecs_endpoint, see get_token_filename(), is reused if ECS still
+    accepts it as the token of username. When ECS answers 401,
+    refresh() logs in again, only once for all the threads which saw
+    the same token fail.
+    The token is logged out when the process exits.
+    '''
+    def __init__(self, username=cfg['ADMIN_USERNAME'],
+                 password=cfg['ADMIN_PASSWORD'],
+                 ecs_endpoint=cfg['CONTROL_ENDPOINT'],
+                 token_endpoint=cfg['TOKEN_ENDPOINT'],
+                 token=cfg['TOKEN']):
+        self.username = username
+        self.token = None
+        self.logins = 0
+        self._initial_token = token
+        self._client = client.EcsControlPlaneClient(
+            username=username,
+            password=password,
+            ecs_endpoint=ecs_endpoint,
+            token_endpoint=token_endpoint,
+            verify_ssl=cfg['VERIFY_SSL'],
+            token_filename=get_token_filename(username, ecs_endpoint),
+            request_timeout=cfg['REQUEST_TIMEOUT'],
+            cache_token=cfg['CACHE_TOKEN'])
+        self._cond = threading.Condition()
+        self._refreshing = False
+        self._has_slot = False
+        self._loaded = False
+
+    def get_token(self):
+        '''Return the shared token, logging in if there is none yet.'''
+        with self._cond:
+            token = self.token
+        if token:
+            return token
+        return self.refresh(None)
+
+    def refresh(self, stale_token):
+        '''
+        Return a valid token after stale_token was rejected by ECS.
+        Threads calling it with the same stale_token wait for a
+        single login; a token refreshed meanwhile is returned at once.
+        '''
+        with self._cond:
+            while self._refreshing:
+                self._cond.wait()
+            if self.token and self.token != stale_token:
+                return self.token
+            self._refreshing = True
+        token = None
+        try:
+            token = self._get_new_token(stale_token)
+        finally:
+            with self._cond:
+                self.token = token
+                self._refreshing = False
+                self._cond.notify_all()
+        return token
+
+    def _get_new_token(self, stale_token):
+        if not self._loaded:
+            self._loaded = True
+            for token in (self._initial_token, self._read_cached_token()):
+                if token and token != stale_token and \
+                        self._is_valid(token):
+                    logger.debug('reuse control plane token of %s',
+                                 self.username)
+                    self._take_slot()
+                    return token
+        self._take_slot()
+        response = self._client.make_login_request()
+        response.raise_for_status()
+        self.logins += 1
+        logger.debug('logged in control plane as %s', self.username)
+        return self._client.token
+
+    def _take_slot(self):
+        # The token replaced by a refresh is expired, keep its slot.
+        if not self._has_slot:
+            _slots.acquire(cfg['REQUEST_TIMEOUT'])
+            self._has_slot = True
+
+    def _read_cached_token(self):
+        if not self._client.cache_token:
+            return None
+        try:
+            with open(self._client.token_filename) as token_file:
+                token = token_file.read().strip()
+        except IOError:
+            return None
+        min_length = int(cfg['AUTH_TOKEN_MIN_LENGTH'])
+        max_length = int(cfg['AUTH_TOKEN_MAX_LENGTH'])
+        if not min_length <= len(token) <= max_length:
+            return None
+        return token
+
+    def _is_valid(self, token):
+        try:
+            response = self._client.session.get(
+                '{0}/user/whoami'.format(self._client.ecs_endpoint),
+                verify=self._client.verify_ssl,
+                headers={'Accept': constants.APPLICATION_JSON,
+                         'X-SDS-AUTH-TOKEN': token},
+                timeout=self._client.request_timeout)
+        except Exception as err:
+            logger.debug('cannot validate control plane token: %s', err)
+            return False
+        if response.status_code != 200:
+            return False
+        try:
+            whoami = response.json().get('common_name')
+        except ValueError:
+            return False
+        if whoami != self.username:
+            logger.debug('cached control plane token is of %s, not %s',
+                         whoami, self.username)
+            return False
+        return True
+
+    def logout(self):
+        '''Log the shared token out and give its slot back.'''
+        with self._cond:
+            token, self.token = self.token, None
+        if token:
+            try:
+                self._client.token = token
+                self._client.make_logout_request()
+            except Exception as err:
+                logger.warn('control plane logout of %s failed: %s',
+                            self.username, err)
+        if self._has_slot:
+            self._has_slot = False
+            _slots.release()
+
+
+def get_token_filename(username, ecs_endpoint):
+    '''
+    Return the file caching the token of username on ecs_endpoint,
+    ECSTEST_TOKEN_FILENAME suffixed by a digest of both, so that
+    users never pick up the token of another one.
+    '''
+    digest = hashlib.md5(('%s@%s' % (username, ecs_endpoint.rstrip('/')))
+                         .encode('utf-8')).hexdigest()
+    return '%s.%s' % (cfg['TOKEN_FILENAME'], digest[:12])
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def is_enabled():
+    '''Tokens are shared when ECSTEST_SHARE_TOKEN is set.'''
+    return cfg['SHARE_TOKEN']
+
+
+def get_manager(username=cfg['ADMIN_USERNAME'],
+                password=cfg['ADMIN_PASSWORD'],
+                ecs_endpoint=cfg['CONTROL_ENDPOINT'],
+                token_endpoint=cfg['TOKEN_ENDPOINT']):
+    '''
+    Return the process-wide token manager of username on ecs_endpoint.
+    '''
+    key = (username, ecs_endpoint.rstrip('/'))
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = TokenManager(username, password,
+                                   ecs_endpoint, token_endpoint)
+            _managers[key] = manager
+    return manager
+
+
+def logout_all():
+    '''Log out the tokens of all managers.'''
+    with _managers_lock:
+        managers = list(_managers.values())
+    for manager in managers:
+        manager.logout()
+
+
+atexit.register(logout_all)
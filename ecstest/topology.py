@@ -0,0 +1,324 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+import json
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import requests
+
+from ecstest.logger import logger
+from ecstest import config
+from ecstest import constants
+from ecstest.controlplane import usermgmt
+
+cfg = config.get_config()
+
+
+def _local_name(tag):
+    # Drop the namespace of '{namespace}name'.
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_vdc_list(stream):
+    '''
+    Parse the response of /object/vdcs/vdc/list from a file-like
+    stream and return a list of (vdc name, list of nodes).
+    Each <vdc> is dropped once parsed, the whole document
+    is never held in memory.
+    '''
+    vdcs = []
+    for _, elem in ET.iterparse(stream):
+        if _local_name(elem.tag) != 'vdc':
+            continue
+        fields = dict((_local_name(child.tag), (child.text or '').strip())
+                      for child in elem)
+        name = fields.get('vdcName') or fields.get('vdcId') or \
+            'vdc%d' % len(vdcs)
+        nodes = [node.strip()
+                 for node in fields.get('interVdcEndPoints', '').split(',')
+                 if node.strip()]
+        if nodes:
+            vdcs.append((name, nodes))
+        elem.clear()
+    return vdcs
+
+
+def fetch_vdc_list():
+    '''Get the VDCs and their nodes from the ECS REST API.'''
+    admin = usermgmt.UserAdmin()
+    auth_token = admin.login()
+
+    url = cfg['CONTROL_ENDPOINT'] + '/object/vdcs/vdc/list'
+    headers = {
+        'Accept': constants.APPLICATION_XML,
+        'Content-Type': constants.APPLICATION_XML,
+        'X-SDS-AUTH-TOKEN': auth_token
+    }
+
+    try:
+        response = requests.get(url, headers=headers,
+                                verify=cfg['VERIFY_SSL'], stream=True,
+                                timeout=cfg['REQUEST_TIMEOUT'])
+        try:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            return parse_vdc_list(response.raw)
+        finally:
+            response.close()
+    finally:
+        # leak auth token
+        if admin.client.token:
+            logger.debug('release the auth token')
+            admin.logout()
+
+
+def interleave_nodes(vdcs):
+    '''
+    Return the nodes of vdcs, a list of (vdc name, list of nodes),
+    the VDCs taking turns: the first node of each VDC, then the second
+    one, and so on, a VDC whose nodes are exhausted being skipped.
+    '''
+    node_list = []
+    max_len_vdc = max([len(nodes) for _, nodes in vdcs] or [0])
+    for i in range(max_len_vdc):
+        for _, nodes in vdcs:
+            if i < len(nodes):
+                node_list.append(nodes[i])
+    return node_list
+
+
+class NodeIterator(object):
+    '''
+    Endless, thread safe iterator over the nodes of several VDCs.
+
+    Without weights, the nodes come in the order of interleave_nodes(),
+    so every node appears once before any appears again.
+    With weights, a dict of VDC name to an integer, each VDC
+    is picked in proportion to its weight (smooth weighted
+    round-robin), a VDC missing from weights is never picked.
+    '''
+    def __init__(self, vdcs, weights=None):
+        self._order = None
+        if weights is None:
+            self._order = interleave_nodes(vdcs)
+            if not self._order:
+                raise Exception('no node to iterate over')
+            self._position = 0
+            self._lock = threading.Lock()
+            return
+        self._vdcs = [(name, nodes, weights.get(name, 0))
+                      for name, nodes in vdcs if weights.get(name, 0) > 0]
+        if not self._vdcs:
+            raise Exception('no node to iterate over')
+        self._total = sum(weight for _, _, weight in self._vdcs)
+        self._current = [0] * len(self._vdcs)
+        self._positions = [0] * len(self._vdcs)
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._lock:
+            if self._order is not None:
+                node = self._order[self._position % len(self._order)]
+                self._position += 1
+                return node
+            best = 0
+            for i, (_, _, weight) in enumerate(self._vdcs):
+                self._current[i] += weight
+                if self._current[i] > self._current[best]:
+                    best = i
+            self._current[best] -= self._total
+            nodes = self._vdcs[best][1]
+            node = nodes[self._positions[best] % len(nodes)]
+            self._positions[best] += 1
+            return node
+
+    next = __next__
+
+
+class Topology(object):
+    '''
+    The VDCs of ECS and their nodes, fetched from the control plane
+    at most once per ttl seconds and shared with other test processes
+    through cache_file.
+
+    start_refresh() refreshes the topology in a background thread,
+    so tests asking for nodes never wait for the control plane.
+    '''
+    def __init__(self, ttl=cfg['TOPOLOGY_TTL'],
+                 cache_file=cfg['TOPOLOGY_CACHE_FILE']):
+        self.ttl = ttl
+        self.cache_file = cache_file
+        self._vdcs = None
+        self._expires = 0
+        # _lock guards _vdcs and _expires and is never held while
+        # fetching, _fetch_lock lets a single thread fetch at a time.
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._stop = None
+        self._thread = None
+
+    def _current(self):
+        # The known topology if it has not expired, under _lock.
+        if self._vdcs is not None and time.time() < self._expires:
+            return self._vdcs
+        return None
+
+    def get_vdcs(self):
+        '''Return a list of (vdc name, list of nodes).'''
+        with self._lock:
+            vdcs = self._current()
+        if vdcs is not None:
+            return vdcs
+        with self._fetch_lock:
+            # Another thread may have loaded it meanwhile.
+            with self._lock:
+                vdcs = self._current()
+            if vdcs is not None:
+                return vdcs
+            loaded = self._read_cache_file()
+            if loaded is None:
+                return self._fetch()
+            with self._lock:
+                self._vdcs, self._expires = loaded
+            return loaded[0]
+
+    def _fetch(self):
+        # Called with _fetch_lock held, readers go on with the
+        # topology known so far until it is replaced.
+        vdcs = fetch_vdc_list()
+        if not vdcs:
+            raise Exception('no VDC found in ECS')
+        logger.debug('get VDC list: %s', vdcs)
+        with self._lock:
+            self._vdcs = vdcs
+            self._expires = time.time() + self.ttl
+        self._write_cache_file(vdcs)
+        return vdcs
+
+    def refresh(self):
+        '''Fetch the topology from the control plane now.'''
+        with self._fetch_lock:
+            self._fetch()
+
+    def _read_cache_file(self):
+        if not self.cache_file:
+            return None
+        try:
+            mtime = os.path.getmtime(self.cache_file)
+            with open(self.cache_file) as cache_file:
+                cached = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return None
+        expires = mtime + self.ttl
+        if cached.get('endpoint') != cfg['CONTROL_ENDPOINT'] or \
+                time.time() >= expires:
+            return None
+        return [(name, nodes) for name, nodes in cached['vdcs']], expires
+
+    def _write_cache_file(self, vdcs):
+        if not self.cache_file:
+            return
+        tmp_path = '%s.%d' % (self.cache_file, os.getpid())
+        try:
+            with open(tmp_path, 'w') as cache_file:
+                json.dump({'endpoint': cfg['CONTROL_ENDPOINT'],
+                           'vdcs': vdcs}, cache_file)
+            # rename is atomic, other processes never see a partial file.
+            os.rename(tmp_path, self.cache_file)
+        except (IOError, OSError) as err:
+            logger.warn('cannot write topology cache file %s: %s',
+                        self.cache_file, err)
+
+    def get_nodes(self, vdc=None):
+        '''Return the nodes of vdc, or of all VDCs.'''
+        vdcs = self.get_vdcs()
+        if vdc is None:
+            return [node for _, nodes in vdcs for node in nodes]
+        for name, nodes in vdcs:
+            if name == vdc:
+                return list(nodes)
+        raise Exception('VDC %s not found' % vdc)
+
+    def get_vdc_names(self):
+        return [name for name, _ in self.get_vdcs()]
+
+    def iter_nodes(self, weights=None):
+        '''Return a NodeIterator over the current topology.'''
+        return NodeIterator(self.get_vdcs(), weights)
+
+    def start_refresh(self, interval=None):
+        '''
+        Refresh the topology every interval seconds, ttl by default,
+        in a daemon thread. Failures are logged and the topology
+        known so far is kept.
+        '''
+        if interval is None:
+            interval = self.ttl
+        if self._thread is not None:
+            return
+        # Each thread has its own event, so a thread which is not done
+        # yet with a refresh stops even if another one is started.
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._refresh_loop,
+                                        args=(interval, self._stop),
+                                        name='ecstest-topology')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _refresh_loop(self, interval, stop):
+        while not stop.wait(interval):
+            try:
+                self.refresh()
+            except Exception as err:
+                logger.warn('topology refresh failed: %s', err)
+            else:
+                # Tests never fetch it themselves between two refreshes.
+                with self._lock:
+                    self._expires = time.time() + max(self.ttl, interval)
+
+    def stop_refresh(self, timeout=None):
+        '''
+        Stop the refresh thread, waiting up to timeout seconds
+        for a refresh in progress to end.
+        '''
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join(timeout)
+
+
+_topology = None
+_topology_lock = threading.Lock()
+
+
+def get_topology():
+    '''
+    Return the process-wide topology, refreshed in the background
+    when ECSTEST_TOPOLOGY_REFRESH_INTERVAL is positive.
+    '''
+    global _topology
+    with _topology_lock:
+        if _topology is None:
+            _topology = Topology()
+            if cfg['TOPOLOGY_REFRESH_INTERVAL'] > 0:
+                _topology.start_refresh(cfg['TOPOLOGY_REFRESH_INTERVAL'])
+    return _topology
@@ -0,0 +1,290 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import atexit
+import json
+import os
+import threading
+import uuid
+
+from ecstest.logger import logger
+from ecstest import config
+from ecstest import constants
+from ecstest import workerpool
+from ecstest.controlplane import usermgmt
+
+cfg = config.get_config()
+
+
+class PooledUser(object):
+    '''An object user and its secret key leased from a UserPool.'''
+    def __init__(self, username, secret_key):
+        self.username = username
+        self.secret_key = secret_key
+
+    def to_dict(self):
+        return {'username': self.username, 'secret_key': self.secret_key}
+
+
+class UserPool(object):
+    '''
+    A pool of object users leased to tests needing another identity,
+    instead of creating a user and its secret key in every test.
+
+    Users are created concurrently by start(). With state_file, the
+    users are written to it when the pool is destroyed and kept on ECS,
+    so the next run reuses the ones whose secret key is still valid.
+    Without it, or for users beyond size, they are deactivated
+    concurrently at exit.
+
+    With rotate_keys, a released user gets a new secret key and
+    its old one is deactivated in the background before it is leased
+    again, for tests which must not see a key used before.
+    '''
+    def __init__(self, size=cfg['USER_POOL_SIZE'],
+                 namespace=cfg['NAMESPACE'],
+                 state_file=cfg['USER_POOL_STATE_FILE'],
+                 rotate_keys=cfg['USER_POOL_ROTATE_KEYS'],
+                 num_workers=constants.DEFAULT_THREAD_NUMBER,
+                 lease_timeout=cfg['REQUEST_TIMEOUT']):
+        self.size = size
+        self.namespace = namespace
+        self.state_file = state_file
+        self.rotate_keys = rotate_keys
+        self.lease_timeout = lease_timeout
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._users = {}
+        self._recycling = 0
+        self._local = threading.local()
+        self._admins = []
+        self._workers = workerpool.WorkerPool(num_workers,
+                                              name='ecstest-user-pool')
+        self._started = False
+        self._destroyed = False
+
+    def _get_admin(self):
+        # The control plane session of UserAdmin is not thread safe,
+        # each thread logs in once, destroy() logs them all out.
+        admin = getattr(self._local, 'admin', None)
+        if admin is None:
+            admin = usermgmt.UserAdmin()
+            admin.login()
+            with self._lock:
+                self._admins.append(admin)
+            self._local.admin = admin
+        return admin
+
+    def _logout_admins(self):
+        # leak auth token
+        with self._lock:
+            admins, self._admins = self._admins, []
+        for admin in admins:
+            try:
+                if admin.client.token:
+                    admin.logout()
+            except Exception as err:
+                logger.warn('user pool failed to log out: %s', err)
+
+    def _create_user(self):
+        # Talk to the client directly, UserAdmin.create_user() and
+        # create_secret_key() each query the user info once more.
+        admin = self._get_admin()
+        username = uuid.uuid4().hex
+        admin.client.user_management.create_object_user(
+            username, self.namespace).raise_for_status()
+        response = admin.client.secret_key_management.create_secret_key(
+            username, namespace=self.namespace)
+        response.raise_for_status()
+        user = PooledUser(username, response.json()['secret_key'])
+        with self._lock:
+            self._users[username] = user
+        logger.debug('user pool created user %s', username)
+        return user
+
+    def _deactivate_user(self, user):
+        with self._lock:
+            self._users.pop(user.username, None)
+        try:
+            admin = self._get_admin()
+            admin.delete_secret_key(user.username).raise_for_status()
+            admin.delete_user(user.username).raise_for_status()
+        except Exception as err:
+            logger.warn('user pool failed to deactivate user %s: %s',
+                        user.username, err)
+
+    def _check_user(self, user):
+        # A user is reusable if its secret key is still active.
+        try:
+            keys = self._get_admin().get_secret_keys(user.username)
+        except Exception as err:
+            logger.debug('user pool cannot reuse user %s: %s',
+                         user.username, err)
+            return None
+        if user.secret_key not in keys:
+            return None
+        with self._lock:
+            self._users[user.username] = user
+        return user
+
+    def _load_state(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return []
+        try:
+            with open(self.state_file) as state_file:
+                state = json.load(state_file)
+        except (IOError, ValueError) as err:
+            logger.warn('user pool ignores state file %s: %s',
+                        self.state_file, err)
+            return []
+        if state.get('endpoint') != cfg['CONTROL_ENDPOINT'] or \
+                state.get('namespace') != self.namespace:
+            return []
+        return [PooledUser(user['username'], user['secret_key'])
+                for user in state.get('users', [])]
+
+    def _save_state(self, users):
+        state = {'endpoint': cfg['CONTROL_ENDPOINT'],
+                 'namespace': self.namespace,
+                 'users': [user.to_dict() for user in users]}
+        tmp_path = '%s.%d' % (self.state_file, os.getpid())
+        with open(tmp_path, 'w') as state_file:
+            json.dump(state, state_file)
+        os.chmod(tmp_path, 0o600)
+        os.rename(tmp_path, self.state_file)
+
+    def start(self):
+        '''
+        Reuse the users of the state file which are still valid,
+        and create the missing ones concurrently.
+        '''
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        saved = self._load_state()[:self.size]
+        users = [user for user in self._workers.map(self._check_user, saved)
+                 if user is not None]
+        logger.debug('user pool reuses %d of %d saved users',
+                     len(users), len(saved))
+        tasks = [self._workers.submit(self._create_user)
+                 for _ in range(self.size - len(users))]
+        users.extend(task.result() for task in tasks)
+        for user in users:
+            self._idle.put(user)
+
+    def lease(self):
+        '''
+        Return a PooledUser for the exclusive use of the caller
+        until it is released.
+        '''
+        self.start()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            recycling = self._recycling
+        if recycling:
+            try:
+                return self._idle.get(timeout=self.lease_timeout)
+            except queue.Empty:
+                pass
+        logger.debug('user pool is exhausted, create a new user')
+        return self._create_user()
+
+    def release(self, user):
+        '''Give a leased user back to the pool.'''
+        if not self.rotate_keys:
+            self._idle.put(user)
+            return
+        with self._lock:
+            self._recycling += 1
+        self._workers.submit(self._rotate_key, user)
+
+    def _rotate_key(self, user):
+        try:
+            admin = self._get_admin()
+            response = admin.client.secret_key_management.create_secret_key(
+                user.username, namespace=self.namespace)
+            response.raise_for_status()
+            old_key = user.secret_key
+            user.secret_key = response.json()['secret_key']
+            admin.delete_secret_key(user.username,
+                                    old_key).raise_for_status()
+        except Exception as err:
+            logger.warn('user pool failed to rotate key of user %s: %s',
+                        user.username, err)
+            self._deactivate_user(user)
+            user = None
+        finally:
+            with self._lock:
+                self._recycling -= 1
+        if user is not None:
+            self._idle.put(user)
+
+    def destroy(self):
+        '''
+        Wait for the keys being rotated, then save up to size users
+        to the state file and deactivate all the others.
+        '''
+        with self._lock:
+            if self._destroyed:
+                return
+            self._destroyed = True
+        self._workers.shutdown()
+        with self._lock:
+            users = list(self._users.values())
+        kept = []
+        if self.state_file:
+            kept, users = users[:self.size], users[self.size:]
+            try:
+                self._save_state(kept)
+            except (IOError, OSError) as err:
+                logger.warn('user pool failed to save state file %s: %s',
+                            self.state_file, err)
+                users.extend(kept)
+        with workerpool.WorkerPool(name='ecstest-user-pool') as workers:
+            for user in users:
+                workers.submit(self._deactivate_user, user)
+        self._logout_admins()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def is_enabled():
+    '''The pool is used when ECSTEST_USER_POOL_SIZE is positive.'''
+    return cfg['USER_POOL_SIZE'] > 0 and \
+        cfg['TEST_TARGET'] == constants.TARGET_ECS
+
+
+def get_pool():
+    '''
+    Return the process-wide user pool, created on first use
+    and destroyed when the test run exits.
+    '''
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = UserPool()
+            atexit.register(_pool.destroy)
+    return _pool
@@ -15,18 +15,19 @@ Author: Rubicon ISE team
 
 import binascii
 import hashlib
-import hmac
 import re
-import requests
 import time
 import uuid
 
-from boto.s3.key import Key
-
 from ecstest.controlplane import usermgmt
 from ecstest.logger import logger
 from ecstest import config
 from ecstest import constants
+from ecstest import purge
+from ecstest import signer
+from ecstest import teardown
+from ecstest import topology
+from ecstest import userpool
 
 
 cfg = config.get_config()
@@ -38,68 +39,20 @@ def mktime_from_str(time_string, time_format="%a, %d %b %Y %H:%M:%S %Z"):
     return int(time.mktime(time.strptime(time_string, time_format)))
 
 
-def delete_keys(bucket, target):
+def delete_keys(bucket, target, num_workers=None, versions=None):
     '''
     Delete all keys at the bucket with
     different target like S3/fakes3/ecs.
+    Pages of keys are deleted concurrently while listing goes on,
+    including versions and delete markers of a versioned bucket.
+    See purge.BucketPurger, return its stats.
     '''
-    key_list = []
-    while True:
-        # The most keys of S3/fakes3/ecs returned
-        # by each time is 1000.
-        # Under fakes3, get_all_versions() returns a key_list
-        # which cause strange error when delete, so deal with it separately
-        if target == constants.TARGET_FAKES3:
-            key_list = bucket.get_all_keys()
-            if len(key_list) == 0:
-                break
-            # Fakes3 doesn't support delete_keys() and delete_key() finely.
-            # So add a loop to delete one by one.
-            for key in key_list:
-                Key(bucket, key.name).delete()
-        else:
-            key_list = bucket.get_all_keys()
-            if len(key_list) == 0:
-                break
-            bucket.delete_keys(key_list)
-
-
-def _get_vdc_list():
-    '''
-    Generate VDC list in ECS
-    '''
-    # get VDC list with ECS rest API
-    vdc_list = []
-    admin = usermgmt.UserAdmin()
-    auth_token = admin.login()
-
-    url = cfg['CONTROL_ENDPOINT'] + '/object/vdcs/vdc/list'
-    headers = {
-        'Content-Type': 'application/xml',
-        'X-SDS-AUTH-TOKEN': auth_token
-    }
-
-    try:
-        session = requests.Session()
-        response = session.get(url, headers=headers, verify=False)
-        content = response.text
-
-        # filter the response body to get the interVdcEndPoints for each VDC
-        pat = re.compile(r'<interVdcEndPoints>([\d., ]*)</interVdcEndPoints>')
-
-        # a list of VDC will be like as below, each item is a string type.
-        # [u'172.29.3.148, 172.29.3.149, 172.29.3.150, 172.29.3.151',
-        #  u'172.29.3.212, 172.29.3.213, 172.29.3.214, 172.29.3.215']
-        vdc_list = pat.findall(content.replace('\n', ''))
-
-        # return a VDC list with each VDC item is a list of nodes
-        return [[ip.strip() for ip in vdc.split(',')] for vdc in vdc_list]
-
-    finally:
-        # leak auth token
-        if admin.client.token:
-            logger.debug('release the auth token')
-            admin.logout()
+    if num_workers is None:
+        num_workers = cfg['PURGE_THREADS']
+    purger = purge.BucketPurger(bucket, target,
+                                num_workers=num_workers,
+                                versions=versions)
+    return purger.purge()
 
 
 def generate_node_list(num=None):
@@ -114,21 +67,14 @@ def generate_node_list(num=None):
     # make sure ECS runtest cfg file includes below item:
     # export ECSTEST_TEST_TARGET='ECS'
     if cfg['TEST_TARGET'] == constants.TARGET_ECS:
-        # if the test target is ECS, then get the node list from ECS REST API
-        vdc_list = _get_vdc_list()
-        logger.debug('get VDC list: %s', vdc_list)
-
-        # In case that a VDC contains different node number,
-        # this variable identifies a VDC with max nodes number.
-        max_len_vdc = max([len(vdc) for vdc in vdc_list])
-
-        # use below parsing logic to return a node list with required number
-        for i in range(max_len_vdc):
-            for j in range(len(vdc_list)):
-                if i < len(vdc_list[j]):
-                    node_list.append(vdc_list[j][i])
-                    if len(node_list) == num:
-                        return node_list
+        # if the test target is ECS, then take the nodes of the cached
+        # topology, the VDCs taking turns until every node appeared,
+        # then start over
+        nodes = topology.interleave_nodes(topology.get_topology().get_vdcs())
+        while num > 0:
+            items = min(num, len(nodes))
+            node_list.extend(nodes[0:items])
+            num -= items
     else:
         # if the test target is AWSS3 or FAKES3, just use them literally
         nodes = [cfg['ACCESS_SERVER'], cfg['ALT_ACCESS_SERVER']]
@@ -151,9 +97,7 @@ def get_signature(secret_key, string_to_sign):
     '''
     Get the signature for authorization
     '''
-    hashed = hmac.new(secret_key.encode('utf-8'),
-                      string_to_sign.encode('utf-8'), hashlib.sha1)
-    return binascii.b2a_base64(hashed.digest()).strip('\n')
+    return signer.get_signature(secret_key, string_to_sign)
 
 
 def get_elements_from_xml(elementname, data):
@@ -172,7 +116,14 @@ class AltUser(object):
         # Create one user for ecs
         # Need to export ECSTEST_TEST_TARGET='ECS'
         # for ECS runtest cfg file
-        if self.cfg['TEST_TARGET'] == constants.TARGET_ECS:
+        self.pooled_user = None
+        if userpool.is_enabled():
+            # Lease a user created beforehand, see ecstest/userpool.py.
+            self.pooled_user = userpool.get_pool().lease()
+            self.username = self.pooled_user.username
+            self.secret_key = self.pooled_user.secret_key
+            logger.debug('leased user ' + self.username)
+        elif self.cfg['TEST_TARGET'] == constants.TARGET_ECS:
             self.username = uuid.uuid4().hex
             logger.debug('username is ' + self.username)
 
@@ -193,3 +144,16 @@ class AltUser(object):
             logger.debug('secret_key is ' + self.secret_key)
         else:
             raise Exception('Can not create another user!')
+
+    def delete(self):
+        '''
+        Delete the user and its secret keys if it was created for ECS.
+        It is done in the background when ECSTEST_ASYNC_TEARDOWN is set.
+        A user leased from the user pool is given back to it instead.
+        '''
+        if self.pooled_user is not None:
+            userpool.get_pool().release(self.pooled_user)
+            self.pooled_user = None
+        elif self.cfg['TEST_TARGET'] == constants.TARGET_ECS:
+            teardown.get_executor().delete_user(self.user_admin,
+                                                self.username)
@@ -0,0 +1,151 @@
+# __CR__
+# Copyright (c) 2008-2015 EMC Corporation
+# All Rights Reserved
+#
+# This software contains the intellectual property of EMC Corporation
+# or is licensed to EMC Corporation from third parties.  Use of this
+# software and the intellectual property contained therein is expressly
+# limited to the terms and conditions of the License Agreement under which
+# it is provided by or on behalf of EMC.
+# __CR__
+
+'''
+Author: Rubicon ISE team
+'''
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import sys
+import threading
+
+import six
+
+from ecstest.logger import logger
+from ecstest import constants
+
+
+class Task(object):
+    '''
+    The pending result of a function submitted to a WorkerPool.
+    '''
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+
+    def run(self):
+        try:
+            self._result = self.func(*self.args, **self.kwargs)
+        except Exception:
+            self._exc_info = sys.exc_info()
+            logger.debug('task %r failed', self.func, exc_info=True)
+        finally:
+            self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        '''Wait for the task to finish, return whether it did.'''
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+    def exception(self, timeout=None):
+        '''Return the exception raised by the task, or None.'''
+        if not self.wait(timeout):
+            raise Exception('task %r is not done' % self.func)
+        if self._exc_info is None:
+            return None
+        return self._exc_info[1]
+
+    def result(self, timeout=None):
+        '''Return the value returned by the task, or raise its exception.'''
+        if not self.wait(timeout):
+            raise Exception('task %r is not done' % self.func)
+        if self._exc_info is not None:
+            six.reraise(*self._exc_info)
+        return self._result
+
+
+class WorkerPool(object):
+    '''
+    A fixed number of daemon threads running submitted functions.
+
+    With max_pending > 0, submit() blocks while that many tasks wait
+    for a worker, which throttles a producer to the workers' pace.
+
+    with WorkerPool(5) as pool:
+        tasks = [pool.submit(func, arg) for arg in args]
+    results = [task.result() for task in tasks]
+    '''
+    def __init__(self, num_workers=constants.DEFAULT_THREAD_NUMBER,
+                 max_pending=0, name='ecstest-worker'):
+        self.num_workers = num_workers
+        self._queue = queue.Queue(max_pending)
+        self._threads = []
+        self._shutdown = False
+        for i in range(num_workers):
+            thread = threading.Thread(target=self._work,
+                                      name='%s-%d' % (name, i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                task.run()
+            finally:
+                self._queue.task_done()
+
+    def submit(self, func, *args, **kwargs):
+        '''Schedule func(*args, **kwargs) and return its Task.'''
+        if self._shutdown:
+            raise Exception('cannot submit to a worker pool shut down')
+        task = Task(func, args, kwargs)
+        self._queue.put(task)
+        return task
+
+    def map(self, func, iterable):
+        '''
+        Run func on every item concurrently and return the results
+        in order. The first exception raised by func is raised.
+        '''
+        tasks = [self.submit(func, item) for item in iterable]
+        return [task.result() for task in tasks]
+
+    def pending(self):
+        '''Return the approximate number of tasks waiting for a worker.'''
+        return self._queue.qsize()
+
+    def join(self):
+        '''Wait until every submitted task is done.'''
+        self._queue.join()
+
+    def shutdown(self, wait=True):
+        '''
+        Stop the workers once the submitted tasks are done.
+        '''
+        if self._shutdown:
+            return
+        self._shutdown = True
+        for _ in self._threads:
+            self._queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()